@@ -0,0 +1,137 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from backend import metrics
+
+
+class BatchStats:
+    """Running counters for the micro-batcher (batch sizes and queue waits)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.max_batch_size = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def record(self, batch_size, waits_ms):
+        with self._lock:
+            self.requests += batch_size
+            self.batches += 1
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self.total_wait_ms += sum(waits_ms)
+            self.max_wait_ms = max(self.max_wait_ms, max(waits_ms))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "mean_queue_wait_ms": self.total_wait_ms / self.requests if self.requests else 0.0,
+                "max_queue_wait_ms": self.max_wait_ms,
+            }
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=32, max_wait_ms=2.0):
+        """
+        run_batch: Callable taking a tensor (batch, seq_len, input_dim) and returning
+                   one result per row, in order.
+        max_batch_size: Upper bound on rows coalesced into one forward pass.
+        max_wait_ms: How long the first request of a batch waits for company.
+
+        Requests are handed to a single worker thread which gathers whatever
+        arrives within the wait window, concatenates it and runs one forward.
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = BatchStats()
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+    @property
+    def enabled(self):
+        return self.max_batch_size > 1
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, x_tensor):
+        """
+        x_tensor: Tensor of shape (n, seq_len, input_dim)
+        Blocks until the batch containing it has run, returns its n results.
+        """
+        if not self.enabled:
+            return self.run_batch(x_tensor)
+
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((x_tensor, time.perf_counter(), future))
+        return future.result()
+
+    def _ensure_worker(self):
+        # The worker is started lazily (and restarted after a fork) because
+        # threads do not survive into child processes.
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._loop, name="evflow-microbatcher", daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            batch = [first]
+            rows = first[0].shape[0]
+            deadline = time.perf_counter() + self.max_wait
+
+            while rows < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += item[0].shape[0]
+
+            self._run(batch)
+
+    def _run(self, batch):
+        started = time.perf_counter()
+        waits_ms = [(started - enqueued) * 1000.0 for _, enqueued, _ in batch]
+        for wait_ms in waits_ms:
+            metrics.STAGE_SECONDS.observe(wait_ms / 1000.0, stage="queue")
+
+        try:
+            x_batch = torch.cat([x for x, _, _ in batch], dim=0)
+            results = self.run_batch(x_batch)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+        else:
+            # Split the flat result list back to each caller
+            offset = 0
+            for x, _, future in batch:
+                n = x.shape[0]
+                future.set_result(results[offset:offset + n])
+                offset += n
+
+        self.stats.record(len(batch), waits_ms)
@@ -0,0 +1,54 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def window_key(x, *extra):
+    """Stable hash of a window (array/tensor) plus any extra request options."""
+    arr = np.ascontiguousarray(np.asarray(x, dtype=np.float32))
+    h = hashlib.sha1(arr.tobytes())
+    h.update(repr((arr.shape,) + extra).encode())
+    return h.hexdigest()
+
+
+class LRUCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
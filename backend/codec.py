@@ -0,0 +1,129 @@
+import struct
+
+import numpy as np
+from fastapi import Request, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+
+try:
+    import msgpack
+except ImportError:  # Optional: only needed for application/msgpack bodies
+    msgpack = None
+
+# Wire formats for /predict, /predict/batch and /explain.
+# JSON stays the default. The binary formats carry one float32 tensor:
+# - F32: little-endian uint32 ndim, ndim x uint32 dims, then the float32 data (little-endian)
+# - MSGPACK: a map {"shape": [...], "data": <float32 little-endian bytes>}
+JSON = 'application/json'
+F32 = 'application/x-evflow-f32'
+MSGPACK = 'application/msgpack'
+BINARY_TYPES = (F32, MSGPACK)
+
+# Response header naming the last axis of a binary response
+COLUMNS_HEADER = 'X-EVFlow-Columns'
+
+
+def _media_type(value):
+    return (value or '').split(';')[0].strip().lower()
+
+
+def content_type(request: Request):
+    return _media_type(request.headers.get('content-type')) or JSON
+
+
+def accepted_binary_type(request: Request):
+    """Binary media type the client asked for in Accept, or None for JSON."""
+    for part in request.headers.get('accept', '').split(','):
+        media_type = _media_type(part)
+        if media_type == F32 or (media_type == MSGPACK and msgpack is not None):
+            return media_type
+    return None
+
+
+def decode_array(body, media_type):
+    if media_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack bodies need the 'msgpack' package installed on the server")
+        try:
+            message = msgpack.unpackb(body)
+            shape = tuple(int(d) for d in message['shape'])
+            data = message['data']
+        except Exception:
+            raise ValueError("msgpack body must be a map with 'shape' and 'data'")
+    else:
+        if len(body) < 4:
+            raise ValueError("Binary body is missing its shape header")
+        (ndim,) = struct.unpack_from('<I', body, 0)
+        header_len = 4 + 4 * ndim
+        if len(body) < header_len:
+            raise ValueError("Binary body is shorter than its shape header")
+        shape = struct.unpack_from(f'<{ndim}I', body, 4)
+        data = memoryview(body)[header_len:]
+
+    expected = int(np.prod(shape, dtype=np.int64)) * 4
+    if len(data) != expected:
+        raise ValueError(f"Body holds {len(data)} data bytes, shape {shape} needs {expected}")
+
+    # Copy once so the array is writable (torch wants that), then one vectorized check
+    arr = np.frombuffer(data, dtype='<f4').reshape(shape).astype(np.float32)
+    if not np.isfinite(arr).all():
+        raise ValueError("Body contains NaN or infinite values")
+    return arr
+
+
+def encode_array(arr, media_type):
+    arr = np.ascontiguousarray(arr, dtype='<f4')
+    if media_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack responses need the 'msgpack' package installed on the server")
+        return msgpack.packb({'shape': list(arr.shape), 'data': arr.tobytes()})
+    header = struct.pack(f'<I{arr.ndim}I', arr.ndim, *arr.shape)
+    return header + arr.tobytes()
+
+
+async def read_array(request: Request, model, field, ndim):
+    """
+    Reads the request body as a float32 array of `ndim` dimensions.
+    Binary bodies are decoded directly; JSON bodies are validated with the
+    pydantic `model` and `field` is taken from it.
+    Returns (array, parsed_model) - parsed_model is None for binary bodies.
+    """
+    body = await request.body()
+    media_type = content_type(request)
+
+    if media_type in BINARY_TYPES:
+        arr = decode_array(body, media_type)
+        if arr.ndim != ndim:
+            raise ValueError(f"Expected a {ndim}-d tensor, got shape {arr.shape}")
+        return arr, None
+
+    try:
+        payload = model.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    try:
+        arr = np.asarray(getattr(payload, field), dtype=np.float32)
+    except ValueError:
+        raise ValueError(f"'{field}' must be a rectangular {ndim}-d array")
+    if arr.ndim != ndim:
+        raise ValueError(f"Expected a {ndim}-d array in '{field}', got shape {arr.shape}")
+    return arr, payload
+
+
+def array_response(arr, media_type, columns=None):
+    headers = {COLUMNS_HEADER: ','.join(columns)} if columns else None
+    return Response(content=encode_array(arr, media_type), media_type=media_type, headers=headers)
+
+
+def request_body(model):
+    """OpenAPI requestBody for endpoints that read the body themselves."""
+    return {
+        'requestBody': {
+            'required': True,
+            'content': {
+                JSON: {'schema': model.model_json_schema()},
+                F32: {'schema': {'type': 'string', 'format': 'binary'}},
+                MSGPACK: {'schema': {'type': 'string', 'format': 'binary'}},
+            },
+        }
+    }
@@ -0,0 +1,225 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import torch
+
+# Set in each pool process by _init_worker
+_explainer = None
+
+
+def _init_worker(model_path, metadata_path, background_path, torch_threads):
+    # Runs once per pool process: its own copy of the model and SHAP explainer
+    global _explainer
+    from ml.model import EVFlowGRU
+    from ml.explainability import EVFlowExplainer
+
+    torch.set_num_threads(torch_threads)
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+
+    model = EVFlowGRU(metadata['input_dim'], metadata['hidden_dim'], metadata['num_layers'], metadata['num_classes'])
+    model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu')))
+    model.eval()
+
+    if os.path.exists(background_path):
+        background = torch.load(background_path, map_location=torch.device('cpu'))
+    else:
+        background = torch.zeros((10, metadata['seq_length'], metadata['input_dim']))
+    _explainer = EVFlowExplainer(model, background)
+
+
+def _explain(windows, heads):
+    # windows: (batch, seq_len, dim) float32 ndarray. Returns (shap values, seconds spent)
+    started = time.perf_counter()
+    shap_vals = _explainer.explain(torch.from_numpy(windows), heads=heads)
+    return shap_vals, time.perf_counter() - started
+
+
+class PoolFull(RuntimeError):
+    """More explanations pending than the pool accepts (the API answers 429)."""
+
+
+class JobTimeout(TimeoutError):
+    """A job did not finish within wait()'s timeout (the API answers 504 with its id to poll)."""
+
+    def __init__(self, job_id, timeout):
+        super().__init__(f"Explain job {job_id} still running after {timeout}s")
+        self.job_id = job_id
+
+
+class ExplainPool:
+    def __init__(self, workers, max_pending, worker_args, job_ttl_s=300.0, local=None):
+        """
+        workers: Processes running SHAP. Each holds its own model and explainer,
+                 so explanations never compete with /predict for the API's threads.
+                 0 runs them in the calling thread with `local` instead.
+        max_pending: Jobs queued or running before submit() raises PoolFull.
+        worker_args: (model_path, metadata_path, background_path, torch_threads)
+        job_ttl_s: How long finished jobs stay retrievable by id.
+        local: Callable (windows, heads) -> (shap values, seconds), for workers=0.
+
+        Processes are spawned, not forked: the parent's torch thread pools do not
+        survive a fork, and the workers load their own copy of the model anyway.
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.worker_args = worker_args
+        self.job_ttl_s = job_ttl_s
+        self.local = local
+        self.executor = self._new_executor() if workers > 0 else None
+
+        self.jobs = {}       # job id -> job dict
+        self.inflight = {}   # window key -> id of the pending job for it
+        # (finished time, job id) in finishing order: expiry pops from the left
+        # instead of scanning every job
+        self.finished = deque()
+        self.pending_count = 0
+        self.lock = threading.Lock()
+        # Only held to replace a broken executor, never while a job runs
+        self.executor_lock = threading.Lock()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=self.worker_args,
+        )
+
+    def _submit(self, windows, heads):
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(self.local(windows, heads))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        executor = self.executor
+        try:
+            return executor.submit(_explain, windows, heads)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): start a fresh pool, once,
+            # even if several callers (jobs, precompute, warm-up) notice together
+            with self.executor_lock:
+                if self.executor is executor:
+                    print("Warning: explain pool was broken, restarting it")
+                    self.executor = self._new_executor()
+                    executor.shutdown(wait=False)
+                executor = self.executor
+            return executor.submit(_explain, windows, heads)
+
+    def pending(self):
+        return self.pending_count
+
+    def run(self, windows, heads):
+        """Blocking explain of a batch, outside the job queue and its limit (precompute, warm-up)."""
+        return self._submit(windows, heads).result()
+
+    def submit(self, key, windows, heads, finish):
+        """
+        Queues an explanation and returns its job id. A window already being
+        explained with the same heads (same key) joins the pending job.
+
+        finish: Called in the parent with the shap values and SHAP seconds, its
+                return value becomes the job's result.
+        """
+        # The slot and the in-flight key are reserved under the lock; the job is
+        # submitted outside it, since with workers=0 submitting runs the whole SHAP
+        # computation. Requests for the same key meanwhile join the reserved job.
+        with self.lock:
+            self._expire()
+            job_id = self.inflight.get(key)
+            if job_id is not None:
+                return job_id
+            if self.pending_count >= self.max_pending:
+                raise PoolFull(f"{self.pending_count} explanations pending, try again later")
+
+            job_id = uuid.uuid4().hex
+            job = {
+                "job_id": job_id, "status": "pending", "created": time.time(), "future": None,
+                "result": None, "error": None, "finished_event": threading.Event(),
+            }
+            self.jobs[job_id] = job
+            self.inflight[key] = job_id
+            self.pending_count += 1
+
+        try:
+            future = self._submit(windows, heads)
+        except Exception as e:
+            # Could not even be queued (e.g. the pool is shutting down): fail the
+            # job, so requests that joined it are not left waiting
+            future = Future()
+            future.set_exception(e)
+        job["future"] = future
+        future.add_done_callback(lambda future: self._done(job, key, future, finish))
+        return job_id
+
+    def add_finished(self, result):
+        """Records an already available result (e.g. a cache hit for /explain/jobs) as a finished job."""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._expire()
+            now = time.time()
+            self.jobs[job_id] = {
+                "job_id": job_id, "status": "done", "created": now, "finished": now,
+                "result": result, "error": None, "future": None, "finished_event": threading.Event(),
+            }
+            self.finished.append((now, job_id))
+            self.jobs[job_id]["finished_event"].set()
+        return job_id
+
+    def _done(self, job, key, future, finish):
+        # Runs on the executor's management thread
+        try:
+            shap_vals, seconds = future.result()
+            job["result"] = finish(shap_vals, seconds)
+            job["status"] = "done"
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = "failed"
+        with self.lock:
+            # Stamped under the lock, so self.finished stays in time order
+            job["finished"] = time.time()
+            self.finished.append((job["finished"], job["job_id"]))
+            self.pending_count -= 1
+            if self.inflight.get(key) == job["job_id"]:
+                del self.inflight[key]
+        job["finished_event"].set()
+
+    def _expire(self):
+        # Caller holds the lock
+        cutoff = time.time() - self.job_ttl_s
+        while self.finished and self.finished[0][0] < cutoff:
+            _, job_id = self.finished.popleft()
+            del self.jobs[job_id]
+
+    def job(self, job_id):
+        """{job_id, status, result, error}; status is pending, running, done or failed."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown or expired explain job: {job_id}")
+        status = job["status"]
+        if status == "pending" and job["future"] is not None and job["future"].running():
+            status = "running"
+        return {"job_id": job_id, "status": status, "result": job["result"], "error": job["error"]}
+
+    def wait(self, job_id, timeout=None):
+        """Blocks until the job has finished, then returns it like job()."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown or expired explain job: {job_id}")
+        # Set by the done callback, after the result has been built
+        if not job["finished_event"].wait(timeout):
+            raise JobTimeout(job_id, timeout)
+        return self.job(job_id)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,14 +1,28 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from fastapi.responses import JSONResponse, Response
+from pydantic import ValidationError
+import asyncio
+import numpy as np
+from typing import Literal, Optional
 import os
 import sys
+import time
 
 # Fix Import path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from backend.schemas import PredictionInput, PredictionOutput, ExplainInput, ExplainOutput, HealthResponse
-from backend.service import ModelService
+from backend.schemas import (
+    PredictionInput, PredictionOutput, BatchPredictionInput, BatchPredictionOutput,
+    ForecastInput, ForecastOutput, FleetForecastOutput, IngestInput, IngestOutput, ExplainInput, ExplainOutput, ExplainJobOutput, HealthResponse
+)
+from backend.service import ModelService, PRECOMPUTE_ENABLED, PRECOMPUTE_DELAY_S
+from backend.explain_pool import PoolFull, JobTimeout
+from backend.precompute import GridScheduler
+from backend import codec
+from backend import metrics
 
 app = FastAPI(title="EV-Flow AI API", description="EV Charging Forecasting & Explainability")
 
@@ -21,44 +35,294 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    # End-to-end latency per route, plus a trace of sampled requests (backend/metrics.py)
+    spans = metrics.start_trace(forced=request.headers.get(metrics.TRACE_HEADER) == "1")
+    start = time.perf_counter()
+    response = await call_next(request)
+    end = time.perf_counter()
+
+    # Route template (/ingest/{station:path}), not the raw path, to keep label cardinality bounded
+    route = request.scope.get("route")
+    route = route.path if route is not None else "unmatched"
+    metrics.REQUEST_SECONDS.observe(end - start, route=route, method=request.method, status=response.status_code)
+    if spans is not None:
+        response.headers[metrics.TRACE_HEADER] = await asyncio.to_thread(
+            metrics.finish_trace, spans, f"{request.method} {route}", start, end
+        )
+    return response
+
 service = ModelService()
+scheduler = GridScheduler(service.refresh_snapshot, delay_s=PRECOMPUTE_DELAY_S)
+
+startup_task = None
+
+async def background_startup():
+    await asyncio.to_thread(service.start_up)
+
+    # Precompute this interval now, then again after every 15-min boundary. With
+    # backend/serve.py's pre-forked workers only worker 0 runs it, so the fleet is
+    # forecast and explained once per boundary rather than once per worker.
+    if PRECOMPUTE_ENABLED and service.ready and os.environ.get('EVFLOW_WORKER_INDEX', '0') == '0':
+        scheduler.start()
 
 @app.on_event("startup")
 async def startup_event():
-    # Pre-load model
-    try:
-        service.load_model()
-    except Exception as e:
-        print(f"Warning: Model not loaded on startup: {e}")
+    # Load and warm up the model in the background, so the server starts
+    # accepting (and answering /livez) right away; see /readyz
+    global startup_task
+    startup_task = asyncio.get_running_loop().create_task(background_startup())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if startup_task is not None:
+        startup_task.cancel()
+    await scheduler.stop()
+    service.shutdown()
+
+def require_model():
+    # Model endpoints answer 503 until the startup task has loaded the model,
+    # instead of making the first request wait for (or retry) the load
+    if not service.model_available():
+        detail = f"Model failed to load: {service.load_error}" if service.status == "failed" else f"Model is {service.status}"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
 
 @app.get("/health", response_model=HealthResponse)
 def health_check():
-    status = "active" if service.model else "loading"
-    return {"status": status, "model_version": "v1.0"}
+    status = "active" if service.ready else service.status
+    return {"status": status, "model_version": service.model_version or "unknown"}
+
+@app.get("/livez")
+def liveness():
+    # Only a failed startup counts as dead, so the orchestrator restarts the process
+    if service.status == "failed":
+        raise HTTPException(status_code=503, detail=f"Model failed to load: {service.load_error}")
+    return {"status": "alive"}
+
+@app.get("/readyz")
+def readiness():
+    # Ready once the model is loaded and has run its warm-up forward pass
+    body = {"status": service.status, "model_version": service.model_version, "error": service.load_error}
+    return JSONResponse(body, status_code=200 if service.ready else 503)
 
-@app.post("/predict", response_model=PredictionOutput)
-def predict(payload: PredictionInput):
+@app.get("/metrics")
+def get_metrics():
+    # Prometheus scrape target: stage histograms, request latency, caches, queue depth, model info
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+def json_response(result):
+    # Serialized here rather than by FastAPI after the handler returns, so the
+    # 'serialize' stage covers it. Results are built from plain Python types.
+    with metrics.stage("serialize"):
+        return JSONResponse(result)
+
+def prediction_response(request, results, single):
+    # JSON by default; packed float32 (energy, port class probabilities) if the client accepts it
+    media_type = codec.accepted_binary_type(request)
+    if media_type is None:
+        return json_response(results[0] if single else {"predictions": results})
+    with metrics.stage("serialize"):
+        arr = np.array([[r["predicted_energy"]] + r["predicted_ports_probs"] for r in results], dtype=np.float32)
+        columns = ["predicted_energy"] + [f"ports_prob_{i}" for i in range(arr.shape[1] - 1)]
+        return codec.array_response(arr, media_type, columns)
+
+@app.post("/predict", response_model=PredictionOutput, openapi_extra=codec.request_body(PredictionInput), dependencies=[Depends(require_model)])
+async def predict(request: Request):
+    # Body: PredictionInput JSON, or a (48, 8) float32 tensor (see backend/codec.py)
+    try:
+        with metrics.stage("validate"):
+            features, _ = await codec.read_array(request, PredictionInput, "features", ndim=2)
+        result = await run_in_threadpool(service.predict, features)
+    except RequestValidationError:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return prediction_response(request, [result], single=True)
+
+@app.post("/predict/batch", response_model=BatchPredictionOutput, openapi_extra=codec.request_body(BatchPredictionInput), dependencies=[Depends(require_model)])
+async def predict_batch(request: Request):
+    # Body: BatchPredictionInput JSON, or a (batch, 48, 8) float32 tensor
+    try:
+        with metrics.stage("validate"):
+            windows, _ = await codec.read_array(request, BatchPredictionInput, "windows", ndim=3)
+        result = await run_in_threadpool(service.predict_batch, windows)
+    except RequestValidationError:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return prediction_response(request, result, single=False)
+
+@app.post("/forecast", response_model=ForecastOutput, dependencies=[Depends(require_model)])
+def forecast(payload: ForecastInput):
+    # Multi-step forecast, rolled forward on the server for all windows at once
     try:
-        result = service.predict(payload.features)
-        return result
+        return service.forecast(payload.windows, payload.last_timestamps, payload.horizon)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/explain", response_model=ExplainOutput)
-def explain(payload: ExplainInput):
+@app.get("/forecast/fleet", response_model=FleetForecastOutput, dependencies=[Depends(require_model)])
+def forecast_fleet():
+    # Every station's next interval from one batched forward
     try:
-        result = service.get_explanation(payload.features)
-        return result
+        return service.forecast_fleet()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/predict/stats")
+def predict_stats():
+    # Micro-batching stats: batch sizes and time spent queued
+    return service.get_batch_stats()
+
+@app.get("/snapshot/stats")
+def snapshot_stats():
+    # Precomputed snapshot: version, age and how often requests were served from it
+    return service.get_snapshot_stats()
+
+@app.get("/explain/stats")
+def explain_stats():
+    # Explanation cache hit rate
+    return service.get_explain_cache_stats()
+
+@app.get("/explain/global")
+def explain_global(head: Literal['energy', 'ports'] = "energy", station: Optional[str] = None):
+    # Mean |attribution| per feature over the processed data, by station, hour and timestep
+    try:
+        return service.get_global_importance(head=head, station=station)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Global importance not built yet, run ml/global_importance.py")
+    except KeyError as e:
+        # A head the job did not compute, or an unknown station
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/ingest/{station:path}", response_model=IngestOutput, dependencies=[Depends(require_model)])
+def ingest(station: str, payload: IngestInput):
+    # Streaming: advance the station's GRU state by one interval
+    try:
+        if payload.reading is not None:
+            history = None
+            if payload.raw_history is not None:
+                history = [(r.timestamp, r.available_ports, r.energy_kwh) for r in payload.raw_history]
+            reading = payload.reading
+            return service.ingest_reading(
+                station, reading.timestamp, reading.available_ports, reading.energy_kwh, history=history
+            )
+        return service.ingest(station, payload.features, history=payload.history)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def read_explain_request(request):
+    # Body: ExplainInput JSON, or a (48, 8) float32 tensor with the other ExplainInput
+    # fields as query parameters (?heads=energy&heads=ports&method=gradient_input&compact=true)
+    with metrics.stage("validate"):
+        features, payload = await codec.read_array(request, ExplainInput, "features", ndim=2)
+        if payload is None:
+            params = request.query_params
+            try:
+                payload = ExplainInput.model_validate({
+                    "features": [],
+                    "heads": params.getlist("heads") or ["energy"],
+                    **{name: params[name] for name in ("method", "steps", "compact", "top_k") if name in params},
+                })
+            except ValidationError as e:
+                raise RequestValidationError(e.errors())
+    options = {"method": payload.method, "steps": payload.steps, "compact": payload.compact, "top_k": payload.top_k}
+    return features, payload.heads, options
+
+def explain_busy(e):
+    # Back-pressure from the explain pool: the client should retry shortly
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+def explain_timeout(e):
+    # Still running after EVFLOW_EXPLAIN_TIMEOUT_S: the client can poll the job instead
+    return HTTPException(
+        status_code=504,
+        detail={"message": str(e), "job_id": e.job_id},
+        headers={"Location": f"/explain/jobs/{e.job_id}"},
+    )
+
+@app.post("/explain", response_model=ExplainOutput, openapi_extra=codec.request_body(ExplainInput), dependencies=[Depends(require_model)])
+async def explain(request: Request):
+    # Synchronous wrapper around the explain pool (see /explain/jobs)
+    try:
+        features, heads, options = await read_explain_request(request)
+        result = await run_in_threadpool(service.get_explanation, features, heads, **options)
+    except RequestValidationError:
+        raise
+    except PoolFull as e:
+        raise explain_busy(e)
+    except JobTimeout as e:
+        raise explain_timeout(e)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    media_type = codec.accepted_binary_type(request)
+    if media_type is None or options["compact"]:
+        # Compact results are small dicts, always JSON
+        return json_response(result)
+
+    # Packed (48, 8, outputs): energy first (if requested), then one column per port class
+    with metrics.stage("serialize"):
+        parts, columns = [], []
+        if result["shap_values"] is not None:
+            parts.append(np.asarray(result["shap_values"], dtype=np.float32))
+            columns.append("energy")
+        if result["ports_shap_values"] is not None:
+            ports = np.asarray(result["ports_shap_values"], dtype=np.float32)
+            parts.append(ports)
+            columns += [f"ports_{i}" for i in range(ports.shape[-1])]
+        return codec.array_response(np.concatenate(parts, axis=-1), media_type, columns)
+
+@app.post("/explain/jobs", status_code=202, response_model=ExplainJobOutput, openapi_extra=codec.request_body(ExplainInput), dependencies=[Depends(require_model)])
+async def submit_explain_job(request: Request):
+    # Queues the explanation and returns at once; poll GET /explain/jobs/{job_id}
+    try:
+        features, heads, options = await read_explain_request(request)
+        return await run_in_threadpool(service.submit_explanation, features, heads, **options)
+    except RequestValidationError:
+        raise
+    except PoolFull as e:
+        raise explain_busy(e)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/explain/jobs/{job_id}", response_model=ExplainJobOutput)
+def get_explain_job(job_id: str):
+    # Finished jobs are kept for EVFLOW_EXPLAIN_JOB_TTL_S seconds
+    try:
+        return service.get_explanation_job(job_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
 @app.get("/sample")
-def get_sample():
+def get_sample(station: Optional[str] = None, timestamp: Optional[str] = None):
     try:
-        result = service.get_sample_data()
-        return {"features": result}
+        # {"features": (48, 8) window, "station": name, "timestamp": last interval}
+        return service.get_sample_data(station=station, timestamp=timestamp)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except (LookupError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Multi-worker launcher (EVFLOW_WORKERS, EVFLOW_TORCH_THREADS), see backend/serve.py
+    from backend.serve import serve
+    serve(app)
@@ -0,0 +1,252 @@
+import bisect
+import contextvars
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus metrics for GET /metrics, in the text exposition format (0.0.4),
+# kept dependency-free rather than pulling in prometheus_client.
+#
+# Every worker process (EVFLOW_WORKERS > 1) keeps its own registry, so a scrape
+# reports the worker that happened to accept it.
+
+# Sampled request traces: a Chrome trace-event JSON of the request's stages
+# (open in chrome://tracing or ui.perfetto.dev). With EVFLOW_TRACE_HEADER=1 a
+# request can also ask for one with the `X-EVFlow-Trace: 1` header; the response
+# header names the file. Off by default: the API is unauthenticated, and every
+# forced trace is a file on disk. Only the newest TRACE_MAX_FILES are kept.
+TRACE_SAMPLE_RATE = float(os.environ.get('EVFLOW_TRACE_SAMPLE_RATE', 0.0))
+TRACE_HEADER_ENABLED = os.environ.get('EVFLOW_TRACE_HEADER', '0') == '1'
+TRACE_DIR = os.environ.get('EVFLOW_TRACE_DIR', 'traces')
+TRACE_MAX_FILES = int(os.environ.get('EVFLOW_TRACE_MAX_FILES', 100))
+TRACE_HEADER = 'X-EVFlow-Trace'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds. Stages range from tens of microseconds (tensor construction) to seconds (SHAP).
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}     # Label values tuple -> value
+        self._functions = {}  # Label values tuple -> callable, read at scrape time
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, fn, **labels):
+        """Reports fn() for these labels at every scrape (stats kept elsewhere)."""
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def samples(self):
+        # [(suffix, [(label, value)], value)]
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        return [('', list(zip(self.labelnames, key)), value) for key, value in sorted(values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        samples = []
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                samples.append(('_bucket', labels + [('le', _format_value(bound))], cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    'evflow_stage_seconds',
+    'Time spent in each hot-path stage (validate, tensor, queue, batch, forward, postprocess, shap, attribution, explain_wait, serialize).',
+    ['stage']
+)
+REQUEST_SECONDS = Histogram(
+    'evflow_request_seconds',
+    'End-to-end request latency by route, method and status code.',
+    ['route', 'method', 'status']
+)
+MODEL_LOAD_SECONDS = Gauge('evflow_model_load_seconds', 'Time the last model load took.')
+WARMUP_SECONDS = Gauge('evflow_warmup_seconds', 'Time the startup warm-up took.')
+MODEL_INFO = Gauge('evflow_model_info', 'Loaded model version (hash of model.pth) and inference backend.', ['version', 'backend'])
+CACHE_HITS = Counter('evflow_cache_hits_total', 'Cache lookups that hit.', ['cache'])
+CACHE_MISSES = Counter('evflow_cache_misses_total', 'Cache lookups that missed.', ['cache'])
+CACHE_HIT_RATIO = Gauge('evflow_cache_hit_ratio', 'Hits / lookups since startup.', ['cache'])
+QUEUE_DEPTH = Gauge('evflow_queue_depth', 'Requests waiting in a queue.', ['queue'])
+BATCHES = Counter('evflow_batches_total', 'Forward passes run by the micro-batcher.')
+BATCHED_REQUESTS = Counter('evflow_batched_requests_total', 'Requests served by the micro-batcher.')
+
+# Spans of the current request, when it is being traced
+_trace = contextvars.ContextVar('evflow_trace', default=None)
+_trace_count = itertools.count(1)
+
+
+@contextmanager
+def stage(name):
+    """Times a block into evflow_stage_seconds{stage=name} (and the trace, if sampled)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        STAGE_SECONDS.observe(end - start, stage=name)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append((name, start, end, threading.get_ident()))
+
+
+def start_trace(forced=False):
+    """
+    Starts collecting spans for this request if it is sampled, or forced by the
+    trace header (when EVFLOW_TRACE_HEADER=1). Returns the span list or None.
+    """
+    forced = forced and TRACE_HEADER_ENABLED
+    if not forced and not (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE):
+        return None
+    spans = []
+    _trace.set(spans)
+    return spans
+
+
+def finish_trace(spans, name, start, end):
+    """
+    Writes the request and its stage spans as a Chrome trace and drops the oldest
+    traces beyond TRACE_MAX_FILES. Returns the file path. Blocking file I/O: the
+    API calls it in a thread, off the event loop.
+    """
+    pid = os.getpid()
+    events = [{"name": name, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6, "pid": pid, "tid": 0}]
+    events += [
+        {"name": span, "ph": "X", "ts": s * 1e6, "dur": (e - s) * 1e6, "pid": pid, "tid": tid}
+        for span, s, e, tid in spans
+    ]
+
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    path = os.path.join(TRACE_DIR, f"trace-{int(time.time() * 1000)}-{pid}-{next(_trace_count)}.json")
+    with open(path, 'w') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    _prune_traces()
+    return path
+
+
+def _prune_traces():
+    # Shared by all workers, so another one may remove a file first
+    traces = []
+    for entry in os.scandir(TRACE_DIR):
+        if entry.name.startswith('trace-') and entry.name.endswith('.json'):
+            try:
+                traces.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    traces.sort()
+    for _, path in traces[:max(len(traces) - TRACE_MAX_FILES, 0)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from ml.features import INTERVAL
+
+
+def next_grid_boundary(now):
+    """Unix time of the next 15-min grid boundary after `now`."""
+    step = INTERVAL / np.timedelta64(1, 's')
+    return (np.floor(now / step) + 1) * step
+
+
+def format_time(unix_time):
+    return str(np.datetime64(int(unix_time), 's'))
+
+
+class SnapshotStore:
+    def __init__(self):
+        """
+        Holds the latest precomputed snapshot: predictions and explanations keyed
+        by window_key of the window they were computed for, plus the fleet forecast.
+
+        Entries are keyed by the window's content, so a lookup can only ever return
+        the result for exactly that window; a stale snapshot just stops matching.
+        Publishing swaps the whole snapshot at once, readers never see a partial one.
+        """
+        self._snapshot = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def current(self):
+        return self._snapshot
+
+    def publish(self, predictions, explanations, fleet, valid_until):
+        with self._lock:
+            self._version += 1
+            self._snapshot = {
+                "version": self._version,
+                "generated_at": time.time(),
+                "valid_until": valid_until,
+                "predictions": predictions,
+                "explanations": explanations,
+                "fleet": fleet,
+            }
+            return self._version
+
+    def _lookup(self, table, key):
+        snapshot = self._snapshot
+        result = snapshot[table].get(key) if snapshot is not None else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def prediction(self, key):
+        return self._lookup("predictions", key)
+
+    def explanation(self, key):
+        return self._lookup("explanations", key)
+
+    def stats(self):
+        snapshot = self._snapshot
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                "version": snapshot["version"] if snapshot else 0,
+                "generated_at": format_time(snapshot["generated_at"]) if snapshot else None,
+                "valid_until": format_time(snapshot["valid_until"]) if snapshot else None,
+                "predictions": len(snapshot["predictions"]) if snapshot else 0,
+                "explanations": len(snapshot["explanations"]) if snapshot else 0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+        return stats
+
+
+class GridScheduler:
+    def __init__(self, job, delay_s=0.0):
+        """
+        job: Blocking callable, run in a worker thread once at start and then
+             right after every 15-min grid boundary.
+        delay_s: Seconds to wait past each boundary (lets readings for the new
+                 interval arrive first).
+        """
+        self.job = job
+        self.delay_s = delay_s
+        self.task = None
+
+    def start(self):
+        # Must be called from the running event loop (the FastAPI startup hook)
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.job)
+            except Exception as e:
+                # Keep the schedule: the next boundary gets another try
+                print(f"Warning: precompute failed: {e}")
+            now = time.time()
+            await asyncio.sleep(next_grid_boundary(now) - now + self.delay_s)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Dict, Any, Optional, Literal
 
 class PredictionInput(BaseModel):
     # A list of 48 timesteps, each having 8 features
@@ -10,18 +10,103 @@ class PredictionOutput(BaseModel):
     predicted_energy: float
     predicted_ports_class: int
     predicted_ports_probs: List[float] # Probabilities for each class
+
+class ForecastInput(BaseModel):
+    # A batch of (48, 8) windows, scaled like /predict
+    windows: List[List[List[float]]]
+    # Timestamp of the last row of each window (ISO format), used to derive calendar features
+    last_timestamps: List[str]
+    # Number of 15-min steps to forecast
+    horizon: int = 4
+
+class ForecastOutput(BaseModel):
+    # All fields are (windows, horizon[, classes])
+    timestamps: List[List[str]]
+    predicted_energy: List[List[float]]
+    predicted_ports_class: List[List[int]]
+    predicted_ports_probs: List[List[List[float]]]
+
+class RawReading(BaseModel):
+    # Raw station reading; the server derives the scaled feature row from it
+    timestamp: str # ISO format, floored to its 15-min interval
+    available_ports: float
+    energy_kwh: float # Energy delivered during the interval
+
+class FleetStationForecast(PredictionOutput):
+    station: str
+    window_end: Optional[str] = None # Timestamp of the window's last row, if known
+    source: Literal['stream', 'processed'] # Live /ingest stream or the processed data store
+
+class FleetForecastOutput(BaseModel):
+    generated_at: str
+    valid_until: str # Next 15-min boundary (UTC); the forecast is cached until then
+    stations: List[FleetStationForecast]
+    missing: List[str] # Stations without a complete 48-step window
+
+class IngestInput(BaseModel):
+    # One new timestep for the station: either 8 features scaled like /predict...
+    features: Optional[List[float]] = None
+    # Optional (<=48, 8) history to (re)seed the station's stream
+    history: Optional[List[List[float]]] = None
+    # ...or one raw reading, preprocessed on the server
+    reading: Optional[RawReading] = None
+    # Optional raw readings (oldest first) to (re)seed the station
+    raw_history: Optional[List[RawReading]] = None
+
+    @model_validator(mode='after')
+    def one_kind_of_row(self):
+        if (self.features is None) == (self.reading is None):
+            raise ValueError("Send either 'features' or 'reading'")
+        if self.features is not None and self.raw_history is not None:
+            raise ValueError("'raw_history' goes with 'reading'; use 'history' with 'features'")
+        if self.reading is not None and self.history is not None:
+            raise ValueError("'history' goes with 'features'; use 'raw_history' with 'reading'")
+        return self
+
+class IngestOutput(PredictionOutput):
+    resynced: bool # True if the full window was replayed for this update
+    steps_since_sync: int
+
+class BatchPredictionInput(BaseModel):
+    # A batch of windows, each (48, 8)
+    windows: List[List[List[float]]]
+
+class BatchPredictionOutput(BaseModel):
+    predictions: List[PredictionOutput]
     
 class ExplainInput(BaseModel):
     features: List[List[float]]
+    # Which model outputs to explain: 'energy' and/or 'ports'
+    heads: List[Literal['energy', 'ports']] = Field(['energy'], min_length=1)
+    # 'shap' (sampled, slow), or single-pass gradient attributions
+    method: Literal['shap', 'integrated_gradients', 'gradient_input'] = 'shap'
+    steps: Optional[int] = None # Integrated gradients steps, default EVFLOW_IG_STEPS
+    # Per-feature totals and the top_k cells instead of the full matrices
+    compact: bool = False
+    top_k: Optional[int] = None # Default EVFLOW_EXPLAIN_TOP_K
 
 class ExplainOutput(BaseModel):
-    shap_values: List[List[List[float]]] # (Features, SeqLen, InputDim) ... complex shape, maybe flattened or simplified
+    shap_values: Optional[List[List[List[float]]]] = None # (Features, SeqLen, InputDim) ... complex shape, maybe flattened or simplified
     # SHAP for GRU is (OutputDim, SeqLen, FeatDim).
     # We might just return a summary or the full tensor.
     # Let's return a simplified structure: feature_importance per feature (summed over time?)
     # or just the raw values.
+    ports_shap_values: Optional[List[List[List[float]]]] = None # (SeqLen, InputDim, Classes), only if 'ports' was requested
     feature_names: List[str]
+    # Largest |SHAP| cells of the energy explanation (step 0 = last row of the window)
+    top_contributions: Optional[List[Dict[str, Any]]] = None
+    method: str = 'shap'
+    # Compact responses only: sum of |attribution| over the window, per feature
+    feature_importance: Optional[Dict[str, float]] = None
+    ports_feature_importance: Optional[Dict[str, List[float]]] = None # One value per port class
     
+class ExplainJobOutput(BaseModel):
+    job_id: str
+    # pending, running, done or failed
+    status: str
+    result: Optional[ExplainOutput] = None # Set once status is 'done'
+    error: Optional[str] = None
+
 class HealthResponse(BaseModel):
     status: str
     model_version: str
@@ -0,0 +1,174 @@
+"""
+Production launcher for the API.
+
+    python backend/serve.py        (or python backend/main.py)
+
+EVFLOW_WORKERS > 1 pre-forks that many uvicorn workers, all accepting on one
+shared listening socket. The model, scaler, SHAP background and window store
+are loaded once in the parent before forking, so the workers share those pages
+copy-on-write instead of each loading its own copy.
+
+For auto-reload during development use `uvicorn backend.main:app --reload`.
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import torch
+import uvicorn
+
+# Fix Import path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend.service import ModelService, EXPLAIN_WORKERS
+
+HOST = os.environ.get('EVFLOW_HOST', '0.0.0.0')
+PORT = int(os.environ.get('EVFLOW_PORT', 8000))
+WORKERS = int(os.environ.get('EVFLOW_WORKERS', 1))
+
+# Per-worker torch thread pools. Intra-op threads default to cores / workers so
+# the workers together use every core once instead of each grabbing all of them.
+TORCH_THREADS = int(os.environ.get('EVFLOW_TORCH_THREADS', 0)) # 0 = cpu_count // workers
+TORCH_INTEROP_THREADS = int(os.environ.get('EVFLOW_TORCH_INTEROP_THREADS', 1))
+
+# Restarting dead workers: the delay doubles with each early exit in a row (up to
+# RESTART_MAX_DELAY_S), and the server gives up after MAX_RESTARTS of them, so a
+# worker that cannot start (bad artifact, import error) is not forked in a tight loop.
+# A worker that ran for STABLE_AFTER_S seconds starts counting again from zero.
+RESTART_DELAY_S = float(os.environ.get('EVFLOW_RESTART_DELAY_S', 1.0))
+RESTART_MAX_DELAY_S = 30.0
+MAX_RESTARTS = int(os.environ.get('EVFLOW_MAX_RESTARTS', 5))
+STABLE_AFTER_S = 60.0
+
+def configure_threads(workers):
+    threads = TORCH_THREADS or max(1, (os.cpu_count() or 1) // workers)
+    torch.set_num_threads(threads)
+    # Only settable before any inter-op work has started, hence before preload
+    try:
+        torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+    except RuntimeError as e:
+        print(f"Warning: interop threads left at {torch.get_num_interop_threads()}: {e}")
+    return threads
+
+def preload(service):
+    """Loads everything the workers would otherwise each load on their own."""
+    service.load_model()
+
+    # Weights in shared memory: every worker maps the same pages
+    service.model.share_memory()
+    if service.runtime is not service.model:
+        try:
+            service.runtime.share_memory()
+        except Exception as e:
+            print(f"Warning: inference runtime stays copy-on-write: {e}")
+
+    # The explainer's background (gradient attributions run in the API process)
+    # and the memory-mapped sample windows. SHAP itself runs in the spawned explain
+    # pool by default, so shap is only imported here, and its modules shared with
+    # every worker, when EVFLOW_EXPLAIN_WORKERS=0 explains in the API process.
+    # No forward / explain runs before the fork: each worker warms up on its own.
+    try:
+        service._get_explainer()
+        if EXPLAIN_WORKERS == 0:
+            import shap  # noqa: F401
+    except Exception as e:
+        print(f"Warning: explainer not preloaded: {e}")
+    try:
+        service._get_window_store()
+    except FileNotFoundError:
+        pass
+
+    # Objects allocated so far are never collected, so the workers' garbage
+    # collector does not write to (and un-share) their pages
+    gc.freeze()
+
+def serve(app, host=HOST, port=PORT, workers=WORKERS):
+    threads = configure_threads(workers)
+    preload(ModelService())
+
+    if workers <= 1 or not hasattr(os, 'fork'):
+        # Windows has no fork(): single process
+        print(f"Serving on {host}:{port} (1 worker, {threads} torch threads)")
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    print(f"Serving on {host}:{port} ({workers} workers, {threads} torch threads each)")
+    children = {}
+    started = {}
+    failures = {worker_id: 0 for worker_id in range(workers)}
+    stopping = False
+    gave_up = False
+
+    def spawn(worker_id):
+        started[worker_id] = time.time()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            # Read by the startup hook: only worker 0 runs the precompute scheduler
+            os.environ['EVFLOW_WORKER_INDEX'] = str(worker_id)
+            torch.set_num_threads(threads)
+            server = uvicorn.Server(uvicorn.Config(app, host=host, port=port))
+            try:
+                server.run(sockets=[sock])
+            finally:
+                os._exit(0)
+        children[pid] = worker_id
+
+    def stop(signum=None, frame=None):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Supervise: restart workers that die, until we are asked to stop
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = children.pop(pid, None)
+        if worker_id is None or stopping:
+            continue
+
+        if time.time() - started[worker_id] < STABLE_AFTER_S:
+            failures[worker_id] += 1
+        else:
+            failures[worker_id] = 1
+        if failures[worker_id] > MAX_RESTARTS:
+            print(f"Error: worker {worker_id} exited {failures[worker_id]} times in a row (last status {status}), shutting down")
+            gave_up = True
+            stop()
+            continue
+
+        delay = min(RESTART_MAX_DELAY_S, RESTART_DELAY_S * 2 ** (failures[worker_id] - 1))
+        print(f"Worker {worker_id} (pid {pid}) exited with status {status}, restarting in {delay:.1f}s")
+        time.sleep(delay)
+        if not stopping:
+            spawn(worker_id)
+
+    sock.close()
+    if gave_up:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    from backend.main import app
+    serve(app)
@@ -1,20 +1,93 @@
 import torch
 import numpy as np
-import pandas as pd
 import pickle
 import os
 import sys
+import threading
+import time
 
 # Add project root to sys path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from ml.model import EVFlowGRU
-from ml.explainability import EVFlowExplainer
+from ml.explainability import EVFlowExplainer, top_contributions, feature_importance
+from ml.features import FeatureScaler, AVAILABLE_PORTS, ENERGY
+from ml.forecast import rollout
+from ml.preprocessor import InferencePreprocessor, MAX_ROLL
+from backend.batching import MicroBatcher
+from backend.window_store import WindowStore
+from backend.streaming import StationStream
+from backend.cache import LRUCache, window_key
+from backend.explain_pool import ExplainPool
+from backend.precompute import SnapshotStore, next_grid_boundary, format_time
+from backend import metrics
 
 MODEL_PATH = r'e:\EVFlow AI\ml\model.pth'
 SCALER_PATH = r'e:\EVFlow AI\data\processed\scaler.pkl'
 ENCODER_PATH = r'e:\EVFlow AI\data\processed\encoders.pkl'
 METADATA_PATH = r'e:\EVFlow AI\ml\metadata.json'
+PROCESSED_STORE_PATH = r'e:\EVFlow AI\data\processed\store'
+BACKGROUND_PATH = r'e:\EVFlow AI\ml\background.pt'
+TORCHSCRIPT_PATH = r'e:\EVFlow AI\ml\model_ts.pt'
+QUANTIZED_PATH = r'e:\EVFlow AI\ml\model_int8.pt'
+GLOBAL_IMPORTANCE_PATH = r'e:\EVFlow AI\ml\global_importance.json' # Written by ml/global_importance.py
+
+# Inference backend for /predict, /predict/batch and /forecast, chosen at startup:
+# 'eager' (model.pth), 'torchscript' or 'int8' (artifacts written by ml/export.py)
+INFERENCE_BACKEND = os.environ.get('EVFLOW_INFERENCE_BACKEND', 'eager')
+
+# Micro-batching: concurrent /predict calls are coalesced into one forward pass.
+# Set EVFLOW_MAX_BATCH_SIZE=1 to disable.
+MAX_BATCH_SIZE = int(os.environ.get('EVFLOW_MAX_BATCH_SIZE', 32))
+MAX_BATCH_WAIT_MS = float(os.environ.get('EVFLOW_MAX_BATCH_WAIT_MS', 2.0))
+
+# Streaming (/ingest): replay the full window at least every N stepped updates,
+# and more often while the stepped energy forecast drifts by more than the tolerance (kWh).
+STREAM_RESYNC_EVERY = int(os.environ.get('EVFLOW_STREAM_RESYNC_EVERY', 16))
+STREAM_DRIFT_TOLERANCE = float(os.environ.get('EVFLOW_STREAM_DRIFT_TOLERANCE', 0.05))
+
+# Longest /forecast horizon accepted, in 15-min steps (96 = 24 hours)
+MAX_FORECAST_HORIZON = int(os.environ.get('EVFLOW_MAX_FORECAST_HORIZON', 96))
+
+# Number of explanations kept in the LRU cache (keyed by a hash of the window)
+EXPLAIN_CACHE_SIZE = int(os.environ.get('EVFLOW_EXPLAIN_CACHE_SIZE', 256))
+
+# SHAP runs in a pool of separate processes (backend/explain_pool.py), each with its
+# own model copy, so explanations do not take threads or cores from /predict.
+# Per API worker. EVFLOW_EXPLAIN_WORKERS=0 explains in-process instead.
+EXPLAIN_WORKERS = int(os.environ.get('EVFLOW_EXPLAIN_WORKERS', 1))
+EXPLAIN_WORKER_THREADS = int(os.environ.get('EVFLOW_EXPLAIN_WORKER_THREADS', 1))
+# Explanations queued or running before /explain and /explain/jobs answer 429
+EXPLAIN_MAX_PENDING = int(os.environ.get('EVFLOW_EXPLAIN_MAX_PENDING', 16))
+EXPLAIN_JOB_TTL_S = float(os.environ.get('EVFLOW_EXPLAIN_JOB_TTL_S', 300.0))
+EXPLAIN_TIMEOUT_S = float(os.environ.get('EVFLOW_EXPLAIN_TIMEOUT_S', 120.0)) # Synchronous /explain
+
+# Largest |SHAP| (timestep, feature) cells summarized in every explanation
+EXPLAIN_TOP_K = int(os.environ.get('EVFLOW_EXPLAIN_TOP_K', 5))
+
+# Gradient attribution methods (method='integrated_gradients' / 'gradient_input'):
+# one batched backward pass, computed in the request thread rather than the explain pool.
+# Default and largest number of interpolation steps for integrated gradients.
+IG_STEPS = int(os.environ.get('EVFLOW_IG_STEPS', 32))
+IG_MAX_STEPS = int(os.environ.get('EVFLOW_IG_MAX_STEPS', 256))
+
+# Background precompute (backend/precompute.py): forecasts and explanations for all
+# active stations, refreshed right after every 15-min boundary. Set EVFLOW_PRECOMPUTE=0 to disable.
+PRECOMPUTE_ENABLED = os.environ.get('EVFLOW_PRECOMPUTE', '1') == '1'
+PRECOMPUTE_DELAY_S = float(os.environ.get('EVFLOW_PRECOMPUTE_DELAY_S', 0.0))
+
+# Startup warm-up before /readyz reports ready: a forward pass at batch size 1 and
+# MAX_BATCH_SIZE, plus (EVFLOW_WARMUP_EXPLAIN=1) one SHAP explanation of each head,
+# which also pays for importing shap.
+WARMUP_EXPLAIN = os.environ.get('EVFLOW_WARMUP_EXPLAIN', '0') == '1'
+
+FEATURE_NAMES = [
+    'Available Ports', 'Energy', 'Hour', 'DayOfWeek', 'Month', 
+    'IsWeekend', 'Energy_Roll_3', 'Energy_Roll_6'
+]
+
+class ModelNotReady(RuntimeError):
+    """The startup task is still loading the model, or failed to (the API answers 503)."""
 
 class ModelService:
     _instance = None
@@ -23,16 +96,104 @@ class ModelService:
         if cls._instance is None:
             cls._instance = super(ModelService, cls).__new__(cls)
             cls._instance.model = None
+            cls._instance.runtime = None
             cls._instance.scaler = None
+            cls._instance.feature_scaler = None
+            cls._instance.preprocessor = None
             cls._instance.explainer = None
             cls._instance.metadata = None
+            cls._instance.window_store = None
+            cls._instance.window_store_lock = threading.Lock()
+            cls._instance.explain_cache = LRUCache(EXPLAIN_CACHE_SIZE)
+            cls._instance.streams = {}
+            cls._instance.streams_lock = threading.Lock()
+            cls._instance.station_names = None
+            cls._instance.station_set = None
+            cls._instance.fleet_cache = None
+            cls._instance.fleet_lock = threading.Lock()
+            cls._instance.snapshots = SnapshotStore()
+            cls._instance.batcher = MicroBatcher(
+                cls._instance._forward,
+                max_batch_size=MAX_BATCH_SIZE,
+                max_wait_ms=MAX_BATCH_WAIT_MS
+            )
+            cls._instance.explain_pool = None
+            cls._instance.explain_pool_pid = None
+            cls._instance.explain_pool_lock = threading.Lock()
+            cls._instance.model_version = None
+            cls._instance.global_importance = None # (mtime, summary)
+            cls._instance.load_lock = threading.Lock()
+            # idle -> loading -> warming -> ready, or failed (see start_up)
+            cls._instance.status = "idle"
+            cls._instance.load_error = None
+            cls._instance._register_metrics()
         return cls._instance
+
+    def _register_metrics(self):
+        # Read from the existing stats objects at scrape time
+        for name, stats in (("explain", self.explain_cache.stats), ("snapshot", self.snapshots.stats)):
+            metrics.CACHE_HITS.set_function(lambda stats=stats: stats()["hits"], cache=name)
+            metrics.CACHE_MISSES.set_function(lambda stats=stats: stats()["misses"], cache=name)
+            metrics.CACHE_HIT_RATIO.set_function(lambda stats=stats: stats()["hit_rate"], cache=name)
+        metrics.QUEUE_DEPTH.set_function(self.batcher.queue_depth, queue="microbatch")
+        metrics.QUEUE_DEPTH.set_function(lambda: self.explain_pool.pending() if self.explain_pool else 0, queue="explain")
+        metrics.BATCHES.set_function(lambda: self.batcher.stats.batches)
+        metrics.BATCHED_REQUESTS.set_function(lambda: self.batcher.stats.requests)
         
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def start_up(self, warm_up_explain=WARMUP_EXPLAIN):
+        """
+        Loads the artifacts and warms up. Run in the background by the API's
+        startup hook, so the server accepts connections (/livez) right away and
+        /readyz flips once the first real request would no longer pay cold-start costs.
+        """
+        try:
+            self.status = "loading"
+            self.load_model()
+            self.status = "warming"
+            self.warm_up(explain=warm_up_explain)
+            self.status = "ready"
+        except Exception as e:
+            self.load_error = str(e)
+            self.status = "failed"
+            print(f"Error: model startup failed: {e}")
+
+    def warm_up(self, explain=False):
+        # First calls pay for allocator growth and kernel selection per batch shape
+        started = time.perf_counter()
+        seq_length, input_dim = self.metadata['seq_length'], self.metadata['input_dim']
+        with torch.no_grad():
+            for batch_size in sorted({1, max(MAX_BATCH_SIZE, 1)}):
+                self.runtime(torch.zeros((batch_size, seq_length, input_dim)))
+        if explain:
+            # Starts an explain pool process and builds its explainers
+            self._get_explain_pool().run(np.zeros((1, seq_length, input_dim), dtype=np.float32), ('energy', 'ports'))
+
+        warm_up_seconds = time.perf_counter() - started
+        metrics.WARMUP_SECONDS.set(warm_up_seconds)
+        print(f"Warm-up done in {warm_up_seconds:.2f}s{' (with explain)' if explain else ''}.")
+
+    def model_available(self):
+        # Without the startup task (scripts, benchmarks) the model still loads on first use
+        return self.model is not None or self.status == "idle"
+
+    def _ensure_model(self):
+        if self.model is None:
+            if not self.model_available():
+                raise ModelNotReady(self.load_error or f"Model is {self.status}")
+            self.load_model()
+
     def load_model(self):
-        if self.model is not None:
-            return
+        with self.load_lock:
+            if self.model is None:
+                self._load_model()
 
+    def _load_model(self):
         print("Loading model artifacts...")
+        started = time.perf_counter()
         
         # Load Metadata (to know dims)
         import json
@@ -45,15 +206,43 @@ class ModelService:
         num_classes = self.metadata['num_classes']
         
         # Load Model
-        self.model = EVFlowGRU(input_dim, hidden_dim, num_layers, num_classes)
-        self.model.load_state_dict(torch.load(MODEL_PATH, map_location=torch.device('cpu')))
-        self.model.eval()
+        model = EVFlowGRU(input_dim, hidden_dim, num_layers, num_classes)
+        model.load_state_dict(torch.load(MODEL_PATH, map_location=torch.device('cpu')))
+        model.eval()
+        
+        # The eager model is always kept: SHAP and streaming need gradients / carried state
+        self.runtime = self._load_runtime(model)
         
         # Load Scaler
         with open(SCALER_PATH, 'rb') as f:
             self.scaler = pickle.load(f)
-            
-        print("Model loaded successfully.")
+        self.feature_scaler = FeatureScaler(self.scaler)
+        self.preprocessor = InferencePreprocessor(self.scaler, seq_length=self.metadata['seq_length'])
+        
+        # Reported by /health and /metrics: first 12 hex digits of model.pth's SHA-1
+        import hashlib
+        with open(MODEL_PATH, 'rb') as f:
+            self.model_version = hashlib.sha1(f.read()).hexdigest()[:12]
+        
+        # Set last: `self.model` is what callers check to see if loading is done
+        self.model = model
+        
+        load_seconds = time.perf_counter() - started
+        metrics.MODEL_LOAD_SECONDS.set(load_seconds)
+        metrics.MODEL_INFO.set(1, version=self.model_version, backend=INFERENCE_BACKEND)
+        print(f"Model {self.model_version} loaded successfully ({INFERENCE_BACKEND} backend) in {load_seconds:.2f}s.")
+
+    def _load_runtime(self, model):
+        if INFERENCE_BACKEND == 'eager':
+            return model
+
+        paths = {'torchscript': TORCHSCRIPT_PATH, 'int8': QUANTIZED_PATH}
+        if INFERENCE_BACKEND not in paths:
+            raise ValueError(f"Unknown EVFLOW_INFERENCE_BACKEND '{INFERENCE_BACKEND}', expected eager, torchscript or int8")
+
+        runtime = torch.jit.load(paths[INFERENCE_BACKEND], map_location=torch.device('cpu'))
+        runtime.eval()
+        return runtime
         
     def preprocess_input(self, features_list):
         # features_list: List[List[float]] (48 steps, 8 features)
@@ -76,74 +265,549 @@ class ModelService:
         # requires moving `process_data.py` logic into a reusable class (`preprocessor.py`).
         # Given time constraints, I will assume INPUT IS PRE-SCALED (i.e. drawn from processed_data.csv by the UI).
         
-        return torch.tensor([features_list], dtype=torch.float32)
+        # features_list may also be a float32 ndarray decoded from a binary body
+        with metrics.stage("tensor"):
+            x_tensor = torch.as_tensor(np.asarray(features_list, dtype=np.float32)).unsqueeze(0)
+        self._check_shape(x_tensor)
+        return x_tensor
 
-    def predict(self, features):
-        if not self.model:
-            self.load_model()
-            
-        x_tensor = self.preprocess_input(features)
-        
-        with torch.no_grad():
-            e_pred, p_logits = self.model(x_tensor)
-            
+    def preprocess_batch(self, windows):
+        # windows: List (or ndarray) of (48, 8) windows -> (batch, 48, 8)
+        with metrics.stage("tensor"):
+            x_tensor = torch.as_tensor(np.asarray(windows, dtype=np.float32))
+        self._check_shape(x_tensor)
+        return x_tensor
+
+    def _check_shape(self, x_tensor):
+        # Reject malformed windows before they reach a shared batch
+        expected = (self.metadata['seq_length'], self.metadata['input_dim'])
+        if x_tensor.dim() != 3 or tuple(x_tensor.shape[1:]) != expected:
+            raise ValueError(f"Expected windows of shape {expected}, got {tuple(x_tensor.shape[1:])}")
+        # An empty binary (0, 48, 8) body, answered 422 like an empty JSON list
+        if x_tensor.shape[0] == 0:
+            raise ValueError("Expected at least one window")
+
+    def _forward(self, x_tensor):
+        # One forward for the whole batch, then split into per-window results
+        with metrics.stage("forward"), torch.no_grad():
+            e_pred, p_logits = self.runtime(x_tensor)
+        with metrics.stage("postprocess"):
+            return self._postprocess(e_pred, p_logits)
+
+    def _postprocess(self, e_pred, p_logits):
         # Energy
-        energy = e_pred.item()
-        
+        energies = e_pred.squeeze(1).tolist()
+
         # Ports
-        p_probs = torch.softmax(p_logits, dim=1).squeeze().tolist()
-        p_class = torch.argmax(p_logits, dim=1).item()
-        
+        p_probs = torch.softmax(p_logits, dim=1).tolist()
+        p_classes = torch.argmax(p_logits, dim=1).tolist()
+
+        return [
+            {
+                "predicted_energy": energy,
+                "predicted_ports_class": p_class,
+                "predicted_ports_probs": probs
+            }
+            for energy, p_class, probs in zip(energies, p_classes, p_probs)
+        ]
+
+    def predict(self, features):
+        self._ensure_model()
+
+        x_tensor = self.preprocess_input(features)
+
+        # Windows the precompute job already forecast this interval are a lookup
+        precomputed = self.snapshots.prediction(window_key(x_tensor))
+        if precomputed is not None:
+            return precomputed
+        # Queue wait plus the (shared) batched forward, as seen by this request
+        with metrics.stage("batch"):
+            return self.batcher.submit(x_tensor)[0]
+
+    def predict_batch(self, windows):
+        self._ensure_model()
+
+        # Already batched by the client, no need to go through the coalescer
+        x_tensor = self.preprocess_batch(windows)
+        return self._forward(x_tensor)
+
+    def forecast(self, windows, last_timestamps, horizon):
+        """
+        Rolls the model forward `horizon` 15-min steps for every window at once.
+        last_timestamps: timestamp of the last row of each window
+        """
+        self._ensure_model()
+
+        if not 1 <= horizon <= MAX_FORECAST_HORIZON:
+            raise ValueError(f"horizon must be between 1 and {MAX_FORECAST_HORIZON}")
+
+        x_tensor = self.preprocess_batch(windows)
+        if len(last_timestamps) != x_tensor.shape[0]:
+            raise ValueError("Need one last_timestamp per window")
+        last_timestamps = np.array(last_timestamps, dtype='datetime64[ns]')
+
+        result = rollout(
+            self.runtime, self.feature_scaler, x_tensor, last_timestamps, horizon,
+            port_values=self.metadata['unique_vals_scaled']
+        )
+
         return {
-            "predicted_energy": energy,
-            "predicted_ports_class": p_class,
-            "predicted_ports_probs": p_probs
+            "timestamps": result["timestamps"].astype('datetime64[s]').astype(str).tolist(),
+            "predicted_energy": result["predicted_energy"].tolist(),
+            "predicted_ports_class": result["predicted_ports_class"].tolist(),
+            "predicted_ports_probs": result["predicted_ports_probs"].tolist()
         }
+
+    def forecast_fleet(self):
+        """
+        Next-interval forecast for every station in encoders.pkl, from one forward
+        over a (stations, 48, 8) batch. Cached until the next 15-min boundary.
+        """
+        self._ensure_model()
+
+        with self.fleet_lock:
+            now = time.time()
+            if self.fleet_cache is not None and now < self.fleet_cache["valid_until_ts"]:
+                return self.fleet_cache["result"]
+
+            stations, windows, window_ends, sources, missing = self._latest_windows()
+            predictions = self._forward(torch.from_numpy(windows)) if stations else []
+
+            valid_until = next_grid_boundary(now)
+            result = _fleet_result(now, valid_until, stations, window_ends, sources, predictions, missing)
+            self.fleet_cache = {"valid_until_ts": valid_until, "result": result}
+            return result
+
+    def refresh_snapshot(self):
+        """
+        Precomputes the current interval for all active stations in one batch:
+        the fleet forecast, each station's /predict result and its energy
+        explanation. Run by the scheduler right after every 15-min boundary.
+        """
+        self._ensure_model()
+
+        now = time.time()
+        stations, windows, window_ends, sources, missing = self._latest_windows()
+        x_batch = torch.from_numpy(windows)
+        predictions = self._forward(x_batch) if stations else []
+
+        # Same keys /predict and /explain compute for a single (1, 48, 8) window
+        heads = ('energy',)
+        predictions_by_key, explanations_by_key = {}, {}
+        if stations:
+            shap_vals, _ = self._get_explain_pool().run(windows, heads)
+            for i, prediction in enumerate(predictions):
+                x_tensor = x_batch[i:i + 1]
+                predictions_by_key[window_key(x_tensor)] = prediction
+                explanations_by_key[window_key(x_tensor, heads)] = self._explanation_result(shap_vals, i)
+
+        valid_until = next_grid_boundary(now)
+        fleet = _fleet_result(now, valid_until, stations, window_ends, sources, predictions, missing)
+        with self.fleet_lock:
+            self.fleet_cache = {"valid_until_ts": valid_until, "result": fleet}
+
+        version = self.snapshots.publish(predictions_by_key, explanations_by_key, fleet, valid_until)
+        print(f"Published forecast snapshot v{version}: {len(stations)} stations in {time.time() - now:.2f}s")
+        return version
+
+    def get_snapshot_stats(self):
+        return self.snapshots.stats()
+
+    def _latest_windows(self):
+        """
+        Most recent complete window per station, stacked into one array.
+        Live streams (/ingest) take precedence over the processed data.
+        Returns (stations, (n, 48, 8) windows, window end timestamps, sources, missing stations).
+        """
+        seq_length = self.metadata['seq_length']
+        try:
+            store = self._get_window_store()
+        except FileNotFoundError:
+            store = None
+
+        stations, windows, window_ends, sources, missing = [], [], [], [], []
+        for station in self._get_station_names():
+            stream = self.streams.get(station)
+            if stream is not None and len(stream.window) == seq_length:
+                with stream.lock:
+                    window = np.stack(stream.window)
+                # Only raw-reading streams know their timestamps
+                last = self.preprocessor.last_timestamp(station)
+                window_end = str(last.astype('datetime64[s]')) if last is not None else None
+                source = "stream"
+            elif store is not None and station in store.bounds:
+                try:
+                    latest = store.latest(station)
+                except LookupError:
+                    missing.append(station)
+                    continue
+                window, window_end, source = latest['features'], latest['timestamp'], "processed"
+            else:
+                missing.append(station)
+                continue
+
+            stations.append(station)
+            windows.append(window)
+            window_ends.append(window_end)
+            sources.append(source)
+
+        shape = (0, seq_length, self.metadata['input_dim'])
+        windows = np.stack(windows).astype(np.float32) if windows else np.zeros(shape, dtype=np.float32)
+        return stations, windows, window_ends, sources, missing
+
+    def _get_station_names(self):
+        # The fleet is every station the LabelEncoder was fit on
+        if self.station_names is None:
+            with open(ENCODER_PATH, 'rb') as f:
+                self.station_names = [str(name) for name in pickle.load(f).classes_]
+        return self.station_names
+
+    def _check_station(self, station):
+        # Streams and preprocessor buffers are kept per station for the life of the
+        # process: only the fleet's stations get one, not any string sent to /ingest
+        if station not in self._get_station_set():
+            raise KeyError(f"Unknown station: {station}")
+
+    def _get_station_set(self):
+        if self.station_set is None:
+            self.station_set = frozenset(self._get_station_names())
+        return self.station_set
+
+    def get_batch_stats(self):
+        stats = self.batcher.stats.snapshot()
+        stats["queue_depth"] = self.batcher.queue_depth()
+        stats["max_batch_size_limit"] = self.batcher.max_batch_size
+        stats["max_wait_ms"] = self.batcher.max_wait * 1000.0
+        return stats
         
-    def get_explanation(self, features):
-        if not self.model:
-            self.load_model()
-            
-        # Lazily init explainer using a small background batch (zeros?)
-        # Ideally we use training data samples.
-        if self.explainer is None:
-            # Create a dummy background (e.g., zeros or mean)
-            # Dims: (10, 48, 8)
-            background = torch.zeros((10, 48, self.metadata['input_dim']))
-            self.explainer = EVFlowExplainer(self.model, background)
-            
+    def get_explanation(self, features, heads=('energy',), method='shap', steps=None, compact=False, top_k=None):
+        # Synchronous /explain: cache and snapshot hits and gradient methods are
+        # returned as they are, a SHAP computation is a pool job like /explain/jobs, waited for
+        result, job = self._explain(features, heads, method, steps, compact, top_k)
+        if result is not None:
+            return result
+        if job["status"] not in ("done", "failed"):
+            with metrics.stage("explain_wait"):
+                job = self._get_explain_pool().wait(job["job_id"], timeout=EXPLAIN_TIMEOUT_S)
+        if job["status"] == "failed":
+            raise RuntimeError(f"Explanation failed: {job['error']}")
+        return job["result"]
+
+    def submit_explanation(self, features, heads=('energy',), method='shap', steps=None, compact=False, top_k=None):
+        """
+        Queues an explanation in the explain pool and returns the job
+        ({job_id, status, result, error}). Raises PoolFull when too many are pending.
+
+        method: 'shap' (explain pool), or 'integrated_gradients' / 'gradient_input',
+                computed right away in the calling thread; the job is returned done.
+        steps: Integrated gradients steps (default EVFLOW_IG_STEPS)
+        compact: Return per-feature totals and the top_k cells instead of the full matrices
+        top_k: Cells in top_contributions (default EVFLOW_EXPLAIN_TOP_K)
+        """
+        result, job = self._explain(features, heads, method, steps, compact, top_k)
+        if result is not None:
+            # Already available: a finished job, so the client polls it like any other
+            pool = self._get_explain_pool()
+            return pool.job(pool.add_finished(result))
+        return job
+
+    def _explain(self, features, heads, method, steps, compact, top_k):
+        # (shaped result, None) when the result is available right away (a cache or
+        # snapshot hit, or a gradient method computed in this thread), or (None, job)
+        # for a SHAP job queued in the explain pool
+        self._ensure_model()
+
+        steps = IG_STEPS if steps is None else steps
+        top_k = EXPLAIN_TOP_K if top_k is None else top_k
+        if method == 'integrated_gradients' and not 1 <= steps <= IG_MAX_STEPS:
+            raise ValueError(f"steps must be between 1 and {IG_MAX_STEPS}")
+        if top_k < 0:
+            raise ValueError("top_k must not be negative")
+
         x_tensor = self.preprocess_input(features)
-        shap_vals = self.explainer.explain(x_tensor)
-        
-        # Convert to list
-        # energy_shap: (1, 48, 8)
+
+        # The dashboard re-explains windows it has already seen on every refresh.
+        # The caches hold full results; compact and top_k only shape the response.
+        heads = tuple(sorted(set(heads)))
+        if method == 'shap':
+            key = window_key(x_tensor, heads) # Same key as the precompute snapshot
+        else:
+            key = window_key(x_tensor, heads, method, steps if method == 'integrated_gradients' else 1)
+        cached = self.snapshots.explanation(key) or self.explain_cache.get(key)
+        if cached is not None:
+            return self._shape_explanation(cached, compact, top_k), None
+
+        if method != 'shap':
+            with metrics.stage("attribution"):
+                attributions = self._get_explainer().explain(x_tensor, heads=heads, method=method, steps=steps)
+            with metrics.stage("postprocess"):
+                result = self._explanation_result(attributions, 0, method)
+            self.explain_cache.put(key, result)
+            return self._shape_explanation(result, compact, top_k), None
+
+        def finish(shap_vals, seconds):
+            # In the API process, once the pool has computed the SHAP values
+            metrics.STAGE_SECONDS.observe(seconds, stage="shap")
+            with metrics.stage("postprocess"):
+                result = self._explanation_result(shap_vals, 0)
+            self.explain_cache.put(key, result)
+            return self._shape_explanation(result, compact, top_k)
+
+        # Requests for the same window only share a pending job if they want the same response shape
+        pool = self._get_explain_pool()
+        return None, pool.job(pool.submit((key, compact, top_k), x_tensor.numpy(), heads, finish))
+
+    def get_explanation_job(self, job_id):
+        return self._get_explain_pool().job(job_id)
+
+    def _get_explain_pool(self):
+        # Created on first use, and again in a forked API worker (the parent's
+        # pool processes and management thread do not carry over)
+        if self.explain_pool is None or self.explain_pool_pid != os.getpid():
+            with self.explain_pool_lock:
+                if self.explain_pool is None or self.explain_pool_pid != os.getpid():
+                    self.explain_pool = ExplainPool(
+                        EXPLAIN_WORKERS,
+                        EXPLAIN_MAX_PENDING,
+                        (MODEL_PATH, METADATA_PATH, BACKGROUND_PATH, EXPLAIN_WORKER_THREADS),
+                        job_ttl_s=EXPLAIN_JOB_TTL_S,
+                        local=self._explain_in_process,
+                    )
+                    self.explain_pool_pid = os.getpid()
+        return self.explain_pool
+
+    def _explain_in_process(self, windows, heads):
+        # EVFLOW_EXPLAIN_WORKERS=0
+        started = time.perf_counter()
+        shap_vals = self._get_explainer().explain(torch.from_numpy(windows), heads=heads)
+        return shap_vals, time.perf_counter() - started
+
+    def shutdown(self):
+        if self.explain_pool is not None and self.explain_pool_pid == os.getpid():
+            self.explain_pool.shutdown()
+
+    def _explanation_result(self, shap_vals, i, method='shap'):
+        # Convert sample i to lists
+        # energy_shap: (batch, 48, 8, 1), ports_shap: [(48, 8, classes)] per sample
+        energy = shap_vals['energy_shap'][i] if 'energy_shap' in shap_vals else None
         return {
-            "shap_values": shap_vals['energy_shap'][0].tolist(), # Just one sample
-            "feature_names": [
-                'Available Ports', 'Energy', 'Hour', 'DayOfWeek', 'Month', 
-                'IsWeekend', 'Energy_Roll_3', 'Energy_Roll_6'
-            ]
+            "method": method,
+            "shap_values": energy.tolist() if energy is not None else None,
+            "ports_shap_values": shap_vals['ports_shap'][i].tolist() if 'ports_shap' in shap_vals else None,
+            "feature_names": FEATURE_NAMES,
+            "top_contributions": top_contributions(energy[..., 0], FEATURE_NAMES, EXPLAIN_TOP_K) if energy is not None else None
         }
 
-    def get_sample_data(self):
-        # Load data if not loaded (we need dataframe for this)
-        # For simplicity, load the csv again or cache it? process_data.py saved it.
-        # Ideally we stick to the 48-window logic.
-        # Let's load the csv, pick a random start index, and return 48 rows.
-        
-        df = pd.read_csv(r'e:\EVFlow AI\data\processed\processed_data.csv')
-        
-        # Features columns expected by model
-        # 'Available Ports', 'Energy (kWh)', 'Hour', 'DayOfWeek', 'Month', 'IsWeekend', 'Energy_Roll_3', 'Energy_Roll_6'
-        feats = ['Available Ports', 'Energy (kWh)', 'Hour', 'DayOfWeek', 'Month', 'IsWeekend', 'Energy_Roll_3', 'Energy_Roll_6']
-        
-        max_idx = len(df) - 48
-        if max_idx < 0:
-            return []
-            
-        import random
-        start_idx = random.randint(0, max_idx)
-        
-        # Extract 48 rows
-        subset = df.iloc[start_idx : start_idx+48][feats]
-        return subset.values.tolist()
+    def _shape_explanation(self, result, compact, top_k):
+        # Full cached result -> response. Compact drops the (48, 8) matrices for
+        # per-feature sums of |attribution| (what the dashboard's chart shows).
+        if not compact and top_k == EXPLAIN_TOP_K:
+            return result
+        energy = np.asarray(result["shap_values"])[..., 0] if result["shap_values"] is not None else None
+        shaped = dict(result, top_contributions=top_contributions(energy, FEATURE_NAMES, top_k) if energy is not None else None)
+        if compact:
+            ports = result["ports_shap_values"]
+            shaped.update(
+                shap_values=None,
+                ports_shap_values=None,
+                feature_importance=feature_importance(energy, FEATURE_NAMES) if energy is not None else None,
+                ports_feature_importance=feature_importance(ports, FEATURE_NAMES) if ports is not None else None,
+            )
+        return shaped
+
+    def _get_explainer(self):
+        # Lazily init explainer. The background is a set of real training windows
+        # sampled once by train.py and stored next to model.pth.
+        if self.explainer is None:
+            if os.path.exists(BACKGROUND_PATH):
+                background = torch.load(BACKGROUND_PATH, map_location=torch.device('cpu'))
+            else:
+                # Fall back to a dummy background (zeros). Dims: (10, 48, 8)
+                print(f"Warning: {BACKGROUND_PATH} not found, using a zeros SHAP background.")
+                background = torch.zeros((10, self.metadata['seq_length'], self.metadata['input_dim']))
+            self.explainer = EVFlowExplainer(self.model, background)
+        return self.explainer
+
+    def get_explain_cache_stats(self):
+        return self.explain_cache.stats()
+
+    def get_global_importance(self, head='energy', station=None):
+        """
+        Summary written offline by ml/global_importance.py, for one head and
+        optionally one station. Re-read whenever the file changes.
+        Raises FileNotFoundError if it has not been built, ValueError for a head
+        that is not a model output, KeyError for a head the job did not compute
+        or an unknown station.
+        """
+        if head not in ('energy', 'ports'):
+            raise ValueError(f"Unknown head '{head}', expected 'energy' or 'ports'")
+        mtime = os.path.getmtime(GLOBAL_IMPORTANCE_PATH)
+        if self.global_importance is None or self.global_importance[0] != mtime:
+            import json
+            with open(GLOBAL_IMPORTANCE_PATH, 'r') as f:
+                self.global_importance = (mtime, json.load(f))
+        summary = self.global_importance[1]
+
+        if head not in summary:
+            raise KeyError(f"Head '{head}' was not computed, rerun ml/global_importance.py with --heads {head}")
+        result = {key: value for key, value in summary.items() if key not in ('energy', 'ports')}
+        result.update(summary[head], head=head)
+        # Attributions of an older model than the one being served
+        result["stale"] = self.model_version is not None and summary["model_version"] != self.model_version
+        if station is not None:
+            result["by_station"] = [s for s in result["by_station"] if s["station"] == station]
+            if not result["by_station"]:
+                raise KeyError(f"Unknown station: {station}")
+        return result
+
+    def ingest(self, station, features, history=None):
+        """
+        Streaming update for one station: append one feature row, advance the
+        carried GRU state by a single step and forecast the next interval.
+        history: optional (<=48, 8) rows to (re)seed the station's window.
+        """
+        self._ensure_model()
+        self._check_station(station)
+
+        row = np.asarray(features, dtype=np.float32)
+        if row.shape != (self.metadata['input_dim'],):
+            raise ValueError(f"Expected {self.metadata['input_dim']} features, got shape {row.shape}")
+
+        if history is not None:
+            history = np.asarray(history, dtype=np.float32)
+            if history.ndim != 2 or history.shape[1] != self.metadata['input_dim'] or len(history) > self.metadata['seq_length']:
+                raise ValueError(f"history must be (<={self.metadata['seq_length']}, {self.metadata['input_dim']}), got {history.shape}")
+
+        stream = self._get_stream(station)
+        with stream.lock:
+            if history is not None:
+                stream.seed(history)
+            stream.window.append(row)
+
+            with torch.no_grad():
+                if stream.hidden is None or stream.steps_since_sync >= stream.resync_every:
+                    e_pred, p_logits = self._resync(stream)
+                    resynced = True
+                else:
+                    x_t = torch.from_numpy(row).unsqueeze(0)
+                    e_pred, p_logits, stream.hidden = self.model.step(x_t, stream.hidden)
+                    stream.steps_since_sync += 1
+                    resynced = False
+
+            result = self._postprocess(e_pred, p_logits)[0]
+            result["resynced"] = resynced
+            result["steps_since_sync"] = stream.steps_since_sync
+        return result
+
+    def ingest_reading(self, station, timestamp, available_ports, energy_kwh, history=None):
+        """
+        Streaming update from a raw reading instead of a scaled feature row.
+        The preprocessor keeps the station's recent raw intervals and derives the
+        rolling, calendar and scaled features server-side.
+        history: optional list of (timestamp, available_ports, energy_kwh) raw
+                 readings, oldest first, to (re)seed the station.
+        """
+        self._ensure_model()
+        self._check_station(station)
+
+        timestamp = _parse_timestamp(timestamp)
+        if history is not None:
+            history = [(_parse_timestamp(t), p, e) for t, p, e in history]
+
+        # The seed check, the push and the stream update happen under the station's
+        # stream lock, so two first readings cannot both reseed, and a push cannot
+        # land between another reading's reseed and its stream update
+        stream = self._get_stream(station)
+        with stream.lock:
+            reseed = history is not None or not self.preprocessor.has_station(station)
+            if history is not None:
+                timestamps, ports, energy = zip(*history) if history else ((), (), ())
+                self.preprocessor.seed(station, list(timestamps), ports, energy)
+            elif reseed:
+                self._seed_preprocessor(station)
+
+            added = self.preprocessor.push(station, timestamp, available_ports, energy_kwh)
+            window, _ = self.preprocessor.window(station)
+
+            # One new interval extends the stream by a step; a replaced interval, a gap
+            # or a fresh buffer re-seeds the stream from the preprocessed window
+            if reseed or added != 1:
+                return self.ingest(station, window[-1], history=window[:-1])
+            return self.ingest(station, window[-1])
+
+    def _seed_preprocessor(self, station):
+        # Continue from the station's processed history if there is one, so the
+        # rolling features are right from the first raw reading
+        try:
+            store = self._get_window_store()
+        except FileNotFoundError:
+            return
+        if station not in store.bounds:
+            return
+        features, timestamps = store.tail(station, self.metadata['seq_length'] + MAX_ROLL)
+        raw = self.feature_scaler.inverse_transform(np.asarray(features, dtype=np.float64))
+        self.preprocessor.seed(station, timestamps, np.rint(raw[:, AVAILABLE_PORTS]), raw[:, ENERGY])
+
+    def _resync(self, stream):
+        # Full-window forward from zeros over the buffered rows
+        x_window = stream.window_tensor()
+        e_pred, p_logits, hidden = self.model.forward_with_state(x_window)
+
+        if stream.hidden is not None:
+            # Measure how far the stepped state had drifted before replacing it
+            e_stream, _, _ = self.model.step(x_window[:, -1, :], stream.hidden)
+            stream.record_drift(abs(e_stream.item() - e_pred.item()), STREAM_DRIFT_TOLERANCE)
+
+        stream.hidden = hidden
+        stream.steps_since_sync = 0
+        return e_pred, p_logits
+
+    def _get_stream(self, station):
+        with self.streams_lock:
+            stream = self.streams.get(station)
+            if stream is None:
+                stream = StationStream(self.metadata['seq_length'], STREAM_RESYNC_EVERY)
+                # Seed a new stream with the station's latest processed window if we have one
+                try:
+                    store = self._get_window_store()
+                    if station in store.bounds:
+                        stream.seed(store.latest(station)['features'])
+                except (FileNotFoundError, LookupError):
+                    pass
+                self.streams[station] = stream
+        return stream
+
+    def _get_window_store(self):
+        # Windows come from a memory-mapped sidecar built once from the processed data store,
+        # indexed per station so a window never crosses a station boundary.
+        # Built under a lock: concurrent first callers (/sample, /ingest, precompute)
+        # would otherwise each write the same sidecar files at once.
+        if self.window_store is None:
+            with self.window_store_lock:
+                if self.window_store is None:
+                    store = WindowStore(PROCESSED_STORE_PATH, seq_length=48)
+                    store.load()
+                    self.window_store = store
+        return self.window_store
+
+    def get_sample_data(self, station=None, timestamp=None):
+        window = self._get_window_store().sample(station=station, timestamp=timestamp)
+        window['features'] = window['features'].tolist()
+        return window
+
+def _parse_timestamp(value):
+    try:
+        return np.datetime64(value, 'ns')
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value!r}")
+
+def _fleet_result(now, valid_until, stations, window_ends, sources, predictions, missing):
+    return {
+        "generated_at": format_time(now),
+        "valid_until": format_time(valid_until),
+        "stations": [
+            dict(prediction, station=station, window_end=window_end, source=source)
+            for station, window_end, source, prediction in zip(stations, window_ends, sources, predictions)
+        ],
+        "missing": missing
+    }
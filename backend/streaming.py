@@ -0,0 +1,46 @@
+import threading
+from collections import deque
+
+import numpy as np
+import torch
+
+
+class StationStream:
+    def __init__(self, seq_length, resync_every):
+        """
+        Per-station streaming state.
+        - window: the last seq_length feature rows, used to re-sync the hidden state
+        - hidden: GRU h_n after the last ingested row, (num_layers, 1, hidden_dim)
+
+        A stepped GRU carries history from before the window (the model was
+        trained on windows starting from h=0), so the carried state slowly
+        drifts from what a full-window forward would give. Re-syncing replays
+        the buffered window from zeros to bound that drift.
+        """
+        self.window = deque(maxlen=seq_length)
+        self.hidden = None
+        self.steps_since_sync = 0
+        self.max_resync_every = resync_every
+        self.resync_every = resync_every
+        self.last_drift = 0.0
+        # Re-entrant: a raw reading holds it across the preprocessor update and
+        # the stream update that follows (ModelService.ingest_reading)
+        self.lock = threading.RLock()
+
+    def seed(self, rows):
+        self.window.clear()
+        self.window.extend(np.asarray(rows, dtype=np.float32))
+        self.hidden = None
+
+    def window_tensor(self):
+        # (1, len(window), input_dim)
+        return torch.from_numpy(np.stack(self.window)).unsqueeze(0)
+
+    def record_drift(self, drift, tolerance):
+        # Drift-triggered re-sync: halve the re-sync interval while the stream
+        # disagrees with the full-window model, relax it back once it agrees.
+        self.last_drift = drift
+        if drift > tolerance:
+            self.resync_every = max(1, self.resync_every // 2)
+        else:
+            self.resync_every = min(self.max_resync_every, self.resync_every * 2)
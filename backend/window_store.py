@@ -0,0 +1,175 @@
+import json
+import os
+
+import numpy as np
+
+FEATURE_COLS = [
+    'Available Ports', 'Energy (kWh)', 'Hour', 'DayOfWeek', 'Month',
+    'IsWeekend', 'Energy_Roll_3', 'Energy_Roll_6'
+]
+
+
+class WindowStore:
+    def __init__(self, store_dir, seq_length=48):
+        """
+        store_dir: processed data store written by process_data.py (ml/store.py)
+        seq_length: Window length served to the model
+
+        The feature columns are gathered once into a binary sidecar directory
+        next to the store (`<store>.windows/`). Features and timestamps are then
+        memory-mapped, so every worker process shares the same pages instead of
+        holding its own copy.
+        """
+        self.store_dir = store_dir
+        self.seq_length = seq_length
+        self.sidecar_dir = store_dir.rstrip('/\\') + '.windows'
+
+        self.features = None    # (rows, 8) float32, memory-mapped
+        self.timestamps = None  # (rows,) int64 ns, memory-mapped
+        self.stations = []      # Station names, in store (Station_ID_Encoded) order
+        self.bounds = {}        # Station name -> (first_row, end_row)
+
+        self._window_ends = None  # Cumulative count of valid windows per station
+
+    @property
+    def loaded(self):
+        return self.features is not None
+
+    def load(self):
+        if not self._sidecar_fresh():
+            self._build_sidecar()
+
+        self.features = np.load(os.path.join(self.sidecar_dir, 'features.npy'), mmap_mode='r')
+        self.timestamps = np.load(os.path.join(self.sidecar_dir, 'timestamps.npy'), mmap_mode='r')
+
+        with open(os.path.join(self.sidecar_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        self.stations = [s['name'] for s in meta['stations']]
+        self.bounds = {s['name']: (s['start'], s['end']) for s in meta['stations']}
+
+        # Valid window starts for a station spanning rows [start, end) are
+        # start .. end - seq_length, so windows never cross station boundaries.
+        counts = [max(end - start - self.seq_length + 1, 0) for start, end in self.bounds.values()]
+        self._window_ends = np.cumsum(counts)
+
+    def _source_stat(self):
+        # The store's manifest is replaced on every rewrite
+        return os.stat(os.path.join(self.store_dir, 'manifest.json'))
+
+    def _sidecar_fresh(self):
+        meta_path = os.path.join(self.sidecar_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        stat = self._source_stat()
+        return meta.get('source_mtime') == stat.st_mtime and meta.get('source_size') == stat.st_size
+
+    def _build_sidecar(self):
+        from ml.store import ProcessedStore
+
+        print("Building window store sidecar...")
+        stat = self._source_stat()
+        store = ProcessedStore(self.store_dir)
+
+        # Each station's rows are already contiguous and in time order in the store
+        features, timestamps, stations = [], [], []
+        start = 0
+        for name in store.stations:
+            arrays = store.read_arrays(name, ['timestamp'] + FEATURE_COLS)
+            features.append(np.stack([arrays[col] for col in FEATURE_COLS], axis=1).astype(np.float32))
+            timestamps.append(arrays['timestamp'].astype('datetime64[ns]').astype(np.int64))
+            end = start + len(timestamps[-1])
+            stations.append({'name': name, 'start': start, 'end': end})
+            start = end
+
+        features = np.concatenate(features) if features else np.zeros((0, len(FEATURE_COLS)), dtype=np.float32)
+        timestamps = np.concatenate(timestamps) if timestamps else np.zeros(0, dtype=np.int64)
+
+        meta = {
+            'source_mtime': stat.st_mtime,
+            'source_size': stat.st_size,
+            'feature_cols': FEATURE_COLS,
+            'stations': stations
+        }
+
+        os.makedirs(self.sidecar_dir, exist_ok=True)
+        # Write to temp files first so concurrent readers never see a partial sidecar
+        for name, arr in [('features.npy', features), ('timestamps.npy', timestamps)]:
+            tmp = os.path.join(self.sidecar_dir, name + '.tmp')
+            with open(tmp, 'wb') as f:
+                np.save(f, arr)
+            os.replace(tmp, os.path.join(self.sidecar_dir, name))
+
+        tmp = os.path.join(self.sidecar_dir, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.sidecar_dir, 'meta.json'))
+
+    def _window(self, station, start):
+        end = start + self.seq_length
+        return {
+            'features': self.features[start:end],
+            'station': station,
+            'timestamp': str(np.datetime64(int(self.timestamps[end - 1]), 'ns').astype('datetime64[s]'))
+        }
+
+    def _end_index(self, station, timestamp):
+        # Last row of `station` at or before `timestamp`
+        start, end = self.bounds[station]
+        pos = start + int(np.searchsorted(self.timestamps[start:end], timestamp, side='right')) - 1
+        if pos - self.seq_length + 1 < start:
+            return None
+        return pos
+
+    def sample(self, station=None, timestamp=None, rng=np.random):
+        """
+        Returns a dict with the (seq_length, 8) `features` window, its `station`
+        and the `timestamp` of its last row.
+        - station: restrict to one station (random window unless timestamp is given)
+        - timestamp: window ending at the last interval at or before this time
+        """
+        if not self._window_ends.size or self._window_ends[-1] == 0:
+            raise LookupError("No complete windows in processed data")
+
+        if station is not None and station not in self.bounds:
+            raise KeyError(f"Unknown station: {station}")
+
+        if timestamp is not None:
+            ts = np.datetime64(timestamp, 'ns').astype(np.int64)
+            candidates = [station] if station is not None else self.stations
+            ends = [(name, self._end_index(name, ts)) for name in candidates]
+            ends = [(name, pos) for name, pos in ends if pos is not None]
+            if not ends:
+                raise LookupError(f"No complete window ending at or before {timestamp}")
+            name, pos = ends[rng.randint(len(ends))]
+            return self._window(name, pos - self.seq_length + 1)
+
+        if station is not None:
+            start, end = self.bounds[station]
+            num_windows = end - start - self.seq_length + 1
+            if num_windows <= 0:
+                raise LookupError(f"Station {station} has fewer than {self.seq_length} intervals")
+            return self._window(station, start + rng.randint(num_windows))
+
+        # Uniform over all valid windows: pick a global window number, then map
+        # it to (station, offset) with the cumulative counts
+        k = rng.randint(int(self._window_ends[-1]))
+        idx = int(np.searchsorted(self._window_ends, k, side='right'))
+        before = int(self._window_ends[idx - 1]) if idx > 0 else 0
+        station = self.stations[idx]
+        return self._window(station, self.bounds[station][0] + k - before)
+
+    def latest(self, station):
+        """Most recent complete window for a station."""
+        start, end = self.bounds[station]
+        if end - start < self.seq_length:
+            raise LookupError(f"Station {station} has fewer than {self.seq_length} intervals")
+        return self._window(station, end - self.seq_length)
+
+    def tail(self, station, n):
+        """Last (up to) n rows of a station: (features, timestamps as datetime64[ns])."""
+        start, end = self.bounds[station]
+        start = max(start, end - n)
+        return self.features[start:end], self.timestamps[start:end].astype('datetime64[ns]')
@@ -0,0 +1,499 @@
+"""
+End-to-end load test of the API: launches the server locally on the checked-in
+artifacts, replays a weighted mix of dashboard calls against it and reports
+throughput, latency percentiles and error rate per endpoint.
+
+    python benchmarks/loadtest.py --concurrency 8 --duration 30 --output load.json
+    python benchmarks/loadtest.py --rate 50 --mix predict=4,explain=1 --server-env EVFLOW_WORKERS=2
+    python benchmarks/loadtest.py --url http://localhost:8000 --concurrency 4   # existing server
+    python benchmarks/loadtest.py --results new.json --baseline old.json        # compare only
+
+The server runs on ml/model.pth, ml/metadata.json, ml/background.pt and
+data/processed/scaler.pkl, with a processed store built from the raw sample
+export (data/raw/ev_data.xlsx.csv) into a temporary directory, or --store.
+
+Two load models:
+- --concurrency N (closed loop): N clients, each sending its next request as
+  soon as the previous one returns. Finds the throughput ceiling.
+- --rate R (open loop): R requests per second on a fixed schedule, whatever the
+  server does. Latency is measured from the scheduled start, so time spent
+  waiting behind a slow server counts (no coordinated omission).
+
+The load generator is Python threads on the same machine as the server: it
+competes for CPU, and above a few thousand requests/s it becomes the limit itself.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+RAW_FILE = os.path.join(ROOT, 'data', 'raw', 'ev_data.xlsx.csv')
+MODEL_PATH = os.path.join(ROOT, 'ml', 'model.pth')
+METADATA_PATH = os.path.join(ROOT, 'ml', 'metadata.json')
+BACKGROUND_PATH = os.path.join(ROOT, 'ml', 'background.pt')
+SCALER_PATH = os.path.join(ROOT, 'data', 'processed', 'scaler.pkl')
+ENCODER_PATH = os.path.join(ROOT, 'data', 'processed', 'encoders.pkl')
+
+# One dashboard refresh is /health, /sample, /predict and /explain once each (frontend/src/App.jsx)
+DEFAULT_MIX = 'health=1,sample=1,predict=1,explain=1'
+ENDPOINTS = {
+    'health': ('GET', '/health'),
+    'sample': ('GET', '/sample'),
+    'predict': ('POST', '/predict'),
+    'explain': ('POST', '/explain'),
+}
+DEFAULT_DURATION_S = 30.0
+DEFAULT_WARMUP_S = 5.0
+WINDOWS = 64 # Distinct windows fetched from /sample for the /predict and /explain bodies
+READY_TIMEOUT_S = 180.0
+REQUEST_TIMEOUT_S = 120.0
+DEFAULT_THRESHOLD = 0.10 # Relative throughput drop / p95 growth flagged as a regression
+
+
+def parse_mix(text):
+    """'predict=4,explain=1' -> {'predict': 4.0, 'explain': 1.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}' in --mix, expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight) if weight else 1.0
+    if not any(w > 0 for w in mix.values()):
+        raise ValueError("--mix needs at least one positive weight")
+    return mix
+
+
+# --- Server -------------------------------------------------------------------
+
+def _serve(store_dir, host, port):
+    # Server process: repo artifacts instead of the deployment paths in service.py
+    from backend import service
+
+    service.MODEL_PATH = MODEL_PATH
+    service.METADATA_PATH = METADATA_PATH
+    service.BACKGROUND_PATH = BACKGROUND_PATH
+    service.SCALER_PATH = SCALER_PATH
+    service.ENCODER_PATH = ENCODER_PATH
+    service.PROCESSED_STORE_PATH = store_dir
+    service.TORCHSCRIPT_PATH = os.path.join(ROOT, 'ml', 'model_ts.pt')
+    service.QUANTIZED_PATH = os.path.join(ROOT, 'ml', 'model_int8.pt')
+    service.GLOBAL_IMPORTANCE_PATH = os.path.join(ROOT, 'ml', 'global_importance.json')
+
+    from backend.main import app
+    from backend.serve import serve
+    serve(app, host=host, port=port, workers=int(os.environ.get('EVFLOW_WORKERS', 1)))
+
+
+def build_store(raw_file, workdir):
+    """Processed store of the raw sample export, in workdir/store."""
+    import process_data
+
+    process_data.process_data(raw_file, workdir)
+    return os.path.join(workdir, 'store')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(store_dir, port, env, log_path):
+    """Launches this script in server mode. Returns the Popen."""
+    server_env = dict(os.environ, **env)
+    server_env.setdefault('PYTHONUNBUFFERED', '1')
+    log = open(log_path, 'w')
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--store', store_dir, '--port', str(port)],
+        env=server_env, stdout=log, stderr=subprocess.STDOUT, cwd=ROOT
+    )
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+# --- Client -------------------------------------------------------------------
+
+class Client:
+    """One keep-alive HTTP connection per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        """Returns (status, response bytes). Raises on connection errors."""
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn = getattr(self.local, 'conn', None)
+        reused = conn is not None
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT_S)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            conn.close()
+            self.local.conn = None
+            if not reused:
+                raise
+            # The server closed the idle keep-alive connection: retry once on a new one
+            return self.request(method, path, body)
+        except Exception:
+            # Next request reconnects
+            conn.close()
+            self.local.conn = None
+            raise
+
+
+def wait_ready(client, timeout=READY_TIMEOUT_S, proc=None):
+    """Polls /readyz until the model is loaded and warmed up."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"Server exited with status {proc.returncode} before becoming ready")
+        try:
+            status, _ = client.request('GET', '/readyz')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Server not ready after {timeout:.0f}s")
+
+
+def fetch_windows(client, count):
+    """Distinct (48, 8) windows from /sample, as the dashboard gets them."""
+    windows = []
+    for _ in range(count):
+        status, body = client.request('GET', '/sample')
+        if status != 200:
+            raise RuntimeError(f"/sample returned {status}: {body[:200]!r}")
+        windows.append(json.loads(body)['features'])
+    return windows
+
+
+class Workload:
+    def __init__(self, mix, windows, explain_options, unique_windows, seed=0):
+        """
+        mix: {endpoint: weight}
+        windows: feature windows for /predict and /explain bodies
+        explain_options: extra /explain fields (method, compact, ...)
+        unique_windows: perturb every body so no request hits a cache
+        """
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.windows = windows
+        self.unique_windows = unique_windows
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # Bodies are encoded once up front, so the client spends its time sending
+        self.bodies = {
+            'predict': [json.dumps({'features': w}).encode() for w in windows],
+            'explain': [json.dumps(dict(explain_options, features=w)).encode() for w in windows],
+        }
+        self.explain_options = explain_options
+
+    def next(self):
+        """(endpoint name, method, path, body)"""
+        with self.lock:
+            name = self.rng.choices(self.names, self.weights)[0]
+            index = self.rng.randrange(len(self.windows))
+            jitter = self.rng.random() * 1e-4
+        method, path = ENDPOINTS[name]
+        if method == 'GET':
+            return name, method, path, None
+        if not self.unique_windows:
+            return name, method, path, self.bodies[name][index]
+
+        window = [row[:] for row in self.windows[index]]
+        window[-1][0] += jitter
+        fields = {'features': window} if name == 'predict' else dict(self.explain_options, features=window)
+        return name, method, path, json.dumps(fields).encode()
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {} # endpoint -> [(latency s, status)]
+        self.recording = False
+
+    def add(self, name, latency, status):
+        if not self.recording:
+            return
+        with self.lock:
+            self.samples.setdefault(name, []).append((latency, status))
+
+
+def _call(client, workload, recorder, scheduled=None):
+    name, method, path, body = workload.next()
+    started = time.perf_counter() if scheduled is None else scheduled
+    try:
+        status, _ = client.request(method, path, body)
+    except Exception as e:
+        status = type(e).__name__
+    recorder.add(name, time.perf_counter() - started, status)
+
+
+def run_closed_loop(client, workload, recorder, concurrency, warmup, duration):
+    stop = time.perf_counter() + warmup + duration
+
+    def loop():
+        while time.perf_counter() < stop:
+            _call(client, workload, recorder)
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    time.sleep(warmup)
+    recorder.recording = True
+    measured_from = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - measured_from
+
+
+def run_open_loop(client, workload, recorder, rate, max_inflight, warmup, duration):
+    interval = 1.0 / rate
+    started = time.perf_counter()
+    record_from = started + warmup
+    stop = record_from + duration
+    measured_from = None
+
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        n = 0
+        while True:
+            scheduled = started + n * interval
+            if scheduled >= stop:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if measured_from is None and scheduled >= record_from:
+                recorder.recording = True
+                measured_from = scheduled
+            # Late submissions keep their scheduled time: the backlog shows up as latency
+            pool.submit(_call, client, workload, recorder, scheduled)
+            n += 1
+    return time.perf_counter() - (measured_from or stop)
+
+
+def summarize(samples, seconds):
+    latencies = np.array([latency for latency, _ in samples]) * 1000.0
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(n for status, n in statuses.items() if not (status.isdigit() and int(status) < 400))
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "throughput_rps": len(samples) / seconds if seconds > 0 else None,
+        "latency_ms": {
+            "mean": float(latencies.mean()),
+            "p50": float(np.percentile(latencies, 50)),
+            "p95": float(np.percentile(latencies, 95)),
+            "p99": float(np.percentile(latencies, 99)),
+            "max": float(latencies.max()),
+        } if len(latencies) else None,
+        "status": statuses,
+    }
+
+
+def print_summary(results):
+    print(f"\n{'endpoint':<10} {'requests':>9} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8}")
+    for name, r in list(results["endpoints"].items()) + [("total", results["total"])]:
+        lat = r["latency_ms"] or {"p50": float('nan'), "p95": float('nan'), "p99": float('nan')}
+        print(f"{name:<10} {r['requests']:>9} {r['throughput_rps'] or 0:>9.1f} {lat['p50']:>9.1f} "
+              f"{lat['p95']:>9.1f} {lat['p99']:>9.1f} {r['error_rate']:>7.1%}")
+
+
+def run_load_test(args):
+    mix = parse_mix(args.mix)
+    explain_options = {'method': args.explain_method, 'compact': args.explain_compact}
+
+    with tempfile.TemporaryDirectory(prefix='evflow-load-') as workdir:
+        proc = None
+        url = args.url
+        server_env = dict(kv.split('=', 1) for kv in args.server_env)
+        if url is None:
+            store_dir = args.store
+            if store_dir is None:
+                print("Building the processed store from the sample data...", flush=True)
+                store_dir = build_store(args.raw, workdir)
+            port = args.port or free_port()
+            url = f"http://127.0.0.1:{port}"
+            log_path = args.server_log or os.path.join(workdir, 'server.log')
+            print(f"Starting server on {url}...", flush=True)
+            proc = start_server(store_dir, port, server_env, log_path)
+
+        client = Client(url)
+        try:
+            wait_ready(client, proc=proc)
+            windows = fetch_windows(client, args.windows)
+            workload = Workload(mix, windows, explain_options, args.unique_windows, seed=args.seed)
+            recorder = Recorder()
+
+            if args.rate:
+                print(f"Open loop: {args.rate:g} req/s for {args.duration:g}s (+{args.warmup:g}s warm-up)...", flush=True)
+                seconds = run_open_loop(client, workload, recorder, args.rate, args.max_inflight, args.warmup, args.duration)
+            else:
+                print(f"Closed loop: {args.concurrency} clients for {args.duration:g}s (+{args.warmup:g}s warm-up)...", flush=True)
+                seconds = run_closed_loop(client, workload, recorder, args.concurrency, args.warmup, args.duration)
+
+            server_info = {}
+            try:
+                status, body = client.request('GET', '/health')
+                if status == 200:
+                    server_info = json.loads(body)
+            except Exception:
+                pass
+        finally:
+            if proc is not None:
+                stop_server(proc)
+                if proc.returncode not in (0, -15) and args.server_log is None:
+                    with open(os.path.join(workdir, 'server.log'), 'r') as f:
+                        print(f.read()[-4000:])
+
+    all_samples = [s for samples in recorder.samples.values() for s in samples]
+    return {
+        "meta": {
+            "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "url": args.url or "local",
+            "server_env": server_env,
+            "model_version": server_info.get("model_version"),
+            "mode": "open" if args.rate else "closed",
+            "rate": args.rate,
+            "concurrency": None if args.rate else args.concurrency,
+            "max_inflight": args.max_inflight if args.rate else None,
+            "duration_s": seconds,
+            "warmup_s": args.warmup,
+            "mix": mix,
+            "windows": args.windows,
+            "unique_windows": args.unique_windows,
+            "explain": explain_options,
+        },
+        "endpoints": {name: summarize(recorder.samples[name], seconds) for name in mix if name in recorder.samples},
+        "total": summarize(all_samples, seconds),
+    }
+
+
+def compare(current, baseline, threshold):
+    """
+    Flags endpoints whose throughput dropped, or whose p95 latency or error rate
+    grew, by more than `threshold` against the baseline. Returns the regressions.
+    """
+    regressions = []
+    for field in ("mode", "rate", "concurrency", "mix", "unique_windows", "explain", "server_env"):
+        if current["meta"].get(field) != baseline["meta"].get(field):
+            print(f"Warning: runs differ in {field}: {baseline['meta'].get(field)} -> {current['meta'].get(field)}")
+    print(f"\n{'endpoint':<10} {'rps':>19} {'p95 ms':>21} {'errors':>17}")
+    rows = list(current["endpoints"].items()) + [("total", current["total"])]
+    for name, r in rows:
+        b = baseline["total"] if name == "total" else baseline["endpoints"].get(name)
+        if b is None or not r["latency_ms"] or not b["latency_ms"]:
+            print(f"{name:<10} {'new':>19}")
+            continue
+        flags = []
+        if r["throughput_rps"] < b["throughput_rps"] * (1.0 - threshold):
+            flags.append("THROUGHPUT")
+        if r["latency_ms"]["p95"] > b["latency_ms"]["p95"] * (1.0 + threshold):
+            flags.append("P95")
+        if r["error_rate"] > b["error_rate"] + threshold * max(b["error_rate"], 0.01):
+            flags.append("ERRORS")
+        if flags:
+            regressions.append({"endpoint": name, "flags": flags})
+        print(f"{name:<10} {b['throughput_rps']:>8.1f} -> {r['throughput_rps']:>8.1f} "
+              f"{b['latency_ms']['p95']:>9.1f} -> {r['latency_ms']['p95']:>9.1f} "
+              f"{b['error_rate']:>6.1%} -> {r['error_rate']:>6.1%} {' '.join(flags)}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {threshold:.0%}.")
+    else:
+        print(f"\nNo regressions beyond {threshold:.0%}.")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EVFlow AI API load test")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=int, default=4, help="Closed loop: concurrent clients (default 4)")
+    load.add_argument('--rate', type=float, default=None, help="Open loop: requests per second")
+    parser.add_argument('--max-inflight', type=int, default=256, help="Open loop: most requests outstanding at once")
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION_S, help="Measured seconds")
+    parser.add_argument('--warmup', type=float, default=DEFAULT_WARMUP_S, help="Seconds of load before measuring")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument('--windows', type=int, default=WINDOWS, help="Distinct windows used in request bodies")
+    parser.add_argument('--unique-windows', action='store_true',
+                        help="Perturb every /predict and /explain body so no request is served from a cache")
+    parser.add_argument('--explain-method', default='shap', choices=['shap', 'integrated_gradients', 'gradient_input'])
+    parser.add_argument('--explain-compact', action=argparse.BooleanOptionalAction, default=True,
+                        help="Ask /explain for compact responses, as the dashboard does (default on)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help="Load an already running server instead of launching one")
+    parser.add_argument('--port', type=int, default=None, help="Port for the launched server (default: a free one)")
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help="Environment for the launched server, e.g. EVFLOW_WORKERS=2 (repeatable)")
+    parser.add_argument('--store', help="Existing processed store for the launched server (default: built from --raw)")
+    parser.add_argument('--raw', default=RAW_FILE, help="Raw session export the store is built from")
+    parser.add_argument('--server-log', help="Write the launched server's output here")
+    parser.add_argument('--output', help="Write results JSON here")
+    parser.add_argument('--results', help="Compare an existing results JSON instead of running")
+    parser.add_argument('--baseline', help="Results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative change flagged as a regression (default 0.10)")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS) # Server process
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        _serve(args.store, '127.0.0.1', args.port)
+        return 0
+
+    if args.results:
+        with open(args.results, 'r') as f:
+            current = json.load(f)
+    else:
+        current = run_load_test(args)
+        print_summary(current)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(current, f, indent=2)
+            print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,473 @@
+"""
+Offline benchmarks for the pipeline stages and the inference hot paths.
+
+    python benchmarks/run.py --output benchmarks/results.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json
+    python benchmarks/run.py --results new.json --baseline old.json   # compare only
+
+Every benchmark runs in its own (spawned) process so peak RSS is per benchmark.
+Peak RSS includes the interpreter and imports (torch alone is a few hundred MB),
+so compare it between runs rather than reading it as an absolute cost.
+
+Data scales are synthetic: scale 2 replays the raw session export twice, with
+the copy's station names suffixed so the stations stay distinct; scale 0.25
+keeps the first quarter of the sessions.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Repo root for process_data / backend, ml/ for the script-style training modules
+sys.path.insert(0, ROOT)
+sys.path.insert(1, os.path.join(ROOT, 'ml'))
+
+RAW_FILE = os.path.join(ROOT, 'data', 'raw', 'ev_data.xlsx.csv')
+MODEL_PATH = os.path.join(ROOT, 'ml', 'model.pth')
+METADATA_PATH = os.path.join(ROOT, 'ml', 'metadata.json')
+BACKGROUND_PATH = os.path.join(ROOT, 'ml', 'background.pt')
+SCALER_PATH = os.path.join(ROOT, 'data', 'processed', 'scaler.pkl')
+
+DEFAULT_SCALES = [0.25, 1.0]
+BATCH_SIZES = [1, 4, 16, 64, 256, 1024]
+MIN_TIME_S = 1.0 # Inference benchmarks repeat until at least this much time has passed
+EXPLAIN_WINDOWS = 10
+DEFAULT_THRESHOLD = 0.10 # Relative slowdown / memory growth flagged as a regression
+
+# Stage pickles passed between the process_data benchmarks of one scale
+LOADED = 'sessions.pkl'
+GRIDS = 'grids.pkl'
+FEATURES = 'features.pkl'
+STORE = 'store'
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, in MB (None if unavailable)."""
+    # Linux: VmHWM is reset on exec, while ru_maxrss would report the
+    # spawning parent's peak if that was higher
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError: # Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def _repeat(fn, min_time=MIN_TIME_S):
+    # Warm up once, then call until min_time has passed. Returns (calls, seconds).
+    fn()
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return calls, elapsed
+
+
+# --- Benchmarks ---------------------------------------------------------------
+# Each one runs in a fresh process and returns a list of
+# {"name", "wall_s", "items", "unit"} dicts; throughput and RSS are added by the runner.
+
+def bench_load_sessions(workdir, raw_file):
+    import process_data as pdata
+
+    started = time.perf_counter()
+    df = pdata.load_sessions(raw_file)
+    wall = time.perf_counter() - started
+
+    df.to_pickle(os.path.join(workdir, LOADED))
+    return [{"name": "process_data.load_sessions", "wall_s": wall, "items": len(df), "unit": "sessions/s"}]
+
+
+def bench_reconstruct(workdir):
+    import pandas as pd
+    import process_data as pdata
+
+    df = pd.read_pickle(os.path.join(workdir, LOADED))
+
+    started = time.perf_counter()
+    all_events, station_capacity = pdata.build_events(df)
+    full_df = pdata.reconstruct_station_grids(all_events, station_capacity, df['Station Name'].unique())
+    wall = time.perf_counter() - started
+
+    full_df.to_pickle(os.path.join(workdir, GRIDS))
+    return [{"name": "process_data.reconstruct", "wall_s": wall, "items": len(full_df), "unit": "intervals/s"}]
+
+
+def bench_engineer_features(workdir):
+    import pandas as pd
+    import process_data as pdata
+
+    full_df = pd.read_pickle(os.path.join(workdir, GRIDS))
+
+    started = time.perf_counter()
+    full_df = pdata.engineer_features(full_df)
+    wall = time.perf_counter() - started
+
+    full_df.to_pickle(os.path.join(workdir, FEATURES))
+    return [{"name": "process_data.engineer_features", "wall_s": wall, "items": len(full_df), "unit": "rows/s"}]
+
+
+def bench_scale_and_encode(workdir):
+    import pandas as pd
+    import process_data as pdata
+    from ml.store import write_store
+
+    full_df = pd.read_pickle(os.path.join(workdir, FEATURES))
+
+    started = time.perf_counter()
+    full_df, _, _ = pdata.scale_and_encode(full_df)
+    wall = time.perf_counter() - started
+
+    # Same columns as process_data writes, for the dataset / training benchmarks
+    final_cols = [
+        'timestamp', 'Station Name', 'Station_ID_Encoded',
+        'Available Ports', 'Energy (kWh)',
+        'Hour', 'DayOfWeek', 'Month', 'IsWeekend',
+        'Energy_Roll_3', 'Energy_Roll_6',
+        'future_energy', 'future_ports'
+    ]
+    full_df = full_df[final_cols]
+
+    started = time.perf_counter()
+    write_store(full_df, os.path.join(workdir, STORE))
+    write_wall = time.perf_counter() - started
+
+    return [
+        {"name": "process_data.scale_and_encode", "wall_s": wall, "items": len(full_df), "unit": "rows/s"},
+        {"name": "process_data.write_store", "wall_s": write_wall, "items": len(full_df), "unit": "rows/s"},
+    ]
+
+
+def _training_frame(workdir):
+    # Same columns and class mapping as train.py
+    from features import FEATURE_COLS
+    from store import ProcessedStore
+
+    df = ProcessedStore(os.path.join(workdir, STORE)).read(
+        columns=['timestamp', 'Station Name'] + FEATURE_COLS + ['future_energy', 'future_ports']
+    )
+    unique_vals = sorted(df['future_ports'].unique())
+    val_to_class = {v: i for i, v in enumerate(unique_vals)}
+    df['future_ports_class'] = df['future_ports'].map(val_to_class)
+    return df, len(unique_vals)
+
+
+def bench_dataset(workdir):
+    from dataset import EVDataSequence
+    from train import SEQ_LENGTH
+
+    df, _ = _training_frame(workdir)
+
+    started = time.perf_counter()
+    dataset = EVDataSequence(df, seq_length=SEQ_LENGTH, target_cols=['future_energy', 'future_ports_class'])
+    wall = time.perf_counter() - started
+
+    return [{"name": "dataset.build", "wall_s": wall, "items": len(df), "unit": "rows/s",
+             "windows": len(dataset)}]
+
+
+def bench_train_epoch(workdir, max_samples=None):
+    import torch
+    import torch.nn as nn
+    import torch.optim as optim
+    from torch.utils.data import DataLoader
+    from dataset import EVDataSequence, WindowBatchSampler, collate_batch, split_indices
+    from model import EVFlowGRU
+    import train
+
+    df, num_classes = _training_frame(workdir)
+    dataset = EVDataSequence(df, seq_length=train.SEQ_LENGTH, target_cols=['future_energy', 'future_ports_class'])
+
+    # Same split and loader as train.py; the cap keeps large scales quick
+    indices, _ = split_indices(len(dataset), train_fraction=0.8)
+    if max_samples is not None:
+        indices = indices[:max_samples]
+    size = len(indices)
+    sampler = WindowBatchSampler(indices, train.BATCH_SIZE, shuffle=True)
+    loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_batch)
+
+    torch.manual_seed(0)
+    model = EVFlowGRU(len(dataset.feature_cols), train.HIDDEN_DIM, train.NUM_LAYERS, num_classes)
+    optimizer = optim.Adam(model.parameters(), lr=train.LEARNING_RATE)
+
+    started = time.perf_counter()
+    train.train_epoch(model, loader, optimizer, nn.MSELoss(), nn.CrossEntropyLoss(), torch.device('cpu'))
+    wall = time.perf_counter() - started
+
+    return [{"name": "train.epoch", "wall_s": wall, "items": size, "unit": "samples/s",
+             "torch_threads": torch.get_num_threads()}]
+
+
+def _service():
+    # Repo-relative artifacts instead of the deployment paths in service.py
+    from backend import service
+
+    service.MODEL_PATH = MODEL_PATH
+    service.METADATA_PATH = METADATA_PATH
+    service.BACKGROUND_PATH = BACKGROUND_PATH
+    service.SCALER_PATH = SCALER_PATH
+    svc = service.ModelService()
+    svc.load_model()
+    return svc
+
+
+def _windows(svc, n, seed=0):
+    # Scaled features live in [0, 1], which is all the forward pass cares about
+    shape = (n, svc.metadata['seq_length'], svc.metadata['input_dim'])
+    return np.random.default_rng(seed).random(shape, dtype=np.float32)
+
+
+def bench_predict(batch_sizes=BATCH_SIZES):
+    svc = _service()
+    results = []
+
+    # Single windows go through predict() (and its micro-batcher) like /predict does
+    window = _windows(svc, 1)[0]
+    calls, wall = _repeat(lambda: svc.predict(window))
+    results.append({"name": "service.predict", "batch_size": 1, "wall_s": wall / calls,
+                    "items": 1, "unit": "windows/s", "calls": calls})
+
+    for batch_size in batch_sizes:
+        windows = _windows(svc, batch_size)
+        calls, wall = _repeat(lambda: svc.predict_batch(windows))
+        results.append({"name": "service.predict_batch", "batch_size": batch_size, "wall_s": wall / calls,
+                        "items": batch_size, "unit": "windows/s", "calls": calls})
+    return results
+
+
+def bench_explain(count=EXPLAIN_WINDOWS):
+    svc = _service()
+    windows = _windows(svc, count + 1)
+
+    # The first call builds the explainer; time distinct windows so every call misses the cache
+    svc.get_explanation(windows[0])
+    started = time.perf_counter()
+    for window in windows[1:]:
+        svc.get_explanation(window)
+    wall = time.perf_counter() - started
+
+    return [{"name": "service.get_explanation", "wall_s": wall / count, "items": 1,
+             "unit": "explanations/s", "calls": count}]
+
+
+# --- Runner --------------------------------------------------------------------
+
+def _child(conn, fn_name, kwargs):
+    try:
+        results = globals()[fn_name](**kwargs)
+        rss = peak_rss_mb()
+        for r in results:
+            r["peak_rss_mb"] = rss
+        conn.send(("ok", results))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def run_isolated(fn_name, **kwargs):
+    """Runs one benchmark function in a fresh process and returns its results."""
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(child, fn_name, kwargs))
+    proc.start()
+    child.close()
+    try:
+        status, payload = parent.recv()
+    except EOFError:
+        status, payload = "error", "benchmark process died"
+    proc.join()
+    if status != "ok":
+        raise RuntimeError(f"{fn_name} failed: {payload}")
+    return payload
+
+
+def make_scaled_input(raw_file, scale, out_path):
+    """Writes a synthetic session export `scale` times the size of raw_file."""
+    import pandas as pd
+
+    df = pd.read_csv(raw_file)
+    n = int(round(len(df) * scale))
+    if n < 1:
+        raise ValueError(f"Scale {scale} leaves no sessions")
+
+    copies = []
+    for copy in range(-(-n // len(df))):
+        part = df.iloc[:min(len(df), n - copy * len(df))].copy()
+        if copy:
+            part['Station Name'] = part['Station Name'] + f' [x{copy}]'
+        copies.append(part)
+    pd.concat(copies, ignore_index=True).to_csv(out_path, index=False)
+    return n
+
+
+def _finish(result, scale):
+    result["scale"] = scale
+    result["throughput"] = result["items"] / result["wall_s"] if result["wall_s"] > 0 else None
+    return result
+
+
+def run_benchmarks(args):
+    results = []
+
+    def record(items, scale=None):
+        for r in items:
+            r = _finish(r, scale)
+            results.append(r)
+            label = r["name"] + (f"[bs={r['batch_size']}]" if "batch_size" in r else "")
+            scale_label = f" @ scale {scale:g}" if scale is not None else ""
+            rss = f"{r['peak_rss_mb']:.0f} MB" if r["peak_rss_mb"] is not None else "n/a"
+            print(f"  {label}{scale_label}: {r['wall_s']:.4f}s, "
+                  f"{r['throughput']:.1f} {r['unit']}, peak RSS {rss}", flush=True)
+
+    only = set(args.only) if args.only else None
+
+    def wanted(group):
+        return only is None or group in only
+
+    pipeline_groups = {'process_data', 'dataset', 'train'}
+    if only is None or only & pipeline_groups:
+        for scale in args.scales:
+            print(f"Scale {scale:g}...", flush=True)
+            with tempfile.TemporaryDirectory(prefix='evflow-bench-') as workdir:
+                raw_file = os.path.join(workdir, 'sessions.csv')
+                make_scaled_input(args.raw, scale, raw_file)
+
+                # The later stages need the earlier stages' output, so they always run
+                record(run_isolated('bench_load_sessions', workdir=workdir, raw_file=raw_file), scale)
+                record(run_isolated('bench_reconstruct', workdir=workdir), scale)
+                record(run_isolated('bench_engineer_features', workdir=workdir), scale)
+                record(run_isolated('bench_scale_and_encode', workdir=workdir), scale)
+                if wanted('dataset'):
+                    record(run_isolated('bench_dataset', workdir=workdir), scale)
+                if wanted('train'):
+                    record(run_isolated('bench_train_epoch', workdir=workdir,
+                                        max_samples=args.max_train_samples), scale)
+
+    # Inference does not depend on the data scale
+    if wanted('predict'):
+        print("Inference...", flush=True)
+        record(run_isolated('bench_predict', batch_sizes=args.batch_sizes))
+    if wanted('explain'):
+        record(run_isolated('bench_explain', count=args.explain_windows))
+
+    return results
+
+
+def _key(r):
+    return (r["name"], r.get("scale"), r.get("batch_size"))
+
+
+def compare(current, baseline, threshold):
+    """
+    Flags results slower (throughput) or hungrier (peak RSS) than the baseline
+    by more than `threshold`. Returns the list of regressions.
+    """
+    base = {_key(r): r for r in baseline["results"]}
+    regressions = []
+
+    print(f"\n{'benchmark':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for r in current["results"]:
+        b = base.get(_key(r))
+        label = r["name"]
+        if r.get("batch_size") is not None:
+            label += f"[bs={r['batch_size']}]"
+        if r.get("scale") is not None:
+            label += f" @ {r['scale']:g}"
+        if b is None:
+            print(f"{label:<48} {'-':>12} {r['throughput']:>12.1f} {'new':>8}")
+            continue
+
+        change = r["throughput"] / b["throughput"] - 1.0
+        flags = []
+        if change < -threshold:
+            flags.append("SLOWER")
+        if r.get("peak_rss_mb") and b.get("peak_rss_mb") and r["peak_rss_mb"] > b["peak_rss_mb"] * (1.0 + threshold):
+            flags.append(f"RSS {b['peak_rss_mb']:.0f}->{r['peak_rss_mb']:.0f} MB")
+        if flags:
+            regressions.append({"benchmark": label, "throughput_change": change, "flags": flags})
+
+        print(f"{label:<48} {b['throughput']:>12.1f} {r['throughput']:>12.1f} {change:>+7.1%} {' '.join(flags)}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {threshold:.0%}.")
+    else:
+        print(f"\nNo regressions beyond {threshold:.0%}.")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EVFlow AI offline benchmarks")
+    parser.add_argument('--scales', type=float, nargs='+', default=DEFAULT_SCALES,
+                        help="Data scales relative to the raw session export")
+    parser.add_argument('--only', nargs='+', choices=['process_data', 'dataset', 'train', 'predict', 'explain'],
+                        help="Run only these benchmark groups")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES)
+    parser.add_argument('--max-train-samples', type=int, default=None,
+                        help="Cap the training epoch at this many windows (default: the full 80%% split)")
+    parser.add_argument('--explain-windows', type=int, default=EXPLAIN_WINDOWS)
+    parser.add_argument('--raw', default=RAW_FILE, help="Raw session export the scales are built from")
+    parser.add_argument('--output', help="Write results JSON here")
+    parser.add_argument('--results', help="Compare an existing results JSON instead of running")
+    parser.add_argument('--baseline', help="Results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative change flagged as a regression (default 0.10)")
+    args = parser.parse_args(argv)
+
+    if args.results:
+        with open(args.results, 'r') as f:
+            current = json.load(f)
+    else:
+        import torch
+
+        current = {
+            "meta": {
+                "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "torch": torch.__version__,
+                "torch_threads": torch.get_num_threads(),
+                "scales": args.scales,
+            },
+            "results": run_benchmarks(args),
+        }
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(current, f, indent=2)
+            print(f"Results saved to {args.output}")
+        elif not args.baseline:
+            print(json.dumps(current, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -44,7 +44,7 @@ function App() {
             setPrediction(predRes.data);
 
             // 3. Explain
-            const explainRes = await axios.post(`${API_URL}/explain`, { features });
+            const explainRes = await axios.post(`${API_URL}/explain`, { features, compact: true });
             setExplanation(explainRes.data);
 
         } catch (e) {
@@ -150,6 +150,7 @@ function App() {
                             <div className="lg:col-span-3">
                                 <FeatureImportance
                                     shapValues={explanation?.shap_values}
+                                    featureImportance={explanation?.feature_importance}
                                     featureNames={explanation?.feature_names}
                                 />
                             </div>
@@ -2,10 +2,10 @@ import React from 'react';
 import { BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer, Cell } from 'recharts';
 import { Target } from 'lucide-react';
 
-export default function FeatureImportance({ shapValues, featureNames }) {
+export default function FeatureImportance({ shapValues, featureImportance, featureNames }) {
     // shapValues is array of importance (absolute mean?) or just raw values for the sample.
     // We'll show absolute magnitude.
-    if (!shapValues || !featureNames) return null;
+    if ((!shapValues && !featureImportance) || !featureNames) return null;
 
     // Flatten if needed or sum over time?
     // SHAP for sequence: (48, 8). We can average over time to get global importance for this sample.
@@ -19,6 +19,14 @@ export default function FeatureImportance({ shapValues, featureNames }) {
     // Safe aggregation
     const getImportance = () => {
         try {
+            // Compact responses already carry the per-feature sum of |SHAP| over the window
+            if (featureImportance) {
+                return featureNames.map(name => ({
+                    name,
+                    value: (featureImportance[name] || 0) / 48 // Average, same scale as below
+                })).sort((a, b) => b.value - a.value);
+            }
+
             if (!Array.isArray(shapValues) || shapValues.length === 0) return [];
             const numFeats = shapValues[0].length;
             const importance = new Array(numFeats).fill(0);
@@ -1,11 +1,11 @@
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 import numpy as np
 
 class EVDataSequence(Dataset):
     def __init__(self, df, seq_length=48, target_cols=['future_energy', 'future_ports']):
         self.seq_length = seq_length
-        self.df = df
+        # The DataFrame is not kept: DataLoader workers only need the tensors below
         
         # Features to Use
         self.feature_cols = [
@@ -24,41 +24,100 @@ class EVDataSequence(Dataset):
         ]
         
         # We need to create sequences per STATION.
-        # It's cleaner to pre-process sequences into a list or index map.
-        self.sequences = []
-        self.targets = []
+        # Instead of materialising every (48, 8) window (~48x the data), keep ONE
+        # contiguous float32 tensor with all stations back to back and an index of
+        # where each window starts. Windows are then views into that tensor.
+        df_sorted = df.dropna(subset=['Station Name']).sort_values(by=['Station Name', 'timestamp'])
         
-        station_groups = df.groupby('Station Name')
+        self.data = torch.from_numpy(np.ascontiguousarray(df_sorted[self.feature_cols].values, dtype=np.float32))
+        self.target_data = torch.from_numpy(np.ascontiguousarray(df_sorted[target_cols].values, dtype=np.float32))
         
-        for name, group in station_groups:
-            # Sort by time just in case
-            group = group.sort_values('timestamp')
-            
-            data_values = group[self.feature_cols].values.astype(np.float32)
-            target_values = group[target_cols].values.astype(np.float32)
-            
-            num_samples = len(group) - seq_length
-            
+        # Row ranges per station (each station is contiguous after the sort)
+        names = df_sorted['Station Name'].values
+        change = np.flatnonzero(names[1:] != names[:-1]) + 1
+        station_starts = np.r_[0, change] if len(names) else np.array([], dtype=int)
+        station_ends = np.r_[change, len(names)] if len(names) else np.array([], dtype=int)
+        
+        self.stations = [names[s] for s in station_starts]
+        # Per-station tensors are contiguous slices (views) of self.data
+        self.station_data = [self.data[s:e] for s, e in zip(station_starts, station_ends)]
+        
+        # Flat index of (station, offset) pairs, one per sample.
+        # Input: rows [offset : offset+seq_len] of the station.
+        # Target: row offset+seq_len-1. In processed_data.csv 'future_energy' is ALREADY
+        # shifted (-1), so row T contains input features at T and the target for T+1;
+        # the target of a window is therefore the one stored on its LAST row.
+        station_ids = []
+        offsets = []
+        for station_id, (s, e) in enumerate(zip(station_starts, station_ends)):
+            num_samples = (e - s) - seq_length
             if num_samples <= 0:
                 continue
-                
-            for i in range(num_samples):
-                # Input: [i : i+seq_len]
-                seq = data_values[i : i+seq_length]
-                # Target: [i+seq_len-1] (This is the target corresponding to the END of the sequence? 
-                # OR is target[i] corresponding to predicting i+1?
-                # In processed_data.csv, 'future_energy' is ALREADY shifted (-1).
-                # So row T contains input features at T and target for T+1.
-                # If we input sequence T-47 ... T, we want to predict T+1.
-                # Row T contains `future_energy` (T+1).
-                # So we want the target from the LAST row of the sequence.
-                target = target_values[i + seq_length - 1]
-                
-                self.sequences.append(seq)
-                self.targets.append(target)
+            station_ids.append(np.full(num_samples, station_id, dtype=np.int64))
+            offsets.append(np.arange(num_samples, dtype=np.int64))
+        
+        if station_ids:
+            self.index = torch.from_numpy(np.stack([np.concatenate(station_ids), np.concatenate(offsets)], axis=1))
+        else:
+            self.index = torch.empty((0, 2), dtype=torch.int64)
+        
+        # Absolute start row in self.data for every sample
+        station_starts_t = torch.as_tensor(station_starts, dtype=torch.int64)
+        self.starts = station_starts_t[self.index[:, 0]] + self.index[:, 1] if len(self.index) else torch.empty(0, dtype=torch.int64)
+        self._steps = torch.arange(seq_length)
                 
     def __len__(self):
-        return len(self.sequences)
+        return len(self.index)
     
     def __getitem__(self, idx):
-        return torch.tensor(self.sequences[idx]), torch.tensor(self.targets[idx])
+        # Strided view, no copy
+        start = int(self.starts[idx])
+        return self.data[start : start+self.seq_length], self.target_data[start + self.seq_length - 1]
+    
+    def __getitems__(self, indices):
+        # Batched fetch used by the DataLoader: one gather for the whole batch
+        starts = self.starts[torch.as_tensor(indices, dtype=torch.int64)]
+        rows = starts.unsqueeze(1) + self._steps # (batch, seq_len)
+        return self.data[rows], self.target_data[starts + self.seq_length - 1]
+
+def collate_batch(batch):
+    # __getitems__ already returns stacked (X, y) tensors
+    return batch
+
+class WindowBatchSampler(Sampler):
+    def __init__(self, indices, batch_size, shuffle=False, drop_last=False, seed=0):
+        """
+        Yields whole batches of window indices, so the DataLoader makes one
+        __getitems__ gather per batch instead of one __getitem__ per window.
+        indices: the window indices of this split (e.g. from split_indices)
+        """
+        self.indices = torch.as_tensor(indices, dtype=torch.int64)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        if self.shuffle:
+            # A new, reproducible order every epoch (also inside persistent workers)
+            generator = torch.Generator().manual_seed(self.seed + self.epoch)
+            order = self.indices[torch.randperm(len(self.indices), generator=generator)]
+            self.epoch += 1
+        else:
+            order = self.indices
+        for batch in torch.split(order, self.batch_size):
+            if self.drop_last and len(batch) < self.batch_size:
+                return
+            yield batch.tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.indices) // self.batch_size
+        return -(-len(self.indices) // self.batch_size)
+
+def split_indices(n, train_fraction=0.8, seed=0):
+    """Random train/validation split of n window indices: (train, val) tensors."""
+    perm = torch.randperm(n, generator=torch.Generator().manual_seed(seed))
+    train_size = int(train_fraction * n)
+    return perm[:train_size], perm[train_size:]
@@ -1,7 +1,25 @@
 import torch
-import shap
+import torch.nn as nn
 import numpy as np
 
+# Output heads of EVFlowGRU, in the order forward() returns them
+HEADS = ('energy', 'ports')
+
+# 'shap': sampled GradientExplainer (default)
+# 'integrated_gradients': path integral of the gradient from the background-mean window to x
+# 'gradient_input': gradient at x times x, a single gradient evaluation
+METHODS = ('shap', 'integrated_gradients', 'gradient_input')
+
+class HeadWrapper(nn.Module):
+    """Exposes a single output head of the model as its own module."""
+    def __init__(self, model, head_index):
+        super(HeadWrapper, self).__init__()
+        self.model = model
+        self.head_index = head_index
+        
+    def forward(self, x):
+        return self.model(x)[self.head_index]
+
 class EVFlowExplainer:
     def __init__(self, model, background_data):
         """
@@ -14,40 +32,133 @@ class EVFlowExplainer:
         # Ensure model is in eval mode
         self.model.eval()
         
-        # GradientExplainer is suitable for PyTorch models
-        # We need to wrap model output to return a single tensor or handle tuple.
-        # SHAP expects model(*args) -> tensor.
-        # Our model returns (energy, ports).
-        # We'll create a wrapper for Energy explanation and one for Ports explanation?
-        # Or just explain Energy for now as it's the primary regression target.
-        
+        # GradientExplainer is suitable for PyTorch models, but it only takes the
+        # PyTorch code path for nn.Module inputs, and SHAP expects model(*args) -> tensor.
+        # Our model returns (energy, ports), so each head gets its own wrapper module.
+        # Explainers are built lazily so a caller that only wants one head
+        # never pays for the other.
         self.background = background_data.to(self.device)
-        self.explainer_energy = shap.GradientExplainer(self.energy_wrapper, self.background)
-        # Ports is ArgMax? Or logits? GradientExplainer works on logits.
-        self.explainer_ports = shap.GradientExplainer(self.ports_wrapper, self.background)
-        
-    def energy_wrapper(self, x):
-        e, _ = self.model(x)
-        return e
+        self.explainers = {}
         
-    def ports_wrapper(self, x):
-        _, p = self.model(x)
-        return p
+    def explainer_for(self, head):
+        if head not in HEADS:
+            raise ValueError(f"Unknown head '{head}', expected one of {HEADS}")
+        if head not in self.explainers:
+            # Imported here: shap (and the scipy/sklearn it pulls in) is slow to
+            # import and only needed once something is actually explained
+            import shap
+            
+            # Ports uses logits, GradientExplainer works on those directly.
+            wrapper = HeadWrapper(self.model, HEADS.index(head))
+            self.explainers[head] = shap.GradientExplainer(wrapper, self.background)
+        return self.explainers[head]
         
-    def explain(self, x):
+    def explain(self, x, heads=HEADS, method='shap', steps=32):
         """
         x: Input tensor (batch, seq_len, dim)
-        Returns: Dict with shap values for energy and ports
+        heads: Which outputs to explain ('energy', 'ports')
+        method: One of METHODS. The gradient methods return attributions in the
+                same layout as SHAP values.
+        steps: Interpolation steps for 'integrated_gradients'
+        Returns: Dict with shap values for the requested heads
         """
-        x = x.to(self.device).requires_grad_(True)
+        if method not in METHODS:
+            raise ValueError(f"Unknown method '{method}', expected one of {METHODS}")
+        if method != 'shap':
+            baseline = self.background.mean(dim=0) if method == 'integrated_gradients' else torch.zeros_like(self.background[0])
+            return gradient_attributions(self.model, x.to(self.device), baseline, heads, steps if method == 'integrated_gradients' else 1)
         
-        # SHAP values shape: (batch, seq_len, dim)
-        shap_energy = self.explainer_energy.shap_values(x)
+        # detach() so the caller's tensor is not flagged as requiring grad
+        x = x.detach().to(self.device).requires_grad_(True)
+        result = {}
         
-        # For multi-class ports, shap_values is a list of tensors (one per class)
-        shap_ports = self.explainer_ports.shap_values(x)
+        if 'energy' in heads:
+            # SHAP values shape: (batch, seq_len, dim, 1)
+            result["energy_shap"] = np.array(self.explainer_for('energy').shap_values(x))
         
-        return {
-            "energy_shap": np.array(shap_energy), 
-            "ports_shap": [np.array(s) for s in shap_ports]
+        if 'ports' in heads:
+            # For multi-class ports, one (seq_len, dim, classes) array per sample
+            shap_ports = self.explainer_for('ports').shap_values(x)
+            result["ports_shap"] = [np.array(s) for s in shap_ports]
+        
+        return result
+
+def gradient_attributions(model, x, baseline, heads=HEADS, steps=32):
+    """
+    Integrated gradients of the requested heads for a batch of windows, in one
+    forward and one backward pass.
+
+    x: (batch, seq_len, dim); baseline: (seq_len, dim) reference window
+    steps: Midpoint Riemann steps along baseline -> x. With steps=1 and a zero
+           baseline this is plain gradient x input.
+
+    Every (head output, interpolation step, window) combination is one row of a
+    single batch; each row backpropagates only its own output, so one
+    autograd.grad call gives every gradient. autograd.grad also leaves the
+    model's parameter .grad untouched. Returns the same dict as
+    EVFlowExplainer.explain: energy_shap (batch, seq_len, dim, 1) and ports_shap,
+    one (seq_len, dim, classes) array per window.
+    """
+    for head in heads:
+        if head not in HEADS:
+            raise ValueError(f"Unknown head '{head}', expected one of {HEADS}")
+    x = x.detach()
+    batch, seq_len, dim = x.shape
+    num_classes = model.clf_head[-1].out_features
+
+    # Output columns: energy is 0, port class c is 1 + c
+    columns = ([0] if 'energy' in heads else []) + ([1 + c for c in range(num_classes)] if 'ports' in heads else [])
+    alphas = (torch.arange(steps, dtype=x.dtype, device=x.device) + 0.5) / steps
+    delta = x - baseline
+
+    # (columns, steps, batch, seq_len, dim), flattened into one batch
+    points = baseline + alphas.view(-1, 1, 1, 1) * delta
+    inputs = points.unsqueeze(0).expand(len(columns), -1, -1, -1, -1).reshape(-1, seq_len, dim)
+    inputs = inputs.detach().requires_grad_(True)
+
+    energy, ports = model(inputs)
+    outputs = torch.cat([energy, ports], dim=1)
+    row_columns = torch.tensor(columns, device=x.device).repeat_interleave(steps * batch)
+    selected = outputs.gather(1, row_columns.unsqueeze(1)).sum()
+    grads, = torch.autograd.grad(selected, inputs)
+
+    # Average gradient along the path, times the distance covered
+    attributions = grads.view(len(columns), steps, batch, seq_len, dim).mean(dim=1) * delta
+    attributions = attributions.detach().cpu().numpy()
+
+    result = {}
+    if 'energy' in heads:
+        result["energy_shap"] = attributions[0][..., None]
+    if 'ports' in heads:
+        ports_attr = np.moveaxis(attributions[-num_classes:], 0, -1) # (batch, seq_len, dim, classes)
+        result["ports_shap"] = [a for a in ports_attr]
+    return result
+
+def feature_importance(attributions, feature_names):
+    """
+    attributions: (seq_len, dim) or (seq_len, dim, classes) for one window
+    Returns {feature: sum of |attribution| over the window}, per class if there is a class axis.
+    """
+    totals = np.abs(np.asarray(attributions)).sum(axis=0)
+    return {name: totals[i].tolist() for i, name in enumerate(feature_names)}
+
+def top_contributions(shap_values, feature_names, k=5):
+    """
+    shap_values: (seq_len, dim) SHAP values for one window and one output
+    Returns the k largest |SHAP| cells as dicts (feature, step, value), largest
+    first. step counts back from the window's last row (0 = most recent).
+    """
+    shap_values = np.asarray(shap_values)
+    flat = np.abs(shap_values).ravel()
+    k = min(k, flat.size)
+    top = np.argpartition(flat, -k)[-k:] if k else np.array([], dtype=int)
+    top = top[np.argsort(-flat[top])]
+    seq_len, dim = shap_values.shape
+    return [
+        {
+            "feature": feature_names[idx % dim],
+            "step": int(seq_len - 1 - idx // dim),
+            "value": float(shap_values.flat[idx])
         }
+        for idx in top
+    ]
@@ -0,0 +1,120 @@
+import torch
+import torch.nn as nn
+import json
+import os
+import sys
+import time
+from dataset import EVDataSequence, split_indices
+from features import FEATURE_COLS
+from store import ProcessedStore
+from model import EVFlowGRU
+
+# Run after train.py: writes optimized inference artifacts next to model.pth
+# and checks them against the eager model on validation windows.
+
+# Config
+STORE_PATH = r'e:\EVFlow AI\data\processed\store'
+MODEL_PATH = r'e:\EVFlow AI\ml\model.pth'
+METADATA_PATH = r'e:\EVFlow AI\ml\metadata.json'
+TORCHSCRIPT_SAVE_PATH = r'e:\EVFlow AI\ml\model_ts.pt'
+QUANTIZED_SAVE_PATH = r'e:\EVFlow AI\ml\model_int8.pt'
+REPORT_SAVE_PATH = r'e:\EVFlow AI\ml\export_report.json'
+
+PARITY_WINDOWS = 512
+# Max allowed deviation from eager: |energy| in kWh, and share of windows whose port class may differ
+TOLERANCE = {
+    "torchscript": {"energy": 1e-4, "ports_mismatch": 0.0},
+    "int8": {"energy": 0.05, "ports_mismatch": 0.02},
+}
+
+def load_eager_model():
+    with open(METADATA_PATH, 'r') as f:
+        metadata = json.load(f)
+    model = EVFlowGRU(metadata['input_dim'], metadata['hidden_dim'], metadata['num_layers'], metadata['num_classes'])
+    model.load_state_dict(torch.load(MODEL_PATH, map_location=torch.device('cpu')))
+    model.eval()
+    return model, metadata
+
+def validation_windows(metadata):
+    df = ProcessedStore(STORE_PATH).read(columns=['timestamp', 'Station Name'] + FEATURE_COLS + ['future_energy', 'future_ports'])
+    dataset = EVDataSequence(df, seq_length=metadata['seq_length'])
+    # Same split as train.py: the parity check never sees training windows.
+    # val_indices is already a random permutation, so its head is a random sample.
+    _, val_indices = split_indices(len(dataset), train_fraction=0.8)
+    windows, _ = dataset.__getitems__(val_indices[:PARITY_WINDOWS].tolist())
+    return windows
+
+def to_torchscript(model, example):
+    # Traced (the forward has no data-dependent control flow), frozen and
+    # optimized for inference. The batch dimension stays dynamic.
+    traced = torch.jit.trace(model, example)
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+def to_int8(model, example):
+    # Dynamic quantization: int8 weights for the GRU and Linear layers,
+    # activations quantized on the fly. CPU only.
+    quantized = torch.ao.quantization.quantize_dynamic(model, {nn.GRU, nn.Linear}, dtype=torch.qint8)
+    return torch.jit.trace(quantized, example)
+
+def run(model, windows):
+    with torch.no_grad():
+        energy, logits = model(windows)
+    return energy.squeeze(1), torch.argmax(logits, dim=1)
+
+def latency_ms(model, windows, repeats=20):
+    with torch.no_grad():
+        model(windows) # Warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(windows)
+    return (time.perf_counter() - start) / repeats * 1000
+
+def export():
+    print("Loading model and validation windows...")
+    model, metadata = load_eager_model()
+    windows = validation_windows(metadata)
+    example = windows[:1]
+    
+    eager_energy, eager_ports = run(model, windows)
+    
+    report = {"parity_windows": len(windows), "eager_latency_ms": latency_ms(model, windows), "backends": {}}
+    passed = True
+    
+    for name, build, path in [
+        ("torchscript", to_torchscript, TORCHSCRIPT_SAVE_PATH),
+        ("int8", to_int8, QUANTIZED_SAVE_PATH),
+    ]:
+        print(f"Exporting {name}...")
+        module = build(model, example)
+        torch.jit.save(module, path)
+        
+        # Check the artifact as the service will load it
+        loaded = torch.jit.load(path)
+        energy, ports = run(loaded, windows)
+        
+        max_energy_diff = (energy - eager_energy).abs().max().item()
+        ports_mismatch = (ports != eager_ports).float().mean().item()
+        ok = max_energy_diff <= TOLERANCE[name]["energy"] and ports_mismatch <= TOLERANCE[name]["ports_mismatch"]
+        passed = passed and ok
+        
+        report["backends"][name] = {
+            "path": path,
+            "size_bytes": os.path.getsize(path),
+            "latency_ms": latency_ms(loaded, windows),
+            "max_energy_diff": max_energy_diff,
+            "ports_mismatch_rate": ports_mismatch,
+            "parity_ok": ok
+        }
+        print(f"  max |energy diff| = {max_energy_diff:.6f}, port class mismatch = {ports_mismatch:.4f} -> {'OK' if ok else 'FAILED'}")
+    
+    report["eager_size_bytes"] = os.path.getsize(MODEL_PATH)
+    with open(REPORT_SAVE_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    print(f"Export report saved to {REPORT_SAVE_PATH}")
+    if not passed:
+        print("Parity check FAILED, do not serve the exported artifacts.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    export()
@@ -0,0 +1,65 @@
+import numpy as np
+
+# Model input features, in the order the model sees them (see ml/dataset.py)
+FEATURE_COLS = [
+    'Available Ports', 
+    'Energy (kWh)', 
+    'Hour', 
+    'DayOfWeek', 
+    'Month', 
+    'IsWeekend', 
+    'Energy_Roll_3', 
+    'Energy_Roll_6'
+]
+
+# Columns the MinMaxScaler in process_data.py is fit on, in the scaler's order.
+# IsWeekend is left unscaled.
+SCALED_COLS = [
+    'Available Ports', 
+    'Energy (kWh)', 
+    'Energy_Roll_3', 
+    'Energy_Roll_6', 
+    'Hour', 'DayOfWeek', 'Month'
+]
+
+AVAILABLE_PORTS = FEATURE_COLS.index('Available Ports')
+ENERGY = FEATURE_COLS.index('Energy (kWh)')
+ENERGY_ROLL_3 = FEATURE_COLS.index('Energy_Roll_3')
+ENERGY_ROLL_6 = FEATURE_COLS.index('Energy_Roll_6')
+CALENDAR = [FEATURE_COLS.index(c) for c in ['Hour', 'DayOfWeek', 'Month', 'IsWeekend']]
+
+INTERVAL = np.timedelta64(15, 'm') # Grid step
+
+class FeatureScaler:
+    def __init__(self, scaler):
+        """
+        scaler: the fitted MinMaxScaler from scaler.pkl
+        
+        Applies the scaler to arrays laid out in FEATURE_COLS order (..., 8),
+        leaving the unscaled columns untouched. MinMaxScaler.transform is
+        x * scale_ + min_, so this is a single vectorized multiply-add.
+        """
+        positions = [FEATURE_COLS.index(c) for c in SCALED_COLS]
+        self.scale = np.ones(len(FEATURE_COLS), dtype=np.float64)
+        self.offset = np.zeros(len(FEATURE_COLS), dtype=np.float64)
+        self.scale[positions] = scaler.scale_
+        self.offset[positions] = scaler.min_
+        
+    def transform(self, raw):
+        return raw * self.scale + self.offset
+    
+    def inverse_transform(self, scaled):
+        return (scaled - self.offset) / self.scale
+
+def calendar_features(timestamps):
+    """
+    timestamps: datetime64 array of any shape
+    Returns (..., 4) raw Hour, DayOfWeek (0=Mon), Month (1-12), IsWeekend, same as process_data.py
+    """
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    days = timestamps.astype('datetime64[D]')
+    hour = (timestamps.astype('datetime64[h]') - days).astype(np.int64)
+    day_of_week = (days.astype(np.int64) + 3) % 7 # 1970-01-01 was a Thursday
+    month = timestamps.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    is_weekend = (day_of_week >= 5).astype(np.int64)
+    return np.stack([hour, day_of_week, month, is_weekend], axis=-1)
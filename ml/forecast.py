@@ -0,0 +1,74 @@
+import numpy as np
+import torch
+
+from ml.features import (
+    AVAILABLE_PORTS, ENERGY, ENERGY_ROLL_3, ENERGY_ROLL_6, CALENDAR, INTERVAL,
+    calendar_features
+)
+
+def rollout(model, feature_scaler, windows, last_timestamps, horizon, port_values):
+    """
+    Autoregressive multi-step forecast, vectorized over all windows.
+    
+    model: EVFlowGRU (eval mode)
+    feature_scaler: FeatureScaler built from scaler.pkl
+    windows: (batch, seq_len, 8) scaled feature windows, like /predict
+    last_timestamps: (batch,) datetime64 of the last row of each window
+    horizon: number of 15-min steps to roll forward
+    port_values: available-port count for each class index (metadata['unique_vals_scaled'])
+    
+    Each step predicts the next interval, turns the prediction back into a
+    feature row (predicted energy and ports, next calendar features, rolling
+    energy means) and slides the window by one. The model always sees a full
+    seq_len window, as in training.
+    """
+    window = torch.as_tensor(windows, dtype=torch.float32)
+    batch = window.shape[0]
+    timestamps = np.asarray(last_timestamps, dtype='datetime64[ns]')
+    port_values = np.asarray(port_values, dtype=np.float64)
+    
+    # Raw energy history (kWh) for the rolling features
+    raw_energy = feature_scaler.inverse_transform(window.numpy().astype(np.float64))[:, :, ENERGY]
+    
+    energies = np.zeros((batch, horizon))
+    probs = []
+    classes = np.zeros((batch, horizon), dtype=np.int64)
+    step_timestamps = []
+    
+    with torch.no_grad():
+        for step in range(horizon):
+            e_pred, p_logits = model(window)
+            p_probs = torch.softmax(p_logits, dim=1)
+            p_class = torch.argmax(p_logits, dim=1).numpy()
+            energy = e_pred.squeeze(1).numpy().astype(np.float64)
+            
+            energies[:, step] = energy
+            classes[:, step] = p_class
+            probs.append(p_probs.numpy())
+            
+            timestamps = timestamps + INTERVAL
+            step_timestamps.append(timestamps)
+            
+            if step == horizon - 1:
+                break
+            
+            # Build the raw feature row for the predicted interval.
+            # Rolling means use the intervals strictly before it (shift(1) in process_data.py).
+            raw_row = np.zeros((batch, window.shape[2]))
+            raw_row[:, AVAILABLE_PORTS] = port_values[p_class]
+            raw_row[:, ENERGY] = np.clip(energy, 0, None)
+            raw_row[:, ENERGY_ROLL_3] = raw_energy[:, -3:].mean(axis=1)
+            raw_row[:, ENERGY_ROLL_6] = raw_energy[:, -6:].mean(axis=1)
+            raw_row[:, CALENDAR] = calendar_features(timestamps)
+            
+            raw_energy = np.concatenate([raw_energy[:, 1:], raw_row[:, [ENERGY]]], axis=1)
+            
+            new_row = torch.as_tensor(feature_scaler.transform(raw_row), dtype=torch.float32)
+            window = torch.cat([window[:, 1:], new_row.unsqueeze(1)], dim=1)
+    
+    return {
+        "timestamps": np.stack(step_timestamps, axis=1),  # (batch, horizon)
+        "predicted_energy": energies,                      # (batch, horizon)
+        "predicted_ports_class": classes,                  # (batch, horizon)
+        "predicted_ports_probs": np.stack(probs, axis=1),  # (batch, horizon, classes)
+    }
@@ -0,0 +1,197 @@
+import torch
+import numpy as np
+import argparse
+import hashlib
+import json
+import os
+import time
+from dataset import EVDataSequence
+from explainability import EVFlowExplainer, METHODS
+from features import FEATURE_COLS
+from store import ProcessedStore
+from model import EVFlowGRU
+
+# Run after train.py: attributes every window of the processed store (or a date
+# range of it) and writes mean |attribution| per feature, overall and broken down
+# by station, hour of day and timestep. GET /explain/global serves the result.
+#
+# Stations are read from the store one at a time and their windows go through the
+# explainer in fixed-size chunks, so memory stays bounded by one station's columns
+# plus one chunk, whatever the size of the store.
+
+# Config
+STORE_PATH = r'e:\EVFlow AI\data\processed\store'
+MODEL_PATH = r'e:\EVFlow AI\ml\model.pth'
+METADATA_PATH = r'e:\EVFlow AI\ml\metadata.json'
+BACKGROUND_PATH = r'e:\EVFlow AI\ml\background.pt'
+GLOBAL_IMPORTANCE_SAVE_PATH = r'e:\EVFlow AI\ml\global_importance.json'
+
+CHUNK_SIZE = 16 # Windows per explainer call (--chunk-size); larger chunks only cost memory on CPU
+METHOD = 'integrated_gradients' # SHAP works too, but is ~20x slower per window
+IG_STEPS = 32
+
+class ImportanceAggregator:
+    def __init__(self, seq_length, num_features):
+        """
+        Running sums of |attribution| for one head. Every window adds its
+        per-feature total (sum over the window's timesteps), so the summary
+        holds means per window, comparable to /explain's compact feature_importance.
+        """
+        self.windows = 0
+        self.feature = np.zeros(num_features)
+        self.by_step = np.zeros((seq_length, num_features))
+        self.hour_windows = np.zeros(24, dtype=np.int64)
+        self.by_hour = np.zeros((24, num_features))
+        self.station_windows = {}
+        self.by_station = {}
+
+    def add(self, station, hours, attributions):
+        """
+        station: Station name of the chunk
+        hours: (n,) hour of day of each window's last row
+        attributions: (n, seq_len, dim) absolute attributions
+        """
+        per_window = attributions.sum(axis=1) # (n, dim)
+        self.windows += len(per_window)
+        self.feature += per_window.sum(axis=0)
+        self.by_step += attributions.sum(axis=0)
+        self.hour_windows += np.bincount(hours, minlength=24)
+        np.add.at(self.by_hour, hours, per_window)
+        self.station_windows[station] = self.station_windows.get(station, 0) + len(per_window)
+        self.by_station[station] = self.by_station.get(station, 0.0) + per_window.sum(axis=0)
+
+    def summary(self):
+        def mean(total, count):
+            return (total / count).tolist() if count else None
+        return {
+            "windows": int(self.windows),
+            "feature": mean(self.feature, self.windows),
+            # Step 0 is the window's last row, as in /explain's top_contributions
+            "by_step": mean(self.by_step[::-1], self.windows),
+            "by_hour": [
+                {"hour": hour, "windows": int(n), "feature": mean(self.by_hour[hour], n)}
+                for hour, n in enumerate(self.hour_windows)
+            ],
+            "by_station": [
+                {"station": station, "windows": int(n), "feature": mean(self.by_station[station], n)}
+                for station, n in self.station_windows.items()
+            ],
+        }
+
+def load_explainer():
+    with open(METADATA_PATH, 'r') as f:
+        metadata = json.load(f)
+    model = EVFlowGRU(metadata['input_dim'], metadata['hidden_dim'], metadata['num_layers'], metadata['num_classes'])
+    model.load_state_dict(torch.load(MODEL_PATH, map_location=torch.device('cpu')))
+    model.eval()
+
+    if os.path.exists(BACKGROUND_PATH):
+        background = torch.load(BACKGROUND_PATH, map_location=torch.device('cpu'))
+    else:
+        print(f"Warning: {BACKGROUND_PATH} not found, using a zeros background.")
+        background = torch.zeros((10, metadata['seq_length'], metadata['input_dim']))
+    return EVFlowExplainer(model, background), metadata
+
+def station_windows(store, station, seq_length, start=None, end=None, sample=1.0, rng=None):
+    """
+    Windows of one station as (EVDataSequence, indices, end timestamps), keeping the
+    windows whose last row falls in [start, end], and a random `sample` share of those.
+    """
+    df = store.read(columns=['timestamp', 'Station Name'] + FEATURE_COLS + ['future_energy', 'future_ports'], stations=[station])
+    if start is not None:
+        # Rows before start are still needed as the history of the first windows
+        df = df[df['timestamp'] >= start - np.timedelta64(15 * (seq_length - 1), 'm')]
+    if end is not None:
+        df = df[df['timestamp'] <= end]
+
+    dataset = EVDataSequence(df, seq_length=seq_length)
+    # One station, already time ordered: dataset rows are df's rows
+    ends = df['timestamp'].values[dataset.starts.numpy() + seq_length - 1]
+    keep = np.ones(len(ends), dtype=bool)
+    if start is not None:
+        keep &= ends >= start
+    indices = np.flatnonzero(keep)
+    if sample < 1.0:
+        # Random rather than every Nth window: a fixed stride would alias with the daily cycle
+        indices = np.sort(rng.choice(indices, size=int(round(len(indices) * sample)), replace=False))
+    return dataset, indices, ends[indices]
+
+def global_importance(heads=('energy',), method=METHOD, steps=IG_STEPS, chunk_size=CHUNK_SIZE,
+                      start=None, end=None, sample=1.0, seed=0, output=GLOBAL_IMPORTANCE_SAVE_PATH):
+    """
+    start, end: Optional datetime64 bounds on the windows' last row (e.g. one quarter)
+    sample: Share of the windows to attribute, drawn at random with `seed` (cheaper, approximate)
+    Returns the summary written to `output`.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}', expected one of {METHODS}")
+    explainer, metadata = load_explainer()
+    seq_length = metadata['seq_length']
+    store = ProcessedStore(STORE_PATH)
+    aggregators = {head: ImportanceAggregator(seq_length, len(FEATURE_COLS)) for head in heads}
+    rng = np.random.default_rng(seed)
+
+    started = time.time()
+    for station in store.stations:
+        dataset, indices, ends = station_windows(store, station, seq_length, start, end, sample, rng)
+        hours = ends.astype('datetime64[h]').astype(np.int64) % 24
+
+        for i in range(0, len(indices), chunk_size):
+            X, _ = dataset.__getitems__(indices[i : i + chunk_size].tolist())
+            attributions = explainer.explain(X, heads=heads, method=method, steps=steps)
+            chunk_hours = hours[i : i + chunk_size]
+            if 'energy' in heads:
+                aggregators['energy'].add(station, chunk_hours, np.abs(attributions['energy_shap'][..., 0]))
+            if 'ports' in heads:
+                # Summed over port classes
+                ports = np.stack([np.abs(a).sum(axis=-1) for a in attributions['ports_shap']])
+                aggregators['ports'].add(station, chunk_hours, ports)
+
+        print(f"{station}: {len(indices)} windows ({time.time() - started:.1f}s)")
+
+    with open(MODEL_PATH, 'rb') as f:
+        model_version = hashlib.sha1(f.read()).hexdigest()[:12]
+    summary = {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "model_version": model_version, # Compared with the served model by /explain/global
+        "method": method,
+        "steps": steps if method == 'integrated_gradients' else None,
+        "start": str(start.astype('datetime64[s]')) if start is not None else None,
+        "end": str(end.astype('datetime64[s]')) if end is not None else None,
+        "sample": sample,
+        "feature_names": FEATURE_COLS,
+        "seconds": round(time.time() - started, 1),
+        **{head: aggregators[head].summary() for head in heads},
+    }
+
+    # Written next to the model and swapped in atomically: the API may be reading it
+    tmp = output + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(summary, f)
+    os.replace(tmp, output)
+    print(f"Attributed {summary[heads[0]]['windows']} windows in {summary['seconds']}s, saved to {output}")
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Global feature importance over the processed data store")
+    parser.add_argument('--heads', nargs='+', choices=['energy', 'ports'], default=['energy'])
+    parser.add_argument('--method', choices=METHODS, default=METHOD)
+    parser.add_argument('--steps', type=int, default=IG_STEPS, help="Integrated gradients steps")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Windows per explainer call")
+    parser.add_argument('--start', default=None, help="Only windows ending at or after this time (e.g. 2024-07-01)")
+    parser.add_argument('--end', default=None, help="Only windows ending at or before this time (e.g. 2024-09-30T23:45)")
+    parser.add_argument('--sample', type=float, default=1.0, help="Attribute a random share of the windows only (e.g. 0.1)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=None, help="torch intra-op threads (default: all cores)")
+    parser.add_argument('--output', default=GLOBAL_IMPORTANCE_SAVE_PATH)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    global_importance(
+        heads=tuple(args.heads), method=args.method, steps=args.steps, chunk_size=args.chunk_size,
+        start=np.datetime64(args.start, 'ns') if args.start else None,
+        end=np.datetime64(args.end, 'ns') if args.end else None,
+        sample=args.sample, seed=args.seed, output=args.output
+    )
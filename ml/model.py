@@ -33,11 +33,17 @@ class EVFlowGRU(nn.Module):
         
     def forward(self, x):
         # x shape: (batch, seq_len, input_dim)
+        energy_pred, ports_logits, _ = self.forward_with_state(x)
+        return energy_pred, ports_logits
+
+    def forward_with_state(self, x, h=None):
+        # x shape: (batch, seq_len, input_dim)
+        # h shape: (num_layers, batch, hidden_dim) or None to start from zeros
         
         # GRU Output
         # out shape: (batch, seq_len, hidden_dim)
         # h_n shape: (num_layers, batch, hidden_dim)
-        out, _ = self.gru(x)
+        out, h_n = self.gru(x, h)
         
         # Use the last time step features for prediction
         last_step_out = out[:, -1, :]
@@ -46,4 +52,9 @@ class EVFlowGRU(nn.Module):
         energy_pred = self.reg_head(last_step_out)
         ports_logits = self.clf_head(last_step_out)
         
-        return energy_pred, ports_logits
+        return energy_pred, ports_logits, h_n
+
+    def step(self, x_t, h):
+        # Streaming mode: advance the GRU by a single timestep from a carried state
+        # x_t shape: (batch, input_dim)
+        return self.forward_with_state(x_t.unsqueeze(1), h)
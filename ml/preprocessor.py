@@ -0,0 +1,172 @@
+import threading
+
+import numpy as np
+
+from ml.features import (
+    FEATURE_COLS, AVAILABLE_PORTS, ENERGY, ENERGY_ROLL_3, ENERGY_ROLL_6, CALENDAR, INTERVAL,
+    FeatureScaler, calendar_features
+)
+
+ROLL_WINDOWS = ((ENERGY_ROLL_3, 3), (ENERGY_ROLL_6, 6))
+MAX_ROLL = max(n for _, n in ROLL_WINDOWS)
+
+class RawRingBuffer:
+    def __init__(self, capacity):
+        """
+        Fixed-size ring buffer of raw 15-min intervals for one station:
+        grid timestamp, available ports and energy (kWh) of the interval.
+        Preallocated once; pushing a reading never allocates.
+        """
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype='datetime64[ns]')
+        self.ports = np.zeros(capacity, dtype=np.float64)
+        self.energy = np.zeros(capacity, dtype=np.float64)
+        self.head = 0 # Next write position
+        self.count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def last_timestamp(self):
+        return self.timestamps[(self.head - 1) % self.capacity] if self.count else None
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, ports, energy):
+        self.timestamps[self.head] = timestamp
+        self.ports[self.head] = ports
+        self.energy[self.head] = energy
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def replace_last(self, ports, energy):
+        last = (self.head - 1) % self.capacity
+        self.ports[last] = ports
+        self.energy[last] = energy
+
+    def ordered(self):
+        # Oldest to newest: (timestamps, ports, energy)
+        order = (self.head - self.count + np.arange(self.count)) % self.capacity
+        return self.timestamps[order], self.ports[order], self.energy[order]
+
+class InferencePreprocessor:
+    def __init__(self, scaler, seq_length=48):
+        """
+        scaler: the fitted MinMaxScaler from scaler.pkl
+        seq_length: Window length the model expects
+
+        Server-side version of the feature engineering in process_data.py, so
+        clients send raw readings instead of rows copied out of processed_data.csv.
+        Each station keeps its last seq_length + 6 raw intervals (the 6 extra
+        feed Energy_Roll_6 of the window's first row).
+        """
+        self.seq_length = seq_length
+        self.feature_scaler = FeatureScaler(scaler)
+        self.buffers = {}
+        self.buffers_lock = threading.Lock()
+
+    def _buffer(self, station):
+        with self.buffers_lock:
+            buffer = self.buffers.get(station)
+            if buffer is None:
+                buffer = RawRingBuffer(self.seq_length + MAX_ROLL)
+                self.buffers[station] = buffer
+        return buffer
+
+    def has_station(self, station):
+        return station in self.buffers
+
+    def last_timestamp(self, station):
+        buffer = self.buffers.get(station)
+        return buffer.last_timestamp if buffer is not None else None
+
+    def seed(self, station, timestamps, ports, energy):
+        """Replaces a station's buffer with raw history (oldest first)."""
+        timestamps = _to_grid(timestamps)
+        if np.any(np.diff(timestamps.astype(np.int64)) <= 0):
+            raise ValueError("History timestamps must be strictly increasing")
+
+        buffer = self._buffer(station)
+        with buffer.lock:
+            buffer.clear()
+            for ts, p, e in zip(timestamps, ports, energy):
+                self._push(buffer, ts, p, e)
+
+    def push(self, station, timestamp, ports, energy):
+        """
+        Adds one raw reading for a station and returns how many new intervals
+        it added to the window (0 if it replaced the current interval).
+
+        - timestamp: time of the reading; floored to its 15-min interval
+        - ports: available ports (count)
+        - energy: energy delivered during the interval (kWh)
+        """
+        buffer = self._buffer(station)
+        with buffer.lock:
+            return self._push(buffer, _to_grid(timestamp), ports, energy)
+
+    def _push(self, buffer, timestamp, ports, energy):
+        last = buffer.last_timestamp
+        if last is None:
+            buffer.append(timestamp, ports, energy)
+            return 1
+
+        steps = int((timestamp - last) // INTERVAL)
+        if steps < 0:
+            raise ValueError(f"Reading at {timestamp} is older than the station's last interval ({last})")
+        if steps == 0:
+            # Latest reading wins within an interval, like the event dedup in process_data.py
+            buffer.replace_last(ports, energy)
+            return 0
+
+        # Missing intervals keep the last known state, as the forward-filled grid
+        # in process_data.py does. Only the last `capacity` of them can matter.
+        last_index = (buffer.head - 1) % buffer.capacity
+        last_ports, last_energy = buffer.ports[last_index], buffer.energy[last_index]
+        for k in range(max(1, steps - buffer.capacity + 1), steps):
+            buffer.append(last + k * INTERVAL, last_ports, last_energy)
+        buffer.append(timestamp, ports, energy)
+        return steps
+
+    def window(self, station):
+        """
+        Scaled (rows, 8) float32 features for the station's most recent
+        intervals (rows <= seq_length), plus the timestamp of the last row.
+        """
+        buffer = self.buffers.get(station)
+        if buffer is None or buffer.count == 0:
+            raise KeyError(f"No readings for station: {station}")
+        with buffer.lock:
+            timestamps, ports, energy = buffer.ordered()
+        # Until the buffer fills up it holds the station's whole history, so the
+        # first rows get 0 rolling features like a new station in process_data.py
+        raw = build_features(timestamps, ports, energy)[-self.seq_length:]
+        return self.feature_scaler.transform(raw).astype(np.float32), timestamps[-1]
+
+def build_features(timestamps, ports, energy):
+    """
+    Raw (unscaled) feature rows in FEATURE_COLS order for one station's
+    contiguous 15-min history, vectorized. Same semantics as process_data.py:
+    Energy_Roll_n is the mean of the n intervals strictly before each row,
+    0 where fewer than n exist.
+    """
+    n = len(energy)
+    raw = np.zeros((n, len(FEATURE_COLS)), dtype=np.float64)
+    raw[:, AVAILABLE_PORTS] = ports
+    raw[:, ENERGY] = energy
+    raw[:, CALENDAR] = calendar_features(timestamps)
+
+    # csum[i] = sum of energy[:i], so the n intervals before row i sum to csum[i] - csum[i - n]
+    csum = np.concatenate([[0.0], np.cumsum(energy)])
+    rows = np.arange(n)
+    for col, window in ROLL_WINDOWS:
+        full = rows >= window
+        raw[full, col] = (csum[rows[full]] - csum[rows[full] - window]) / window
+    return raw
+
+def _to_grid(timestamps):
+    # Floor to the 15-min grid process_data.py resamples onto
+    ts = np.asarray(timestamps, dtype='datetime64[ns]')
+    step = INTERVAL.astype('timedelta64[ns]').astype(np.int64)
+    return (ts.astype(np.int64) // step * step).astype('datetime64[ns]')
@@ -0,0 +1,227 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# Columnar, station-partitioned replacement for processed_data.csv.
+#
+#   store/
+#     manifest.json              columns, dtypes, stations (id, name, rows, time range)
+#     <generation>/station=<id>.feather
+#
+# One uncompressed Feather (Arrow IPC) file per Station_ID_Encoded, so readers
+# can memory-map a file and only touch the columns and stations they ask for.
+# Station names live in the manifest rather than on every row.
+# A rewrite goes to a new generation directory and is published by replacing
+# manifest.json, so readers never see a half-written store. update_store
+# (process_data.py --incremental) only rewrites the stations whose tail changed.
+
+STATION_COL = 'Station Name' # Virtual column, rebuilt from the manifest on read
+
+COLUMN_DTYPES = {
+    'timestamp': 'datetime64[ns]',
+    'Station_ID_Encoded': 'int16',
+    'Available Ports': 'float32',
+    'Energy (kWh)': 'float32',
+    'Hour': 'float32',
+    'DayOfWeek': 'float32',
+    'Month': 'float32',
+    'IsWeekend': 'int8',
+    'Energy_Roll_3': 'float32',
+    'Energy_Roll_6': 'float32',
+    'future_energy': 'float32',
+    'future_ports': 'float32',
+}
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+def _new_generation(store_dir):
+    generation = f"{int(time.time() * 1000)}-{os.getpid()}"
+    os.makedirs(os.path.join(store_dir, generation))
+    return generation
+
+def _write_station(store_dir, generation, station_id, name, columns):
+    """Writes one station's columns ({column: array}, time ordered). Returns its manifest entry."""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    table = pa.table({
+        col: np.ascontiguousarray(np.asarray(columns[col]).astype(COLUMN_DTYPES[col]))
+        for col in COLUMN_DTYPES
+    })
+    file_name = f"station={station_id}.feather"
+    feather.write_feather(table, os.path.join(store_dir, generation, file_name), compression='uncompressed')
+
+    timestamps = table.column('timestamp').to_numpy()
+    return {
+        'id': int(station_id),
+        'name': str(name),
+        'file': f"{generation}/{file_name}",
+        'rows': int(len(timestamps)),
+        'start': str(timestamps[0].astype('datetime64[s]')),
+        'end': str(timestamps[-1].astype('datetime64[s]')),
+    }
+
+def _publish(store_dir, generation, stations):
+    """Atomically replaces manifest.json, then removes the previous generation."""
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'generation': generation,
+        'rows': int(sum(s['rows'] for s in stations)),
+        'columns': COLUMN_DTYPES,
+        'stations': sorted(stations, key=lambda s: s['id']),
+    }
+
+    previous = None
+    manifest_path = os.path.join(store_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            previous = json.load(f).get('generation')
+
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+
+    # Readers may still have the old files mapped (Windows refuses to delete those)
+    if previous and previous != generation:
+        shutil.rmtree(os.path.join(store_dir, previous), ignore_errors=True)
+    return manifest
+
+def write_store(full_df, store_dir):
+    """
+    Writes the processed frame (one row per station interval, with 'Station Name'
+    and 'Station_ID_Encoded') as a station-partitioned store. Rows keep their
+    order within each station. Returns the manifest.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    generation = _new_generation(store_dir)
+
+    ids = full_df['Station_ID_Encoded'].values
+    names = full_df[STATION_COL].values
+
+    # Stable sort by station id: one contiguous, still time-ordered run per station
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_ids)) + 1] if len(order) else np.array([], dtype=int)
+    ends = np.r_[starts[1:], len(order)] if len(order) else np.array([], dtype=int)
+
+    stations = []
+    for start, end in zip(starts, ends):
+        rows = order[start:end]
+        columns = {col: full_df[col].values[rows] for col in COLUMN_DTYPES}
+        stations.append(_write_station(store_dir, generation, sorted_ids[start], names[rows[0]], columns))
+
+    return _publish(store_dir, generation, stations)
+
+def update_store(store_dir, tails):
+    """
+    Replaces the tail of some stations' data (process_data.py --incremental).
+
+    tails: {Station_ID_Encoded: (cut, frame)}. The station keeps its rows with
+           timestamp < cut (datetime64) and frame's rows are appended after them.
+
+    Untouched stations are hard-linked into the new generation rather than
+    rewritten. Returns the new manifest.
+    """
+    import pyarrow.feather as feather
+
+    store = ProcessedStore(store_dir)
+    generation = _new_generation(store_dir)
+
+    stations = []
+    for info in store.manifest['stations']:
+        old_path = os.path.join(store_dir, info['file'])
+        if info['id'] not in tails:
+            file_name = os.path.basename(info['file'])
+            try:
+                os.link(old_path, os.path.join(store_dir, generation, file_name))
+            except OSError:
+                shutil.copy2(old_path, os.path.join(store_dir, generation, file_name))
+            stations.append(dict(info, file=f"{generation}/{file_name}"))
+            continue
+
+        cut, frame = tails[info['id']]
+        table = feather.read_table(old_path, memory_map=False)
+        keep = table.column('timestamp').to_numpy() < np.datetime64(cut, 'ns')
+        columns = {
+            col: np.concatenate([table.column(col).to_numpy()[keep], frame[col].values.astype(COLUMN_DTYPES[col])])
+            for col in COLUMN_DTYPES
+        }
+        stations.append(_write_station(store_dir, generation, info['id'], info['name'], columns))
+
+    return _publish(store_dir, generation, stations)
+
+class ProcessedStore:
+    def __init__(self, store_dir):
+        """
+        store_dir: directory written by write_store (process_data.py)
+        Raises FileNotFoundError if the store has not been built yet.
+        """
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, MANIFEST)
+        with open(self.manifest_path, 'r') as f:
+            self.manifest = json.load(f)
+
+        self.stations = [s['name'] for s in self.manifest['stations']] # Station_ID_Encoded order
+        self._by_name = {s['name']: s for s in self.manifest['stations']}
+        self._by_id = {s['id']: s for s in self.manifest['stations']}
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    def station_info(self, station):
+        """Manifest entry for a station name or Station_ID_Encoded."""
+        info = self._by_name.get(station) if isinstance(station, str) else self._by_id.get(int(station))
+        if info is None:
+            raise KeyError(f"Unknown station: {station}")
+        return info
+
+    def _table(self, info, columns, memory_map):
+        import pyarrow.feather as feather
+
+        return feather.read_table(os.path.join(self.store_dir, info['file']), columns=columns, memory_map=memory_map)
+
+    def read_arrays(self, station, columns, memory_map=True):
+        """
+        Columns of one station as numpy arrays, {column: array}.
+        With memory_map the numeric columns are zero-copy views of the mapped file.
+        """
+        info = self.station_info(station)
+        table = self._table(info, [c for c in columns if c != STATION_COL], memory_map)
+        arrays = {name: table.column(name).to_numpy() for name in table.column_names}
+        if STATION_COL in columns:
+            arrays[STATION_COL] = np.full(info['rows'], info['name'], dtype=object)
+        return arrays
+
+    def read(self, columns=None, stations=None, memory_map=True):
+        """
+        DataFrame of the requested columns (all by default, plus 'Station Name')
+        for the requested stations (names or ids, all by default), in
+        Station_ID_Encoded then time order.
+        """
+        import pandas as pd
+        import pyarrow as pa
+
+        if columns is None:
+            columns = list(self.manifest['columns']) + [STATION_COL]
+        infos = self.manifest['stations'] if stations is None else [self.station_info(s) for s in stations]
+        stored = [c for c in columns if c != STATION_COL]
+
+        tables = [self._table(info, stored, memory_map) for info in infos]
+        if tables:
+            df = pa.concat_tables(tables).to_pandas()
+        else:
+            df = pd.DataFrame({c: pd.Series(dtype=self.manifest['columns'][c]) for c in stored})
+
+        if STATION_COL in columns:
+            df[STATION_COL] = np.repeat(
+                np.array([info['name'] for info in infos], dtype=object),
+                [info['rows'] for info in infos]
+            ) if infos else np.array([], dtype=object)
+        return df[columns]
@@ -1,29 +1,69 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, random_split
-import pandas as pd
+from torch.utils.data import DataLoader
 import numpy as np
 import os
 import json
-from dataset import EVDataSequence
+import time
+import argparse
+from contextlib import nullcontext
+from dataset import EVDataSequence, WindowBatchSampler, collate_batch, split_indices
+from features import FEATURE_COLS
+from store import ProcessedStore
 from model import EVFlowGRU
 
 # Config
-DATA_PATH = r'e:\EVFlow AI\data\processed\processed_data.csv'
+STORE_PATH = r'e:\EVFlow AI\data\processed\store'
 MODEL_SAVE_PATH = r'e:\EVFlow AI\ml\model.pth'
 METRICS_SAVE_PATH = r'e:\EVFlow AI\ml\metrics.json'
+BACKGROUND_SAVE_PATH = r'e:\EVFlow AI\ml\background.pt'
 
 SEQ_LENGTH = 48
 HIDDEN_DIM = 64
 NUM_LAYERS = 2
 BATCH_SIZE = 64
-EPOCHS = 10 # Configurable, keep low for demo speed if needed, but high enough for convergence
+EPOCHS = 10 # Configurable with --epochs; use --epochs 1 for a quick demo run
 LEARNING_RATE = 0.001
+BACKGROUND_SIZE = 50 # Training windows kept as the SHAP background
+MAX_ROWS = None # Set to an int (or --max-rows) to train on the first N rows only (quick demo runs)
+NUM_WORKERS = 0 # DataLoader worker processes (--num-workers)
 
-def train():
+def train_epoch(model, train_loader, optimizer, criterion_reg, criterion_clf, device, bf16=False):
+    """One pass over train_loader. Returns the mean batch loss."""
+    model.train()
+    running_loss = 0.0
+    # bf16 autocast runs the matmuls in bfloat16 on CPUs that support it; weights stay fp32
+    autocast = torch.autocast(device_type=device.type, dtype=torch.bfloat16) if bf16 else nullcontext()
+    
+    for X_batch, y_batch in train_loader:
+        X_batch = X_batch.to(device)
+        # y_batch: [energy, ports_class]
+        y_energy = y_batch[:, 0].unsqueeze(1).to(device) # (B, 1)
+        y_ports = y_batch[:, 1].long().to(device) # (B,)
+        
+        optimizer.zero_grad()
+        
+        with autocast:
+            pred_energy, pred_ports = model(X_batch)
+            
+            loss_reg = criterion_reg(pred_energy.float(), y_energy)
+            loss_clf = criterion_clf(pred_ports.float(), y_ports)
+            
+            loss = 0.7 * loss_reg + 0.3 * loss_clf
+        
+        loss.backward()
+        optimizer.step()
+        
+        running_loss += loss.item()
+        
+    return running_loss / len(train_loader)
+
+def train(epochs=EPOCHS, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, persistent_workers=False,
+          bf16=False, compile_model=False, max_rows=MAX_ROWS):
     print("Loading data...")
-    df = pd.read_csv(DATA_PATH)
+    # Only the columns training uses, float32 straight from the columnar store
+    df = ProcessedStore(STORE_PATH).read(columns=['timestamp', 'Station Name'] + FEATURE_COLS + ['future_energy', 'future_ports'])
     
     # Check max ports for num_classes
     # The 'Available Ports' column is MinMax scaled (0-1).
@@ -40,7 +80,7 @@ def train():
     # ALTERNATIVE: Treat it as Regression + rounding?
     # User specifically said: "Multi-class classification... CrossEntropy".
     # So I must treat it as classes.
-    # The `future_ports` column in `processed_data.csv` is likely floats.
+    # The `future_ports` column in the processed store is likely floats.
     # Let's inspect the data first (in my head or via tool if needed).
     # In `process_data.py`: `full_df['future_ports'] = ...shift(-1)`. Then `scaler.fit_transform`.
     # So `future_ports` IS scaled.
@@ -60,17 +100,22 @@ def train():
     
     # Create Dataset
     # We pass the class column name as target for ports
-    # SPEED OPTIMIZATION FOR DEMO: Slice dataframe to smaller size
-    df = df.iloc[:5000].copy() 
+    # The dataset keeps a single float32 copy of the data and builds windows as views,
+    # so the full history fits in memory; max_rows is only for quick demo runs.
+    if max_rows is not None:
+        df = df.iloc[:max_rows].copy()
     dataset = EVDataSequence(df, seq_length=SEQ_LENGTH, target_cols=['future_energy', 'future_ports_class'])
+    del df
     
     # Split
-    train_size = int(0.8 * len(dataset))
-    val_size = len(dataset) - train_size
-    train_ds, val_ds = random_split(dataset, [train_size, val_size])
+    train_indices, val_indices = split_indices(len(dataset), train_fraction=0.8)
     
-    train_loader = DataLoader(train_ds, batch_size=BATCH_SIZE, shuffle=True)
-    val_loader = DataLoader(val_ds, batch_size=BATCH_SIZE, shuffle=False)
+    # The batch sampler hands the dataset whole batches of indices, which it
+    # gathers from its pre-built tensors in one go (__getitems__)
+    loader_args = dict(collate_fn=collate_batch, num_workers=num_workers,
+                       persistent_workers=persistent_workers and num_workers > 0)
+    train_loader = DataLoader(dataset, batch_sampler=WindowBatchSampler(train_indices, batch_size, shuffle=True), **loader_args)
+    val_loader = DataLoader(dataset, batch_sampler=WindowBatchSampler(val_indices, batch_size), **loader_args)
     
     # Init Model
     # Features size: len(dataset.feature_cols)
@@ -83,37 +128,26 @@ def train():
     optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
     
     # Training Loop
-    print("Starting training (Demo Mode)...")
+    print(f"Starting training ({epochs} epochs, {num_workers} loader workers, "
+          f"{'bf16' if bf16 else 'fp32'}{', compiled' if compile_model else ''})...")
     device = torch.device('cpu') # User req: CPU-compatible training
     model.to(device)
-    
-    DEMO_EPOCHS = 1 # Force 1 epoch for demo
-    
-    for epoch in range(DEMO_EPOCHS):
-        model.train()
-        running_loss = 0.0
-        
-        for X_batch, y_batch in train_loader:
-            X_batch = X_batch.to(device)
-            # y_batch: [energy, ports_class]
-            y_energy = y_batch[:, 0].unsqueeze(1).to(device) # (B, 1)
-            y_ports = y_batch[:, 1].long().to(device) # (B,)
-            
-            optimizer.zero_grad()
-            
-            pred_energy, pred_ports = model(X_batch)
-            
-            loss_reg = criterion_reg(pred_energy, y_energy)
-            loss_clf = criterion_clf(pred_ports, y_ports)
-            
-            loss = 0.7 * loss_reg + 0.3 * loss_clf
-            
-            loss.backward()
-            optimizer.step()
-            
-            running_loss += loss.item()
-            
-        print(f"Epoch {epoch+1}/{DEMO_EPOCHS}, Loss: {running_loss/len(train_loader):.4f}")
+    # The compiled wrapper shares its parameters with `model`, which is what gets saved
+    train_model = torch.compile(model) if compile_model else model
+    
+    epoch_stats = []
+    for epoch in range(epochs):
+        started = time.perf_counter()
+        epoch_loss = train_epoch(train_model, train_loader, optimizer, criterion_reg, criterion_clf, device, bf16=bf16)
+        seconds = time.perf_counter() - started
+        samples_per_sec = len(train_indices) / seconds
+        epoch_stats.append({
+            "epoch": epoch + 1,
+            "loss": epoch_loss,
+            "seconds": seconds,
+            "samples_per_sec": samples_per_sec
+        })
+        print(f"Epoch {epoch+1}/{epochs}, Loss: {epoch_loss:.4f}, {samples_per_sec:.0f} samples/s")
         
     # Evaluation
     print("Evaluating...")
@@ -129,7 +163,7 @@ def train():
             y_energy = y_batch[:, 0].unsqueeze(1).to(device)
             y_ports = y_batch[:, 1].long().to(device)
             
-            pred_energy, pred_ports = model(X_batch)
+            pred_energy, pred_ports = train_model(X_batch)
             
             # Metrics
             mse_energy_sum += criterion_reg(pred_energy, y_energy).item() * X_batch.size(0)
@@ -149,9 +183,26 @@ def train():
     
     print(f"Validation Metrics: {metrics}")
     
+    # Throughput per epoch, with the settings that produced it
+    metrics["training"] = {
+        "epochs": epoch_stats,
+        "batch_size": batch_size,
+        "num_workers": num_workers,
+        "bf16": bf16,
+        "compile": compile_model,
+        "torch_threads": torch.get_num_threads()
+    }
+    
     # Save Model
     torch.save(model.state_dict(), MODEL_SAVE_PATH)
     
+    # SHAP background: a fixed sample of training windows, saved next to the model
+    # so the backend explainer uses real data instead of zeros.
+    generator = torch.Generator().manual_seed(0)
+    picks = torch.randperm(len(train_indices), generator=generator)[:BACKGROUND_SIZE]
+    background, _ = dataset.__getitems__(train_indices[picks].tolist())
+    torch.save(background, BACKGROUND_SAVE_PATH)
+    
     # Map class index back to scaled value for reference if needed?
     # We might need to save 'val_to_class' mapping or 'num_classes' to use in inference.
     # Actually inference needs to know num_classes to shape the model.
@@ -168,7 +219,7 @@ def train():
     
     metadata = {
         "num_classes": num_classes,
-        "unique_vals_scaled": unique_vals, # List of floats
+        "unique_vals_scaled": [float(v) for v in unique_vals], # List of floats
         "input_dim": input_dim,
         "hidden_dim": HIDDEN_DIM,
         "num_layers": NUM_LAYERS,
@@ -184,4 +235,20 @@ def train():
     print("Training complete and artifacts saved.")
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Train EVFlowGRU on the processed data store")
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--num-workers', type=int, default=NUM_WORKERS, help="DataLoader worker processes")
+    parser.add_argument('--persistent-workers', action='store_true', help="Keep loader workers alive between epochs")
+    parser.add_argument('--bf16', action='store_true', help="bfloat16 autocast (CPUs with AVX512-BF16/AMX benefit most)")
+    parser.add_argument('--compile', action='store_true', help="torch.compile the model")
+    parser.add_argument('--threads', type=int, default=None, help="torch intra-op threads (default: all cores)")
+    parser.add_argument('--max-rows', type=int, default=MAX_ROWS, help="Train on the first N rows only")
+    args = parser.parse_args()
+    
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    
+    train(epochs=args.epochs, batch_size=args.batch_size, num_workers=args.num_workers,
+          persistent_workers=args.persistent_workers, bf16=args.bf16, compile_model=args.compile,
+          max_rows=args.max_rows)
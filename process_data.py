@@ -3,60 +3,142 @@ import numpy as np
 import pickle
 from sklearn.preprocessing import MinMaxScaler, LabelEncoder
 import os
+import argparse
+import hashlib
+import io
+from concurrent.futures import ProcessPoolExecutor
+from ml.features import SCALED_COLS
+from ml.store import ProcessedStore, write_store, update_store
 
 # Configuration
 INPUT_FILE = r'e:\EVFlow AI\data\raw\ev_data.xlsx.csv'
 OUTPUT_DIR = r'e:\EVFlow AI\data\processed'
-PROCESSED_DATA_FILE = os.path.join(OUTPUT_DIR, 'processed_data.csv')
+PROCESSED_DATA_FILE = os.path.join(OUTPUT_DIR, 'processed_data.csv') # Only written with --csv
+STORE_DIR = os.path.join(OUTPUT_DIR, 'store') # Columnar store read by train.py, the backend and verify_data.py
 SCALER_FILE = os.path.join(OUTPUT_DIR, 'scaler.pkl')
 ENCODER_FILE = os.path.join(OUTPUT_DIR, 'encoders.pkl')
+STATE_FILE = os.path.join(OUTPUT_DIR, 'incremental_state.pkl') # Per-station watermarks for --incremental
+WORKERS = 1 # Processes for the per-station stages (--workers); 1 = serial
+CHUNKS_PER_WORKER = 4 # Smaller station chunks even out the load across workers
+LOOKBACK = pd.Timedelta(days=7) # --incremental: how far before a station's last interval new sessions may start
+MAX_ROLL = 6 # Longest rolling feature window (Energy_Roll_6), in intervals
 
-def parse_duration_to_minutes(duration_str):
-    """Parses hh:mm:ss string to minutes (float)."""
-    if pd.isna(duration_str):
-        return 0.0
-    try:
-        parts = str(duration_str).split(':')
-        if len(parts) == 3:
-            h, m, s = map(float, parts)
-            return h * 60 + m + s / 60
-        return 0.0
-    except:
-        return 0.0
-
-def process_data():
-    print("Loading data...", flush=True)
-    df = pd.read_csv(INPUT_FILE)
-    
-    # 1. Data Cleaning & PII Removal
-    print("Cleaning data...", flush=True)
-    # Drop PII
-    cols_to_drop = ['User ID', 'Driver Postal Code']
-    existing_drop_cols = [c for c in cols_to_drop if c in df.columns]
-    df.drop(columns=existing_drop_cols, inplace=True)
+# Raw export columns the pipeline uses, and how to read them. The other columns
+# (including the PII ones, 'User ID' and 'Driver Postal Code') are never parsed.
+# Timestamps and durations are read as text and parsed below.
+RAW_COLUMNS = {
+    'Station Name': 'category',
+    'Start Date': 'string',
+    'End Date': 'string',
+    'Total Duration (hh:mm:ss)': 'string',
+    'Charging Time (hh:mm:ss)': 'string',
+    'Energy (kWh)': 'float64',
+    'Port Number': 'float64',
+}
+DATE_FORMAT = '%m/%d/%Y %H:%M' # Start Date / End Date in the export, e.g. 7/29/2011 20:17
+CHUNK_BYTES = 64 << 20 # Raw CSV bytes parsed at a time (--chunk-mb); only the typed columns above are kept
+# h:m:s, each part a number (sign and fraction allowed)
+DURATION_PATTERN = r'^\s*\+?(?P<h>-?(?:\d+\.?\d*|\.\d+))\s*:\s*\+?(?P<m>-?(?:\d+\.?\d*|\.\d+))\s*:\s*\+?(?P<s>-?(?:\d+\.?\d*|\.\d+))\s*$'
+
+def parse_durations(values):
+    """
+    pyarrow string array of hh:mm:ss -> minutes (float64), h * 60 + m + s / 60,
+    0 for missing or malformed values.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    
+    # Missing and malformed values become 0:0:0 (extract_regex fails on non-matching rows)
+    valid = pc.fill_null(pc.match_substring_regex(values, DURATION_PATTERN), False)
+    parts = pc.extract_regex(pc.if_else(valid, values, '0:0:0'), DURATION_PATTERN)
+    h, m, s = (pc.cast(parts.field(name), pa.float64()).to_numpy(zero_copy_only=False) for name in 'hms')
+    return h * 60 + m + s / 60
+
+def parse_timestamps(values):
+    """
+    pyarrow string array -> datetime64[ns], NaT where unparseable. Values not in
+    DATE_FORMAT get a second, per-value attempt at inferring their format.
+    """
+    import pyarrow.compute as pc
+    
+    parsed = pc.strptime(values, format=DATE_FORMAT, unit='ns', error_is_null=True)
+    parsed = parsed.to_numpy(zero_copy_only=False).astype('datetime64[ns]')
+    retry = np.flatnonzero(np.isnat(parsed) & ~values.is_null().to_numpy(zero_copy_only=False))
+    if len(retry):
+        other = pd.Series(values.take(retry).to_pylist())
+        parsed[retry] = pd.to_datetime(other, format='mixed', errors='coerce').values
+    return parsed
+
+def _clean_sessions(batch):
+    # One parsed block of the raw file -> typed session frame
+    import pyarrow.compute as pc
     
     # Drop rows with missing Energy
-    df.dropna(subset=['Energy (kWh)'], inplace=True)
-    
-    # Parse Timestamps
-    # 'Start Date', 'End Date' seem to contain both date and time based on previous view_file
-    df['Start Date'] = pd.to_datetime(df['Start Date'], errors='coerce')
-    df['End Date'] = pd.to_datetime(df['End Date'], errors='coerce')
+    batch = batch.filter(pc.is_valid(batch.column('Energy (kWh)')))
+    
+    df = pd.DataFrame({
+        'Station Name': batch.column('Station Name').to_pandas(),
+        'Start Date': parse_timestamps(batch.column('Start Date')),
+        'End Date': parse_timestamps(batch.column('End Date')),
+        'Energy (kWh)': batch.column('Energy (kWh)').to_numpy(zero_copy_only=False),
+        'Port Number': batch.column('Port Number').to_numpy(zero_copy_only=False),
+        'Total Duration (min)': parse_durations(batch.column('Total Duration (hh:mm:ss)')),
+        'Charging Time (min)': parse_durations(batch.column('Charging Time (hh:mm:ss)')),
+    })
     
     # Drop invalid timestamps
-    df.dropna(subset=['Start Date', 'End Date'], inplace=True)
-    
-    # 2. Duration Conversion
-    print("Converting durations...", flush=True)
-    df['Total Duration (min)'] = df['Total Duration (hh:mm:ss)'].apply(parse_duration_to_minutes)
-    df['Charging Time (min)'] = df['Charging Time (hh:mm:ss)'].apply(parse_duration_to_minutes)
-    
-    # 3. Port Availability Reconstruction & Energy Load Estimation
-    print("Reconstructing port availability and energy load...", flush=True)
+    return df.dropna(subset=['Start Date', 'End Date'])
+
+def load_sessions(input_file=INPUT_FILE, chunk_bytes=CHUNK_BYTES):
+    """
+    Reads the raw session export (a path or a binary file object): the RAW_COLUMNS
+    only, typed, with timestamps and durations parsed. Station Name is categorical.
+    
+    The CSV is streamed CHUNK_BYTES at a time and every block is reduced to the
+    typed columns before the next one is read, so the raw text never has to fit in memory.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    from pandas.api.types import union_categoricals
     
+    print("Loading data...", flush=True)
+    arrow_types = {
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'string': pa.string(),
+        'float64': pa.float64(),
+    }
+    reader = pacsv.open_csv(
+        input_file,
+        read_options=pacsv.ReadOptions(block_size=chunk_bytes),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=list(RAW_COLUMNS),
+            column_types={col: arrow_types[dtype] for col, dtype in RAW_COLUMNS.items()},
+            strings_can_be_null=True, # Empty fields are missing, as with pd.read_csv
+        ),
+    )
+    chunks = [_clean_sessions(batch) for batch in reader]
+    
+    if not chunks:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in (
+            ('Station Name', 'category'), ('Start Date', 'datetime64[ns]'), ('End Date', 'datetime64[ns]'),
+            ('Energy (kWh)', 'float64'), ('Port Number', 'float64'),
+            ('Total Duration (min)', 'float64'), ('Charging Time (min)', 'float64'),
+        )})
+    
+    # Every block has its own station dictionary: merge them into one set of categories
+    stations = union_categoricals([c['Station Name'] for c in chunks], sort_categories=True).remove_unused_categories()
+    df = pd.concat([c.drop(columns='Station Name') for c in chunks], ignore_index=True)
+    df.insert(0, 'Station Name', stations)
+    return df
+
+def build_events(df):
+    """
+    Turns sessions into occupancy / load change events.
+    Returns (all_events sorted by timestamp, station_capacity).
+    """
     # Calculate Total Ports per Station
     # Assuming Port Number is 1-based index, max port number ~ total ports
-    station_capacity = df.groupby('Station Name')['Port Number'].max().fillna(1).astype(int)
+    station_capacity = df.groupby('Station Name', observed=True)['Port Number'].max().fillna(1).astype(int)
     
     # Event-based simulation for efficiency
     # Events: (Timestamp, Station, PortChange, PowerChange)
@@ -95,71 +177,98 @@ def process_data():
     all_events = pd.concat([starts, charges_end, ends], ignore_index=True)
     all_events.sort_values(by='timestamp', inplace=True)
     
-    # Process per station
-    processed_dfs = []
-    
-    unique_stations = df['Station Name'].unique()
-    
-    print(f"Processing {len(unique_stations)} stations...")
-    
-    for station in unique_stations:
-        # Filter events for this station
-        events = all_events[all_events['station'] == station].copy()
-        
-        # Cumulative Sum
-        events['occupied_ports'] = events['port_change'].cumsum()
-        events['current_load_kw'] = events['power_change'].cumsum()
-        
-        # Resample to 15-min grid
-        # Create a complete grid from min to max
-        if events.empty:
-            continue
-            
-        start_grid = events['timestamp'].min().floor('15min')
-        end_grid = events['timestamp'].max().ceil('15min')
-        grid = pd.date_range(start_grid, end_grid, freq='15min', name='timestamp')
-        
-        # Set index to timestamp
-        events.set_index('timestamp', inplace=True)
-        
-        # Handle duplicate timestamps (multiple events same time) -> take the last one as it reflects final state
-        # But we need to use 'last' of the cumsum.
-        # However, if we resample directly, we might miss events that happen between grid points?
-        # No, 'asof' logic or 'step' logic is needed.
-        # We want the state AT 10:00, 10:15.
-        # events includes ALL changes.
-        # duplicate index clearing:
-        events = events[~events.index.duplicated(keep='last')]
-        
-        # Reindex to grid using 'ffill' (pad) to carry forward the state
-        resampled = events[['occupied_ports', 'current_load_kw']].reindex(grid, method='ffill').fillna(0)
-        
-        # Constraints
-        capacity = station_capacity.get(station, 1) # Default to 1 if missing?
-        
-        # Ensure non-negative and cap at capacity
-        resampled['occupied_ports'] = resampled['occupied_ports'].clip(lower=0, upper=capacity)
-        resampled['current_load_kw'] = resampled['current_load_kw'].clip(lower=0)
-        
-        resampled['Available Ports'] = capacity - resampled['occupied_ports']
-        
-        # Calculate Energy (kWh) for the 15-min interval
-        # Power (kW) * 0.25 h
-        resampled['Energy (kWh)'] = resampled['current_load_kw'] * 0.25
-        
-        resampled['Station Name'] = station
-        
-        processed_dfs.append(resampled)
-        
-    # combine
-    if not processed_dfs:
-        print("No data to process.")
-        return
+    return all_events, station_capacity
 
-    full_df = pd.concat(processed_dfs).reset_index()
-    
+GRID_FREQ_NS = 15 * 60 * 10**9 # 15-minute grid in nanoseconds
+
+def reconstruct_station_grids(all_events, station_capacity, stations):
+    """
+    Rebuilds port occupancy and charging load on a 15-min grid for every station at once.
+    all_events: timestamp-sorted events (timestamp, station, power_change, port_change)
+    station_capacity: Series of port counts indexed by station name
+    stations: station names, in the order their grids are emitted
+    
+    Returns the same frame the old per-station loop produced (one 15-min grid per
+    station from floor(first event) to ceil(last event), state carried forward).
+    """
+    # Group events by station. A stable sort keeps each station's events in the
+    # timestamp order they had in all_events, i.e. the order the old per-station
+    # filter saw, so the cumulative sums below add up in exactly the same order.
+    codes = pd.Categorical(all_events['station'], categories=stations).codes
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    ts = all_events['timestamp'].values.astype('datetime64[ns]').view(np.int64)[order]
+    port_change = all_events['port_change'].values[order]
+    power_change = all_events['power_change'].values[order].astype(np.float64)
+    
+    if len(codes) == 0:
+        return pd.DataFrame(columns=['timestamp', 'occupied_ports', 'current_load_kw', 'Available Ports', 'Energy (kWh)', 'Station Name'])
+    
+    # Segment boundaries: each station's events are now contiguous
+    seg_starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1]
+    seg_ends = np.r_[seg_starts[1:], len(codes)]
+    
+    # Cumulative Sum within each station.
+    # np.cumsum per contiguous segment rather than groupby().cumsum(), which uses
+    # compensated summation and would not reproduce the old float results bit for bit.
+    occupied = np.empty(len(codes), dtype=np.float64)
+    load = np.empty(len(codes), dtype=np.float64)
+    for start, end in zip(seg_starts, seg_ends):
+        occupied[start:end] = np.cumsum(port_change[start:end])
+        load[start:end] = np.cumsum(power_change[start:end])
+    
+    # Multiple events at the same time -> keep the last one, it reflects the final state
+    last_of_ts = np.r_[(codes[1:] != codes[:-1]) | (ts[1:] != ts[:-1]), True]
+    events = pd.DataFrame({
+        'station_code': codes[last_of_ts],
+        'timestamp': ts[last_of_ts],
+        'occupied_ports': occupied[last_of_ts],
+        'current_load_kw': load[last_of_ts],
+    })
+    
+    # 15-min grid per station, from floor(first event) to ceil(last event)
+    seg_codes = codes[seg_starts]
+    grid_start = ts[seg_starts] - ts[seg_starts] % GRID_FREQ_NS
+    grid_end = -((-ts[seg_ends - 1]) // GRID_FREQ_NS) * GRID_FREQ_NS
+    grid_len = (grid_end - grid_start) // GRID_FREQ_NS + 1
+    
+    grid_offsets = np.r_[0, np.cumsum(grid_len)[:-1]]
+    step = np.arange(grid_len.sum()) - np.repeat(grid_offsets, grid_len)
+    grid = pd.DataFrame({
+        'station_code': np.repeat(seg_codes, grid_len),
+        'timestamp': np.repeat(grid_start, grid_len) + step * GRID_FREQ_NS,
+    })
+    grid['row'] = np.arange(len(grid))
+    
+    # As-of join: state AT each grid point is the last event at or before it (ffill),
+    # zero before the station's first event
+    grid = grid.sort_values('timestamp', kind='stable')
+    events = events.sort_values('timestamp', kind='stable')
+    resampled = pd.merge_asof(grid, events, on='timestamp', by='station_code', direction='backward')
+    resampled = resampled.sort_values('row').reset_index(drop=True)
+    resampled[['occupied_ports', 'current_load_kw']] = resampled[['occupied_ports', 'current_load_kw']].fillna(0)
+    
+    # Constraints
+    capacity = station_capacity.reindex(stations).fillna(1).values[resampled['station_code'].values]
+    
+    # Ensure non-negative and cap at capacity
+    resampled['occupied_ports'] = resampled['occupied_ports'].clip(lower=0, upper=capacity)
+    resampled['current_load_kw'] = resampled['current_load_kw'].clip(lower=0)
+    
+    resampled['Available Ports'] = capacity - resampled['occupied_ports']
+    
+    # Calculate Energy (kWh) for the 15-min interval
+    # Power (kW) * 0.25 h
+    resampled['Energy (kWh)'] = resampled['current_load_kw'] * 0.25
+    
+    resampled['Station Name'] = np.asarray(stations, dtype=object)[resampled['station_code'].values]
+    resampled['timestamp'] = pd.to_datetime(resampled['timestamp'])
+    
+    return resampled[['timestamp', 'occupied_ports', 'current_load_kw', 'Available Ports', 'Energy (kWh)', 'Station Name']]
+
+def engineer_features(full_df):
+    """Calendar and rolling energy features, plus the t+1 targets."""
     # 4. Feature Engineering
-    print("Engineering features...")
     full_df['Hour'] = full_df['timestamp'].dt.hour
     full_df['DayOfWeek'] = full_df['timestamp'].dt.dayofweek
     full_df['Month'] = full_df['timestamp'].dt.month
@@ -195,35 +304,185 @@ def process_data():
     # Drop rows with NaNs in targets
     full_df.dropna(subset=['future_energy', 'future_ports'], inplace=True)
     
+    return full_df
+
+def partition_stations(all_events, stations, n_chunks):
+    """
+    Splits the stations into up to n_chunks contiguous runs of the sorted station
+    names, balanced by event count. Contiguous sorted runs mean the per-chunk
+    outputs, concatenated in chunk order, are already in the serial sort order.
+    """
+    names = sorted(stations)
+    counts = all_events['station'].value_counts().reindex(names).fillna(0).values
+    before = np.cumsum(counts) - counts # Events in the stations ahead of each one
+    chunk_of = np.minimum((before * n_chunks) // max(counts.sum(), 1), n_chunks - 1).astype(int)
+    return [list(np.asarray(names, dtype=object)[chunk_of == c]) for c in np.unique(chunk_of)]
+
+def _process_station_chunk(args):
+    # Worker: grids and features for one chunk of stations. Station names go back
+    # as int codes into the chunk's list instead of one pickled string per row.
+    all_events, station_capacity, stations = args
+    full_df = engineer_features(reconstruct_station_grids(all_events, station_capacity, stations))
+    codes = pd.Categorical(full_df['Station Name'], categories=stations).codes
+    return full_df.drop(columns='Station Name'), codes
+
+def build_station_frames_parallel(all_events, station_capacity, stations, workers):
+    """
+    reconstruct_station_grids + engineer_features over a process pool.
+    Every station is processed independently and with the same code as the
+    serial path, so the result matches it exactly.
+    """
+    chunks = partition_stations(all_events, stations, workers * CHUNKS_PER_WORKER)
+    tasks = [
+        (all_events[all_events['station'].isin(chunk)], station_capacity.reindex(chunk), chunk)
+        for chunk in chunks
+    ]
+    
+    frames = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map() returns results in chunk order, whatever order they finish in
+        for chunk, (frame, codes) in zip(chunks, pool.map(_process_station_chunk, tasks)):
+            frame['Station Name'] = np.asarray(chunk, dtype=object)[codes]
+            frames.append(frame)
+    
+    return pd.concat(frames, ignore_index=True)
+
+def scale_and_encode(full_df, scaler=None, le=None):
+    """
+    Fits the station LabelEncoder and the MinMaxScaler, or applies already fitted
+    ones (--incremental keeps the scaler frozen). Returns (full_df, scaler, encoder).
+    """
     # 6. Scaling & Encoding
     print("Scaling and encoding...")
     
     # Encode Station Name
-    le = LabelEncoder()
-    full_df['Station_ID_Encoded'] = le.fit_transform(full_df['Station Name'])
+    if le is None:
+        le = LabelEncoder()
+        full_df['Station_ID_Encoded'] = le.fit_transform(full_df['Station Name'])
+    else:
+        full_df['Station_ID_Encoded'] = le.transform(full_df['Station Name'])
     
     # Scale Numerical Features
     # Features: Hour, DayOfWeek, Month, IsWeekend, Energy_Roll_3, Energy_Roll_6, Available Ports?
     # Usually we scale inputs.
     # Inputs: 'Available Ports', 'Energy (kWh)', 'Hour', 'DayOfWeek', 'Month', 'IsWeekend', 'Energy_Roll_3', 'Energy_Roll_6'
     
-    cols_to_scale = [
-        'Available Ports', 
-        'Energy (kWh)', 
-        'Energy_Roll_3', 
-        'Energy_Roll_6', 
-        'Hour', 'DayOfWeek', 'Month'
-    ]
+    cols_to_scale = SCALED_COLS
+    
+    if scaler is None:
+        scaler = MinMaxScaler()
+        full_df[cols_to_scale] = scaler.fit_transform(full_df[cols_to_scale])
+    else:
+        full_df[cols_to_scale] = scaler.transform(full_df[cols_to_scale])
+    
+    return full_df, scaler, le
+
+# --- Incremental state ---
+# For every station the state keeps a watermark (grid_end, the station's last
+# 15-min interval) and a lookback window before it: the occupancy / load
+# cumsums at window_start and the raw events after it. An incremental run
+# re-runs the cumsum from that state over the window's events plus the new
+# ones, and rewrites the station's rows from window_start + MAX_ROLL intervals
+# (the rows before that have full rolling history and cannot change).
+DIGEST_BYTES = 4096 # Bytes before the processed offset that must be unchanged
+
+def _raw_mark(input_file, offset):
+    """How far into the raw file we got, plus enough to notice it being rewritten."""
+    with open(input_file, 'rb') as f:
+        header = f.readline()
+        start = max(offset - DIGEST_BYTES, 0)
+        f.seek(start)
+        digest = hashlib.sha1(f.read(offset - start)).hexdigest()
+    return {'offset': offset, 'header': header, 'digest': digest}
+
+def _station_events(all_events, stations):
+    """
+    Each station's events as (timestamp ns, port_change, power_change) arrays, in
+    the order reconstruct_station_grids accumulates them.
+    """
+    codes = pd.Categorical(all_events['station'], categories=stations).codes
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    ts = all_events['timestamp'].values.astype('datetime64[ns]').view(np.int64)[order]
+    port_change = all_events['port_change'].values[order].astype(np.float64)
+    power_change = all_events['power_change'].values[order].astype(np.float64)
+    
+    bounds = np.r_[0, np.flatnonzero(np.diff(codes)) + 1, len(codes)] if len(codes) else []
+    return {
+        stations[codes[start]]: (ts[start:end], port_change[start:end], power_change[start:end])
+        for start, end in zip(bounds[:-1], bounds[1:])
+    }
+
+def _window_state(ts, port_change, power_change, capacity):
+    # Watermark and lookback window of one station, from all its events so far
+    grid_end = -((-ts[-1]) // GRID_FREQ_NS) * GRID_FREQ_NS
+    window_start = max(ts[0] - ts[0] % GRID_FREQ_NS, grid_end - LOOKBACK.value)
+    split = np.searchsorted(ts, window_start, side='right')
+    
+    # np.cumsum adds sequentially, so continuing from these sums later gives the
+    # same floats as one cumsum over every event
+    return {
+        'capacity': int(capacity),
+        'grid_end': int(grid_end),
+        'window_start': int(window_start),
+        'base': (
+            float(np.cumsum(port_change[:split])[-1]) if split else 0.0,
+            float(np.cumsum(power_change[:split])[-1]) if split else 0.0,
+        ),
+        'events': (ts[split:].copy(), port_change[split:].copy(), power_change[split:].copy()),
+    }
+
+def _save_state(state_file, generation, mark, stations):
+    tmp = state_file + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump({'generation': generation, 'input': mark, 'stations': stations}, f)
+    os.replace(tmp, state_file)
+
+def process_data(input_file=INPUT_FILE, output_dir=OUTPUT_DIR, workers=WORKERS, write_csv=False, chunk_bytes=CHUNK_BYTES):
+    raw_size = os.path.getsize(input_file) # Later runs with --incremental start here
+    df = load_sessions(input_file, chunk_bytes)
+    
+    # 3. Port Availability Reconstruction & Energy Load Estimation
+    print("Reconstructing port availability and energy load...", flush=True)
+    all_events, station_capacity = build_events(df)
+    
+    # Process all stations in one grouped pass (names in order of first appearance)
+    unique_stations = np.asarray(df['Station Name'].unique(), dtype=object)
+    del df
+    
+    if workers > 1 and len(unique_stations) > 1:
+        # Stations are independent from here until scaling: grids and features per chunk
+        print(f"Processing {len(unique_stations)} stations on {workers} workers...")
+        full_df = build_station_frames_parallel(all_events, station_capacity, unique_stations, workers)
+    else:
+        print(f"Processing {len(unique_stations)} stations...")
+        full_df = reconstruct_station_grids(all_events, station_capacity, unique_stations)
+        
+        if full_df.empty:
+            print("No data to process.")
+            return
+        
+        print("Engineering features...")
+        full_df = engineer_features(full_df)
+    
+    if full_df.empty:
+        print("No data to process.")
+        return
+    
+    full_df, scaler, le = scale_and_encode(full_df)
     
-    scaler = MinMaxScaler()
-    full_df[cols_to_scale] = scaler.fit_transform(full_df[cols_to_scale])
+    processed_data_file = os.path.join(output_dir, os.path.basename(PROCESSED_DATA_FILE))
+    store_dir = os.path.join(output_dir, os.path.basename(STORE_DIR))
+    scaler_file = os.path.join(output_dir, os.path.basename(SCALER_FILE))
+    encoder_file = os.path.join(output_dir, os.path.basename(ENCODER_FILE))
+    state_file = os.path.join(output_dir, os.path.basename(STATE_FILE))
     
     # Save Artifacts
     print("Saving artifacts...")
-    with open(SCALER_FILE, 'wb') as f:
+    with open(scaler_file, 'wb') as f:
         pickle.dump(scaler, f)
         
-    with open(ENCODER_FILE, 'wb') as f:
+    with open(encoder_file, 'wb') as f:
         pickle.dump(le, f)
         
     # Save Data
@@ -237,9 +496,140 @@ def process_data():
     ]
     
     full_df = full_df[final_cols]
-    full_df.to_csv(PROCESSED_DATA_FILE, index=False)
+    manifest = write_store(full_df, store_dir)
+    print(f"Processing complete. Saved {manifest['rows']} rows for {len(manifest['stations'])} stations to {store_dir}")
+    
+    events = _station_events(all_events, list(unique_stations))
+    stations = {name: _window_state(*events[name], station_capacity[name]) for name in events}
+    _save_state(state_file, manifest['generation'], _raw_mark(input_file, raw_size), stations)
+    
+    # The old single-file format, for inspecting the data by hand
+    if write_csv:
+        full_df.to_csv(processed_data_file, index=False)
+        print(f"Saved {processed_data_file}")
+
+def process_data_incremental(input_file=INPUT_FILE, output_dir=OUTPUT_DIR, workers=WORKERS, chunk_bytes=CHUNK_BYTES):
+    """
+    Processes only the sessions appended to input_file since the last run and
+    rewrites the affected tail of their stations in the store. The scaler and
+    encoder stay frozen, so new values may fall slightly outside [0, 1].
+    
+    Falls back to a full rebuild (process_data) when the result could differ from one:
+    - no state yet, or the store was rebuilt without it
+    - the raw file was modified rather than appended to
+    - a new station (its encoding would shift the others)
+    - a port number above a station's known capacity (changes its past Available Ports)
+    - a session starting before the station's lookback window (plus MAX_ROLL intervals)
+    """
+    store_dir = os.path.join(output_dir, os.path.basename(STORE_DIR))
+    scaler_file = os.path.join(output_dir, os.path.basename(SCALER_FILE))
+    encoder_file = os.path.join(output_dir, os.path.basename(ENCODER_FILE))
+    state_file = os.path.join(output_dir, os.path.basename(STATE_FILE))
+    
+    def rebuild(reason):
+        print(f"Full rebuild needed: {reason}")
+        return process_data(input_file, output_dir, workers=workers, chunk_bytes=chunk_bytes)
+    
+    if not os.path.exists(state_file) or not os.path.exists(os.path.join(store_dir, 'manifest.json')):
+        return rebuild("no incremental state")
+    with open(state_file, 'rb') as f:
+        state = pickle.load(f)
+    if state['generation'] != ProcessedStore(store_dir).manifest['generation']:
+        return rebuild("the store was rewritten since the last run")
+    
+    mark = state['input']
+    if os.path.getsize(input_file) < mark['offset'] or _raw_mark(input_file, mark['offset']) != mark:
+        return rebuild("the raw file was modified, not appended to")
+    
+    with open(input_file, 'rb') as f:
+        f.seek(mark['offset'])
+        appended = f.read()
+    # Whole lines only: the exporter may be mid-append, and a partial last line would
+    # be parsed truncated and then skipped by the next run. It is read once complete.
+    appended = appended[:appended.rfind(b'\n') + 1]
+    if not appended.strip():
+        print("No new sessions.")
+        return
+    new_mark = _raw_mark(input_file, mark['offset'] + len(appended))
+    
+    df = load_sessions(io.BytesIO(mark['header'] + appended), chunk_bytes)
+    stations = state['stations']
+    if df.empty:
+        print("No valid new sessions.")
+        _save_state(state_file, state['generation'], new_mark, stations)
+        return
     
-    print(f"Processing complete. Saved to {PROCESSED_DATA_FILE}")
+    all_events, station_capacity = build_events(df)
+    del df
+    
+    unknown = [name for name in station_capacity.index if name not in stations]
+    if unknown:
+        return rebuild(f"new station(s): {', '.join(unknown)}")
+    grown = [name for name in station_capacity.index if station_capacity[name] > stations[name]['capacity']]
+    if grown:
+        return rebuild(f"more ports than before at: {', '.join(grown)}")
+    
+    affected = sorted(station_capacity.index)
+    rewrite_from = {name: stations[name]['window_start'] + MAX_ROLL * GRID_FREQ_NS for name in affected}
+    for name, (ts, _, _) in _station_events(all_events, affected).items():
+        if ts[0] <= rewrite_from[name]:
+            return rebuild(f"a session at {name} starts before {pd.Timestamp(rewrite_from[name])}")
+    
+    # Each station's window: its state at window_start as one synthetic event,
+    # then the window's events and the new ones
+    frames = []
+    for name in affected:
+        ts, port_change, power_change = stations[name]['events']
+        port_base, power_base = stations[name]['base']
+        frames.append(pd.DataFrame({
+            'timestamp': pd.to_datetime(np.r_[stations[name]['window_start'], ts]),
+            'station': name,
+            'power_change': np.r_[power_base, power_change],
+            'port_change': np.r_[port_base, port_change],
+        }))
+    frames.append(all_events) # After the window's events, so ties keep arrival order
+    window_events = pd.concat(frames, ignore_index=True).sort_values(by='timestamp', kind='stable')
+    
+    print(f"Reprocessing {len(affected)} stations from their watermarks...", flush=True)
+    capacity = pd.Series({name: stations[name]['capacity'] for name in affected})
+    full_df = engineer_features(reconstruct_station_grids(window_events, capacity, affected))
+    
+    # Rows before rewrite_from lack their full rolling history here and are already in the store
+    cut = full_df['Station Name'].map(rewrite_from).values.astype('datetime64[ns]')
+    full_df = full_df[full_df['timestamp'].values >= cut]
+    
+    with open(scaler_file, 'rb') as f:
+        scaler = pickle.load(f)
+    with open(encoder_file, 'rb') as f:
+        le = pickle.load(f)
+    full_df, _, _ = scale_and_encode(full_df, scaler, le)
+    
+    tails = {
+        int(frame['Station_ID_Encoded'].iat[0]): (np.datetime64(rewrite_from[name], 'ns'), frame)
+        for name, frame in full_df.groupby('Station Name', sort=False)
+    }
+    manifest = update_store(store_dir, tails)
+    
+    # Move every affected station's watermark and window forward
+    for name, events in _station_events(window_events, affected).items():
+        stations[name] = _window_state(*events, stations[name]['capacity'])
+    _save_state(state_file, manifest['generation'], new_mark, stations)
+    print(f"Incremental update complete. Rewrote {len(full_df)} rows for {len(tails)} stations ({manifest['rows']} rows in {store_dir})")
 
 if __name__ == "__main__":
-    process_data()
+    parser = argparse.ArgumentParser(description="Build the processed data store, scaler.pkl and encoders.pkl")
+    parser.add_argument('--input', default=INPUT_FILE)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--workers', type=int, default=WORKERS, help="Processes for the per-station stages (1 = serial)")
+    parser.add_argument('--csv', action='store_true', help="Also write processed_data.csv")
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES >> 20, help="Raw CSV megabytes parsed at a time")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only process sessions appended since the last run (keeps the fitted scaler)")
+    args = parser.parse_args()
+    if args.incremental and args.csv:
+        parser.error("--csv is only written by full rebuilds")
+    
+    if args.incremental:
+        process_data_incremental(args.input, args.output_dir, workers=args.workers, chunk_bytes=args.chunk_mb << 20)
+    else:
+        process_data(args.input, args.output_dir, workers=args.workers, write_csv=args.csv, chunk_bytes=args.chunk_mb << 20)
@@ -1,13 +1,20 @@
-import pandas as pd
 import os
+import sys
 
-PROCESSED_DATA_FILE = r'e:\EVFlow AI\data\processed\processed_data.csv'
+from ml.store import ProcessedStore
 
-if not os.path.exists(PROCESSED_DATA_FILE):
-    print("File not found!")
-    exit(1)
+STORE_DIR = r'e:\EVFlow AI\data\processed\store'
 
-df = pd.read_csv(PROCESSED_DATA_FILE)
+if not os.path.exists(os.path.join(STORE_DIR, 'manifest.json')):
+    print("Store not found!")
+    sys.exit(1)
+
+store = ProcessedStore(STORE_DIR)
+print(f"Stations: {len(store.stations)}, Rows: {store.rows}")
+for info in store.manifest['stations']:
+    print(f"  {info['id']:>4} {info['name']}: {info['rows']} rows, {info['start']} .. {info['end']}")
+
+df = store.read()
 print(f"Shape: {df.shape}")
 print(f"Columns: {df.columns.tolist()}")
 print(f"Nulls: \n{df.isnull().sum()}")